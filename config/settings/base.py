@@ -304,3 +304,25 @@ SOCIALACCOUNT_ADAPTER = "kicoma.users.adapters.SocialAccountAdapter"
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 PAGINATE_BY = 30
+# about page statistics, tables with more estimated rows are not counted exactly
+STATISTICS_CACHE_TIMEOUT = 300
+STATISTICS_EXACT_COUNT_LIMIT = 100000
+STATISTICS_WORKERS = 4
+# merge imports run in a background thread, the progress is kept in the cache
+IMPORT_IN_BACKGROUND = True
+# rendered PDF documents are cached on disk by the content of the page, an empty directory disables the cache
+PDF_CACHE_DIR = env("PDF_CACHE_DIR", default=str(ROOT_DIR / "pdfcache"))
+PDF_CACHE_MAX_SIZE = env.int("PDF_CACHE_MAX_SIZE", default=100 * 1024 * 1024)
+# wkhtmltopdf runs in a pool of threads of each web worker, a request waits PDF_RENDER_TIMEOUT seconds
+# (at most 3) and longer renderings are picked up on a job page
+PDF_RENDER_WORKERS = env.int("PDF_RENDER_WORKERS", default=2)
+PDF_RENDER_QUEUE_SIZE = env.int("PDF_RENDER_QUEUE_SIZE", default=20)
+PDF_RENDER_TIMEOUT = 2
+# PDF backend of the document types stockissue, stockreceipt, stocktake and dailymenu, wkhtmltopdf or reportlab
+PDF_BACKENDS = {}
+# TrueType fonts of the reportlab backend
+PDF_FONT = env("PDF_FONT", default="/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+PDF_FONT_BOLD = env("PDF_FONT_BOLD", default="/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf")
+# the print_batch command converts the documents in this many processes, the web endpoint uses the PDF renderer
+# threads
+PDF_BATCH_WORKERS = env.int("PDF_BATCH_WORKERS", default=4)
@@ -49,3 +49,10 @@ EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
 
 # Your stuff...
 # ------------------------------------------------------------------------------
+# worker threads use their own database connections which do not see the test transaction
+STATISTICS_WORKERS = 1
+IMPORT_IN_BACKGROUND = False
+# rendered PDF documents are not cached unless a test enables it
+PDF_CACHE_DIR = ""
+# print_batch converts the documents in the test process where the converter can be patched
+PDF_BATCH_WORKERS = 1
@@ -0,0 +1,197 @@
+import json
+import os
+
+from django.db.models import F
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .export import CHUNK_SIZE
+from .functions import RoundTo, convert_units_expression
+from .models import HistoricalArticle, StockIssueArticle, StockReceiptArticle
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # analytics export is optional
+    pyarrow = None
+
+# file name suffix of the supported formats
+FORMATS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+STATE_FILE = '_state.json'
+
+
+class AnalyticsError(Exception):
+    pass
+
+
+# approved stock issue lines, amounts and prices are in the unit of the article,
+# the watermark is the approval time which is set once and does not change with later edits
+def stock_issue_rows(after):
+    lines = StockIssueArticle.objects.filter(stock_issue__approved=True, stock_issue__approved_at__isnull=False)
+    if after is not None:
+        lines = lines.filter(stock_issue__approved_at__gt=after)
+    amount = convert_units_expression('amount', 'unit', 'article__unit')
+    return lines.order_by('stock_issue__date_approved', 'id').values(
+        'id', 'article_id', document=F('stock_issue_id'), date=F('stock_issue__date_approved'),
+        month=TruncMonth('stock_issue__date_approved'), article_name=F('article__article'),
+        article_unit=F('article__unit'), converted_amount=RoundTo(amount, 4),
+        price=RoundTo(StockIssueArticle.total_price_expression(), 2), watermark=F('stock_issue__approved_at'))
+
+
+# approved stock receipt lines, amounts and prices are in the unit of the article
+def stock_receipt_rows(after):
+    lines = StockReceiptArticle.objects.filter(stock_receipt__approved=True, stock_receipt__approved_at__isnull=False)
+    if after is not None:
+        lines = lines.filter(stock_receipt__approved_at__gt=after)
+    amount = convert_units_expression('amount', 'unit', 'article__unit')
+    return lines.order_by('stock_receipt__date_approved', 'id').values(
+        'id', 'article_id', document=F('stock_receipt_id'), date=F('stock_receipt__date_approved'),
+        month=TruncMonth('stock_receipt__date_approved'), article_name=F('article__article'),
+        article_unit=F('article__unit'), converted_amount=RoundTo(amount, 4),
+        price=StockReceiptArticle.total_price_expression(), watermark=F('stock_receipt__approved_at'))
+
+
+def article_history_rows(after):
+    history = HistoricalArticle.objects.all()
+    if after is not None:
+        history = history.filter(history_id__gt=after)
+    return history.order_by('history_date', 'history_id').values(
+        'history_id', 'history_date', 'history_type', 'history_user_id', 'history_change_reason', 'on_stock',
+        'total_price', 'last_price', article_id=F('id'), month=TruncMonth('history_date'),
+        article_name=F('article'), article_unit=F('unit'), watermark=F('history_id'))
+
+
+def movement_schema():
+    return pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('document', pyarrow.int64()),
+        ('date', pyarrow.date32()),
+        ('article_id', pyarrow.int64()),
+        ('article', pyarrow.string()),
+        ('unit', pyarrow.string()),
+        ('amount', pyarrow.decimal128(14, 4)),
+        ('price', pyarrow.decimal128(14, 2)),
+    ])
+
+
+def history_schema():
+    return pyarrow.schema([
+        ('history_id', pyarrow.int64()),
+        ('history_date', pyarrow.timestamp('us', tz='UTC')),
+        ('history_type', pyarrow.string()),
+        ('history_user_id', pyarrow.int64()),
+        ('history_change_reason', pyarrow.string()),
+        ('article_id', pyarrow.int64()),
+        ('article', pyarrow.string()),
+        ('unit', pyarrow.string()),
+        ('on_stock', pyarrow.decimal128(10, 2)),
+        ('total_price', pyarrow.decimal128(10, 2)),
+        ('last_price', pyarrow.decimal128(12, 2)),
+    ])
+
+
+# dataset name: (rows after the watermark, schema, watermark from its JSON value)
+DATASETS = {
+    'stockissuearticle': (stock_issue_rows, movement_schema, parse_datetime),
+    'stockreceiptarticle': (stock_receipt_rows, movement_schema, parse_datetime),
+    'historicalarticle': (article_history_rows, history_schema, int),
+}
+
+
+def check_available(dataset, file_format):
+    if pyarrow is None:
+        raise AnalyticsError('Export pro analýzy vyžaduje knihovnu pyarrow')
+    if dataset not in DATASETS:
+        raise AnalyticsError('Neznámá data {}'.format(dataset))
+    if file_format not in FORMATS:
+        raise AnalyticsError('Nepodporovaný formát {}'.format(file_format))
+
+
+def open_writer(sink, schema, file_format):
+    if file_format == 'parquet':
+        return pyarrow.parquet.ParquetWriter(sink, schema)
+    return pyarrow.ipc.new_file(sink, schema)
+
+
+def row_values(row):
+    row = dict(row, article=row['article_name'], unit=row['article_unit'])
+    if 'converted_amount' in row:
+        row['amount'] = row['converted_amount']
+    return row
+
+
+# rows grouped by month in batches of CHUNK_SIZE as (month, record batch, watermark of the batch)
+def month_batches(dataset, after=None):
+    rows_function, schema_function, _ = DATASETS[dataset]
+    schema = schema_function()
+    batch, month, watermark = [], None, None
+    for row in rows_function(after).iterator(chunk_size=CHUNK_SIZE):
+        row_month = row['month'].strftime('%Y-%m')
+        if batch and (row_month != month or len(batch) == CHUNK_SIZE):
+            yield month, pyarrow.RecordBatch.from_pylist(batch, schema=schema), watermark
+            batch = []
+        month = row_month
+        watermark = row['watermark'] if watermark is None else max(watermark, row['watermark'])
+        batch.append(row_values(row))
+    if batch:
+        yield month, pyarrow.RecordBatch.from_pylist(batch, schema=schema), watermark
+
+
+def watermark_value(watermark):
+    return watermark.isoformat() if hasattr(watermark, 'isoformat') else watermark
+
+
+# rows after the watermark in one file with a month column, returns the number of rows and the new watermark
+def export_file(dataset, sink, file_format='parquet', after=None):
+    check_available(dataset, file_format)
+    schema = DATASETS[dataset][1]().append(pyarrow.field('month', pyarrow.string()))
+    rows, watermark = 0, after
+    with open_writer(sink, schema, file_format) as writer:
+        for month, batch, batch_watermark in month_batches(dataset, after):
+            months = pyarrow.array([month] * batch.num_rows, pyarrow.string())
+            writer.write_table(pyarrow.Table.from_batches([batch]).append_column('month', months))
+            rows += batch.num_rows
+            watermark = batch_watermark if watermark is None else max(watermark, batch_watermark)
+    return rows, watermark_value(watermark)
+
+
+def read_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+# append the rows since the last export to directory/dataset/month=YYYY-MM/part-<time>.<format>,
+# the watermark of the last export is kept in directory/dataset/_state.json
+def export_partitions(dataset, directory, file_format='parquet', full=False):
+    check_available(dataset, file_format)
+    dataset_directory = os.path.join(directory, dataset)
+    state_path = os.path.join(dataset_directory, STATE_FILE)
+    state = {} if full else read_state(state_path)
+    after = None if state.get('watermark') is None else DATASETS[dataset][2](state['watermark'])
+    part = 'part-{}{}'.format(timezone.now().strftime('%Y%m%d%H%M%S%f'), FORMATS[file_format])
+    writers = {}
+    rows, watermark = 0, after
+    try:
+        for month, batch, batch_watermark in month_batches(dataset, after):
+            if month not in writers:
+                month_directory = os.path.join(dataset_directory, 'month=' + month)
+                os.makedirs(month_directory, exist_ok=True)
+                writers[month] = open_writer(os.path.join(month_directory, part), batch.schema, file_format)
+            writers[month].write_table(pyarrow.Table.from_batches([batch]))
+            rows += batch.num_rows
+            watermark = batch_watermark if watermark is None else max(watermark, batch_watermark)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    os.makedirs(dataset_directory, exist_ok=True)
+    with open(state_path, 'w') as f:
+        json.dump({'watermark': watermark_value(watermark), 'format': file_format,
+                   'exported': timezone.now().isoformat()}, f)
+    return rows, len(writers)
@@ -0,0 +1,416 @@
+import decimal
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import uuid
+
+from django.apps import apps
+from django.conf import settings
+from django.core import serializers
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction
+from django.utils import timezone
+from psycopg2.extras import execute_values
+
+from .admin import ArticleResource
+from .export import export_chunks, export_models, zstandard
+from .models import Allergen, Article, Recipe
+
+BATCH_SIZE = 1000
+JOB_TIMEOUT = 24 * 60 * 60
+READ_SIZE = 64 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# columns of the article spreadsheet which are not imported, the article is identified by its name
+ARTICLE_IMPORT_EXCLUDE = ['id', 'created', 'modified', 'last_price', 'allergen_mask']
+WHITESPACE = re.compile(r'\s*')
+
+
+class DataImportError(Exception):
+    pass
+
+
+# text stream of an uploaded file, gzip and zstd compressed files are recognized by the content
+def open_upload(path):
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if magic == ZSTD_MAGIC:
+        if zstandard is None:
+            raise DataImportError('Soubor je komprimovaný pomocí zstd, který není nainstalován')
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+        return io.TextIOWrapper(io.BufferedReader(reader), encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+# objects of a dumpdata or export_data JSON file one by one, only the object being parsed is kept in memory
+def read_objects(path):
+    decoder = json.JSONDecoder()
+    with open_upload(path) as f:
+        buffer, position, state = '', 0, 'start'
+        while True:
+            position = WHITESPACE.match(buffer, position).end()
+            if position == len(buffer):
+                buffer, position = f.read(READ_SIZE), 0
+                if not buffer:
+                    raise DataImportError('Neočekávaný konec souboru')
+                continue
+            char = buffer[position]
+            if state == 'start':
+                if char != '[':
+                    raise DataImportError('Soubor neobsahuje seznam objektů')
+                position, state = position + 1, 'first'
+            elif char == ']' and state in ('first', 'next'):
+                return
+            elif state == 'next':
+                if char != ',':
+                    raise DataImportError('Chybný formát souboru na znaku {!r}'.format(char))
+                position, state = position + 1, 'object'
+            else:
+                try:
+                    obj, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError as e:
+                    # the object continues in the next part of the file, bigger objects are read faster
+                    data = f.read(max(READ_SIZE, len(buffer) - position))
+                    if not data:
+                        raise DataImportError('Chybný formát souboru: {}'.format(e))
+                    buffer, position = buffer[position:] + data, 0
+                    continue
+                if not isinstance(obj, dict) or 'model' not in obj:
+                    raise DataImportError('Chybný formát objektu {}'.format(obj))
+                yield obj
+                state = 'next'
+
+
+# hash of the serialized fields, values are compared as they are written to JSON
+def content_hash(fields, m2m_names):
+    fields = dict(fields)
+    for name in m2m_names:
+        if name in fields:
+            fields[name] = sorted(fields[name])
+    content = json.dumps(fields, cls=DjangoJSONEncoder, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def existing_hashes(model, m2m_names):
+    serializer = serializers.get_serializer('python')()
+    hashes = {}
+    for chunk in export_chunks([model]):
+        for obj in serializer.serialize(chunk):
+            fields = json.loads(json.dumps(obj['fields'], cls=DjangoJSONEncoder))
+            hashes[obj['pk']] = content_hash(fields, m2m_names)
+    return hashes
+
+
+def apply_batch(model, objects, update):
+    deserialized = list(serializers.deserialize('python', objects, ignorenonexistent=True))
+    instances = [obj.object for obj in deserialized]
+    fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+    if update:
+        model._base_manager.bulk_update(instances, fields, batch_size=BATCH_SIZE)
+    else:
+        # bulk_create sets auto_now and auto_now_add fields to the current time, the imported ones are restored
+        timestamps = [field.attname for field in model._meta.concrete_fields
+                      if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+        values = [[getattr(instance, name) for name in timestamps] for instance in instances]
+        model._base_manager.bulk_create(instances, batch_size=BATCH_SIZE)
+        if timestamps:
+            for instance, instance_values in zip(instances, values):
+                for name, value in zip(timestamps, instance_values):
+                    setattr(instance, name, value)
+            model._base_manager.bulk_update(instances, timestamps, batch_size=BATCH_SIZE)
+    for field in model._meta.many_to_many:
+        through = field.remote_field.through
+        source = field.m2m_field_name()
+        target = field.m2m_reverse_field_name()
+        pks = [obj.object.pk for obj in deserialized]
+        if update:
+            through._base_manager.filter(**{source + '__in': pks}).delete()
+        through._base_manager.bulk_create([
+            through(**{source + '_id': obj.object.pk, target + '_id': related_pk})
+            for obj in deserialized for related_pk in obj.m2m_data.get(field.name, [])], batch_size=BATCH_SIZE)
+
+
+def reset_sequences(models):
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+
+
+def update_allergens(article_ids=None):
+    try:
+        Article.update_allergens(article_ids)
+    except ValidationError as e:
+        raise DataImportError(e.messages[0])
+
+
+# insert the objects in batches per model into empty tables, the objects are expected in the dependency order
+# of dumpdata and the foreign keys are checked at the end of the transaction
+def load_objects(objects):
+    batches = {}
+    counts = {}
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+        for obj in objects:
+            try:
+                model = apps.get_model(obj['model'])
+            except (LookupError, ValueError):
+                raise DataImportError('Neznámý model {}'.format(obj['model']))
+            batch = batches.setdefault(model, [])
+            batch.append(obj)
+            counts[model._meta.label_lower] = counts.get(model._meta.label_lower, 0) + 1
+            if len(batch) == BATCH_SIZE:
+                apply_batch(model, batch, False)
+                batches[model] = []
+        for model, batch in batches.items():
+            if batch:
+                apply_batch(model, batch, False)
+        reset_sequences(list(batches))
+        Recipe.update_prices()
+        update_allergens()
+    return counts
+
+
+# apply the differences between the uploaded objects and the database by primary key and content hash,
+# read is called for every pass over the uploaded objects, progress(done, total, model label) is optional
+def merge_import(read, progress=None):
+    models = export_models()
+    labels = {model._meta.label_lower: model for model in models}
+    incoming = {label: {} for label in labels}
+    for obj in read():
+        model = labels.get(obj['model'])
+        if model is not None:
+            m2m_names = [field.name for field in model._meta.many_to_many]
+            incoming[obj['model']][model._meta.pk.to_python(obj['pk'])] = content_hash(obj['fields'], m2m_names)
+    result = {}
+    with transaction.atomic():
+        changes = {}
+        for done, model in enumerate(models):
+            label = model._meta.label_lower
+            if progress:
+                progress(done, len(models) * 2, label)
+            m2m_names = [field.name for field in model._meta.many_to_many]
+            existing = existing_hashes(model, m2m_names)
+            changes[label] = {pk for pk, content in incoming[label].items() if existing.get(pk) != content}
+            inserts = {pk for pk in changes[label] if pk not in existing}
+            deletes = set(existing.keys()) - set(incoming[label].keys())
+            result[label] = {'inserted': len(inserts), 'updated': len(changes[label]) - len(inserts),
+                             'deleted': len(deletes)}
+            changes[label] = (inserts, changes[label] - inserts, deletes)
+        # the deletes go first in the reverse dependency order, so that a unique name of a deleted row can be used
+        # by an inserted or updated one
+        for done, model in enumerate(reversed(models)):
+            if progress:
+                progress(len(models) + done, len(models) * 2, model._meta.label_lower)
+            deletes = changes[model._meta.label_lower][2]
+            if deletes:
+                model._base_manager.filter(pk__in=deletes).delete()
+        # updated rows removed by the cascade of the deletes are inserted again
+        for model in models:
+            label = model._meta.label_lower
+            inserts, updates, deletes = changes[label]
+            if updates:
+                remaining = set(model._base_manager.filter(pk__in=updates).values_list('pk', flat=True))
+                changes[label] = (inserts | (updates - remaining), remaining, deletes)
+        batches = {}
+        for obj in read():
+            label = obj['model']
+            if label not in labels:
+                continue
+            model = labels[label]
+            pk = model._meta.pk.to_python(obj['pk'])
+            inserts, updates, _ = changes[label]
+            for update, pks in ((False, inserts), (True, updates)):
+                if pk in pks:
+                    batch = batches.setdefault((model, update), [])
+                    batch.append(obj)
+                    if len(batch) == BATCH_SIZE:
+                        apply_batch(model, batch, update)
+                        batches[(model, update)] = []
+        # objects are written in the dependency order of the models, the foreign keys are checked at commit
+        for model in models:
+            for update in (False, True):
+                if batches.get((model, update)):
+                    apply_batch(model, batches[(model, update)], update)
+        reset_sequences(models)
+        Recipe.update_prices()
+        update_allergens()
+    return result
+
+
+# convert a spreadsheet cell to the value of the article field, raises ValidationError
+def clean_article_value(field, value, allergen_ids):
+    if isinstance(value, str):
+        value = value.strip()
+    if value == '':
+        value = None
+    if field.many_to_many:
+        try:
+            ids = {int(float(pk)) for pk in str(value or '').split(',') if pk.strip()}
+        except ValueError:
+            raise ValidationError('Chybný seznam alergenů {}'.format(value))
+        if ids - allergen_ids:
+            raise ValidationError('Neznámé alergeny {}'.format(', '.join(str(pk) for pk in sorted(ids - allergen_ids))))
+        return sorted(ids)
+    if isinstance(field, models.DecimalField) and value is not None:
+        try:
+            value = decimal.Decimal(str(value)).quantize(decimal.Decimal(1).scaleb(-field.decimal_places))
+        except decimal.InvalidOperation:
+            raise ValidationError('Chybné číslo {}'.format(value))
+    elif isinstance(field, models.CharField) and value is not None:
+        value = str(value)
+    return field.clean(value, None)
+
+
+# check all rows of an ArticleResource spreadsheet and compare them with the articles of the same name
+def diff_articles(dataset):
+    resource = ArticleResource()
+    columns = {name: dataset.headers.index(field.column_name) for name, field in resource.fields.items()
+               if field.column_name in (dataset.headers or []) and name not in ARTICLE_IMPORT_EXCLUDE}
+    if 'article' not in columns:
+        raise DataImportError('Soubor neobsahuje sloupec article')
+    fields = {name: Article._meta.get_field(name) for name in columns}
+    allergen_ids = set(Allergen.objects.values_list('id', flat=True)) if 'allergen' in columns else set()
+    rows = []
+    for number, values in enumerate(dataset, start=2):
+        row = {'number': number, 'article': values[columns['article']], 'values': {}, 'changes': {}, 'errors': []}
+        for name, index in columns.items():
+            try:
+                row['values'][name] = clean_article_value(fields[name], values[index], allergen_ids)
+            except ValidationError as e:
+                row['errors'].append('{}: {}'.format(fields[name].verbose_name, ' '.join(e.messages)))
+        if 'article' in row['values']:
+            row['article'] = row['values']['article']
+        rows.append(row)
+
+    names = [row['article'] for row in rows if not row['errors']]
+    plain_columns = [name for name in columns if not fields[name].many_to_many]
+    existing = {values['article']: values for values in Article.objects.filter(article__in=names).values(
+        'id', *plain_columns)}
+    if 'allergen' in columns:
+        for values in existing.values():
+            values['allergen'] = []
+        for article, allergen in Article.allergen.through.objects.filter(article__article__in=names).order_by(
+                'allergen').values_list('article__article', 'allergen'):
+            existing[article]['allergen'].append(allergen)
+    required = [field for field in Article._meta.concrete_fields
+                if field.name not in columns and field.name not in ARTICLE_IMPORT_EXCLUDE]
+    seen = set()
+    for row in rows:
+        if row['errors']:
+            pass
+        elif row['article'] in seen:
+            row['errors'].append('Zboží {} je v souboru vícekrát'.format(row['article']))
+        elif row['article'] in existing:
+            old = existing[row['article']]
+            row['id'] = old['id']
+            row['changes'] = {name: (old[name], value) for name, value in row['values'].items() if old[name] != value}
+        else:
+            row['changes'] = {name: (None, value) for name, value in row['values'].items()}
+            for field in required:
+                try:
+                    field.clean(field.get_default(), None)
+                except ValidationError as e:
+                    row['errors'].append('{}: {}'.format(field.verbose_name, ' '.join(e.messages)))
+        seen.add(row['article'])
+        if row['errors']:
+            row['status'] = 'error'
+        elif 'id' not in row:
+            row['status'] = 'new'
+        else:
+            row['status'] = 'update' if row['changes'] else 'skip'
+    return rows
+
+
+# INSERT ... ON CONFLICT (article) of the rows, columns missing in the spreadsheet keep their values
+def upsert_articles(rows):
+    names = [name for name in rows[0]['values'] if not Article._meta.get_field(name).many_to_many]
+    fields = [field for field in Article._meta.concrete_fields if not field.primary_key]
+    now = timezone.now()
+    values = []
+    for row in rows:
+        values.append([row['values'][field.name] if field.name in names
+                       else now if field.name in ('created', 'modified') else field.get_default() for field in fields])
+    quote = connection.ops.quote_name
+    article = quote(Article._meta.get_field('article').column)
+    sql = 'INSERT INTO {} ({}) VALUES %s ON CONFLICT ({}) DO UPDATE SET {} RETURNING {}, {}'.format(
+        quote(Article._meta.db_table), ', '.join(quote(field.column) for field in fields), article,
+        ', '.join('{0} = EXCLUDED.{0}'.format(quote(Article._meta.get_field(name).column))
+                  for name in names + ['modified'] if name != 'article'),
+        article, quote(Article._meta.pk.column))
+    with connection.cursor() as cursor:
+        return dict(execute_values(cursor, sql, values, page_size=BATCH_SIZE, fetch=True))
+
+
+# import the articles of an ArticleResource spreadsheet, nothing is written when a row is invalid
+def import_articles(dataset, user=None):
+    rows = diff_articles(dataset)
+    totals = {status: len([row for row in rows if row['status'] == status])
+              for status in ('new', 'update', 'skip', 'error')}
+    changed = [row for row in rows if row['status'] in ('new', 'update')]
+    if totals['error'] or not changed:
+        return {'rows': rows, 'totals': totals}
+    with transaction.atomic():
+        ids = upsert_articles(changed)
+        for row in changed:
+            row['id'] = ids[row['article']]
+        allergen_rows = [row for row in changed if 'allergen' in row['changes']]
+        if allergen_rows:
+            through = Article.allergen.through
+            through.objects.filter(article__in=[row['id'] for row in allergen_rows]).delete()
+            through.objects.bulk_create([through(article_id=row['id'], allergen_id=allergen)
+                                         for row in allergen_rows for allergen in row['values']['allergen']])
+            update_allergens([row['id'] for row in allergen_rows])
+        for update in (False, True):
+            Article.history.bulk_history_create(
+                Article.objects.filter(pk__in=[row['id'] for row in changed if (row['status'] == 'update') == update]),
+                update=update, default_user=user, default_change_reason='Import zboží')
+        Recipe.update_prices_for_articles(list(ids.values()))
+    return {'rows': rows, 'totals': totals}
+
+
+def job_key(job_id):
+    return 'kitchen_import_' + job_id
+
+
+def get_job(job_id):
+    return cache.get(job_key(job_id))
+
+
+def set_job(job_id, **job):
+    cache.set(job_key(job_id), job, JOB_TIMEOUT)
+
+
+def run_import_job(job_id, path, background):
+    def progress(done, total, label):
+        set_job(job_id, state='running', done=done, total=total, model=label)
+
+    try:
+        result = merge_import(lambda: read_objects(path), progress)
+        set_job(job_id, state='done', result=result)
+    except Exception as e:
+        set_job(job_id, state='error', message=str(e))
+    finally:
+        os.remove(path)
+        if background:
+            connection.close()
+
+
+# merge import of the uploaded file, the file is removed when the job finishes
+def start_import_job(path):
+    job_id = uuid.uuid4().hex
+    set_job(job_id, state='queued')
+    if settings.IMPORT_IN_BACKGROUND:
+        threading.Thread(target=run_import_job, args=(job_id, path, True), daemon=True).start()
+    else:
+        run_import_job(job_id, path, False)
+    return job_id
@@ -0,0 +1,79 @@
+import json
+import zlib
+
+from django.apps import apps
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import prefetch_related_objects
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+CHUNK_SIZE = 2000
+
+# file name suffix of the supported compressions
+COMPRESSIONS = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+
+def available_compressions():
+    return [compression for compression in COMPRESSIONS if compression != 'zstd' or zstandard is not None]
+
+
+# kitchen models in the same order as dumpdata, objects referenced by natural keys first
+def export_models():
+    return serializers.sort_dependencies([(apps.get_app_config('kitchen'), None)])
+
+
+# instances of the queryset in chunks of CHUNK_SIZE, the lookups are prefetched per chunk
+def queryset_chunks(queryset, prefetch=()):
+    chunk = []
+    for obj in queryset.iterator(chunk_size=CHUNK_SIZE):
+        chunk.append(obj)
+        if len(chunk) == CHUNK_SIZE:
+            prefetch_related_objects(chunk, *prefetch)
+            yield chunk
+            chunk = []
+    if chunk:
+        prefetch_related_objects(chunk, *prefetch)
+        yield chunk
+
+
+# model instances in chunks of CHUNK_SIZE, many to many relations are prefetched per chunk
+def export_chunks(models):
+    for model in models:
+        m2m_fields = [field.name for field in model._meta.many_to_many]
+        yield from queryset_chunks(model._default_manager.order_by(model._meta.pk.name), m2m_fields)
+
+
+# the same JSON as dumpdata without indentation, produced piece by piece
+def export_json(models=None):
+    serializer = serializers.get_serializer('python')()
+    separator = '['
+    for chunk in export_chunks(export_models() if models is None else models):
+        objects = serializer.serialize(chunk)
+        yield separator + ', '.join(json.dumps(obj, cls=DjangoJSONEncoder, ensure_ascii=False) for obj in objects)
+        separator = ', '
+    yield '[]' if separator == '[' else ']'
+
+
+def compress(chunks, compression):
+    if compression is None:
+        yield from (chunk.encode() for chunk in chunks)
+        return
+    if compression == 'gzip':
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    elif compression == 'zstd' and zstandard is not None:
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        raise ValueError('Unsupported compression: {}'.format(compression))
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
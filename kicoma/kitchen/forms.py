@@ -186,6 +186,8 @@ class DailyMenuPrintForm(forms.ModelForm):
 
 
 class DailyMenuCateringUnitForm(forms.ModelForm):
+    period = forms.ChoiceField(choices=(('day', 'Den'), ('week', 'Týden'), ('month', 'Měsíc')), required=False,
+                               label='Období', help_text='Den, týden nebo měsíc, do kterého datum patří')
 
     class Meta:
         model = DailyMenu
@@ -202,6 +204,7 @@ class DailyMenuCateringUnitForm(forms.ModelForm):
         self.helper.layout = Layout(
             Row(
                 Column('date', css_class='col-md-2'),
+                Column('period', css_class='col-md-2'),
             )
         )
 
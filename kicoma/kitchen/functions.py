@@ -1,26 +1,64 @@
+from django.db.models import Case, DecimalField, F, Func, Q, When
 from django.forms import ValidationError
 
+# supported conversions between units as (multiplier, divisor), units are defined in .models.UNIT
+UNIT_CONVERSIONS = {
+    ('kg', 'g'): (1000, 1),
+    ('g', 'kg'): (1, 1000),
+    ('l', 'ml'): (100, 1),
+    ('ml', 'l'): (1, 100),
+}
+
 
 # convert article amount or price between units, units are defined in .models.UNIT
 def convert_units(number, unit_in, unit_out):
     if unit_in == unit_out:
         return number
-    if unit_in == 'kg' and unit_out == 'g':
-        return number*1000
-    if unit_in == 'g' and unit_out == 'kg':
-        return number/1000
-    if unit_in == 'l' and unit_out == 'ml':
-        return number*100
-    if unit_in == 'ml' and unit_out == 'l':
-        return number/100
-    raise ValidationError("Není možné provést konverzi {} {} na {}".format(number, unit_in, unit_out))
-
-
-# returns total RecipeArticle price, RecipeArticle amount is converted using Article unit
-def total_recipe_article_price(recipe_articles, norm_amount):
-    total_price = 0
-    for recipe_article in recipe_articles:
-        converted_amount = convert_units(recipe_article.amount, recipe_article.unit, recipe_article.article.unit)
-        recipe_article_price = converted_amount * recipe_article.average_unit_price * norm_amount
-        total_price += recipe_article_price
-    return total_price
+    if (unit_in, unit_out) not in UNIT_CONVERSIONS:
+        raise ValidationError("Není možné provést konverzi {} {} na {}".format(number, unit_in, unit_out))
+    multiplier, divisor = UNIT_CONVERSIONS[(unit_in, unit_out)]
+    return number * multiplier / divisor
+
+
+# convert lists of amounts or prices, units_in and units_out are lists of the same length or a single unit,
+# the conversion of every pair of units is looked up and validated only once
+def convert_units_array(numbers, units_in, units_out):
+    if isinstance(units_in, str):
+        units_in = [units_in] * len(numbers)
+    if isinstance(units_out, str):
+        units_out = [units_out] * len(numbers)
+    conversions = {}
+    converted = []
+    for number, unit_in, unit_out in zip(numbers, units_in, units_out):
+        if (unit_in, unit_out) not in conversions:
+            convert_units(number, unit_in, unit_out)
+            conversions[(unit_in, unit_out)] = UNIT_CONVERSIONS.get((unit_in, unit_out))
+        conversion = conversions[(unit_in, unit_out)]
+        converted.append(number if conversion is None else number * conversion[0] / conversion[1])
+    return converted
+
+
+# database expression for convert_units, number is an expression or a field name and units are field names
+# rows with units which cannot be converted are evaluated as NULL
+def convert_units_expression(number, unit_in, unit_out):
+    if isinstance(number, str):
+        number = F(number)
+    whens = [When(Q(**{unit_in: F(unit_out)}), then=number)]
+    for (convert_in, convert_out), (multiplier, divisor) in UNIT_CONVERSIONS.items():
+        whens.append(When(Q(**{unit_in: convert_in, unit_out: convert_out}), then=number * multiplier / divisor))
+    return Case(*whens, output_field=DecimalField())
+
+
+# filter for rows where unit_in cannot be converted to unit_out, units are field names
+def incorrect_units(unit_in, unit_out):
+    compatible = Q(**{unit_in: F(unit_out)})
+    for convert_in, convert_out in UNIT_CONVERSIONS:
+        compatible |= Q(**{unit_in: convert_in, unit_out: convert_out})
+    return ~compatible
+
+
+# ROUND(number, decimal places), Round in Django 3.2 does not support the precision
+class RoundTo(Func):
+    function = 'ROUND'
+    arity = 2
+    output_field = DecimalField()
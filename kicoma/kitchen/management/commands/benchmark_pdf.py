@@ -0,0 +1,63 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.template.response import TemplateResponse
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from kicoma.kitchen.models import DailyMenu, StockIssue, StockReceipt
+from kicoma.kitchen.pdf import BACKENDS, render_html
+
+
+# url and query of the newest document of each type
+def document_urls():
+    urls = {'stocktake': (reverse('kitchen:printStockArticles'), {})}
+    stock_issue = StockIssue.objects.order_by('-id').first()
+    if stock_issue:
+        urls['stockissue'] = (reverse('kitchen:printStockIssue', kwargs={'pk': stock_issue.pk}), {})
+    stock_receipt = StockReceipt.objects.order_by('-id').first()
+    if stock_receipt:
+        urls['stockreceipt'] = (reverse('kitchen:printStockReceipt', kwargs={'pk': stock_receipt.pk}), {})
+    daily_menu = DailyMenu.objects.order_by('-date').first()
+    if daily_menu:
+        urls['dailymenu'] = (reverse('kitchen:printDailyMenu'),
+                             {'date': daily_menu.date.strftime('%d.%m.%Y'), 'meal_group': ''})
+    return urls
+
+
+class Command(BaseCommand):
+    help = 'Porovná rychlost PDF backendů na nejnovějších dokumentech v databázi'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10, help='Počet vytvoření každého dokumentu')
+        parser.add_argument('--backend', action='append', choices=list(BACKENDS),
+                            help='Porovnávané backendy, výchozí jsou všechny')
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.filter(is_active=True).order_by('-is_superuser', 'id').first()
+        for document, (url, query) in document_urls().items():
+            # the page is rendered as HTML once, only the conversion to PDF is measured
+            request = RequestFactory().get(url, dict(query, **{'as': 'html'}))
+            request.user = user
+            match = resolve(url)
+            response = match.func(request, *match.args, **match.kwargs)
+            if not isinstance(response, TemplateResponse):
+                self.stdout.write('{}: dokument nelze vytvořit'.format(document))
+                continue
+            context = response.resolve_context(response.context_data)
+            pages = [render_html(response.resolve_template(response.template_name), context, request),
+                     None, None, None]
+            # the HTML response has no wkhtmltopdf options, they are taken from the view
+            cmd_options = match.func.view_class(**match.func.view_initkwargs).get_cmd_options()
+            for backend in options['backend'] or BACKENDS:
+                try:
+                    start = time.perf_counter()
+                    for _ in range(options['repeat']):
+                        content = BACKENDS[backend](pages, cmd_options.copy())
+                    elapsed = (time.perf_counter() - start) / options['repeat']
+                except Exception as e:
+                    self.stdout.write('{} {}: chyba {}'.format(document, backend, e))
+                    continue
+                self.stdout.write('{} {}: {:.1f} ms, {} kB'.format(document, backend, elapsed * 1000,
+                                                                   len(content) // 1024))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from kicoma.kitchen.snapshot import create_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Uloží všechny tabulky aplikace kitchen do archivu tar.gz pomocí COPY'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='Cílový soubor .tar.gz')
+
+    def handle(self, *args, **options):
+        with open(options['file'], 'wb') as f:
+            manifest = create_snapshot(f)
+        self.stdout.write('Uloženo {} tabulek, {} záznamů do {}'.format(
+            len(manifest['tables']), sum(table['rows'] for table in manifest['tables']), options['file']))
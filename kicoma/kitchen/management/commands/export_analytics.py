@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from kicoma.kitchen.analytics import DATASETS, FORMATS, AnalyticsError, export_partitions
+
+
+class Command(BaseCommand):
+    help = 'Připíše pohyby zboží od posledního exportu do souborů Parquet nebo Arrow rozdělených po měsících'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Cílový adresář')
+        parser.add_argument('--dataset', action='append', choices=list(DATASETS),
+                            help='Exportovaná data, výchozí jsou všechna')
+        parser.add_argument('--format', default='parquet', choices=list(FORMATS), help='Formát souborů')
+        parser.add_argument('--full', action='store_true', help='Exportovat vše bez ohledu na poslední export')
+
+    def handle(self, *args, **options):
+        for dataset in options['dataset'] or DATASETS:
+            try:
+                rows, months = export_partitions(dataset, options['directory'], options['format'], options['full'])
+            except AnalyticsError as e:
+                raise CommandError(e)
+            self.stdout.write('{}: {} záznamů v {} měsících'.format(dataset, rows, months))
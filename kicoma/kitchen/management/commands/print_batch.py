@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from kicoma.kitchen import pdf_batch
+from kicoma.kitchen.pdf import get_backend
+
+
+def date(value):
+    return datetime.strptime(value, pdf_batch.DATE_FORMAT).date()
+
+
+class Command(BaseCommand):
+    help = 'Vytiskne denní menu nebo výdejky za období do jednoho PDF nebo do ZIP souboru s PDF každého dokumentu'
+
+    def add_arguments(self, parser):
+        parser.add_argument('document', choices=list(pdf_batch.DOCUMENTS), help='Druh dokumentu')
+        parser.add_argument('output', help='Výstupní soubor, *.zip pro ZIP, jinak jedno PDF')
+        parser.add_argument('--date-from', type=date, help='Začátek období dd.mm.rrrr')
+        parser.add_argument('--date-to', type=date, help='Konec období dd.mm.rrrr')
+        parser.add_argument('--ids', type=int, nargs='+', help='Čísla dokladů místo období')
+        parser.add_argument('--meal-group', help='Skupina strávníků denního menu')
+        parser.add_argument('--workers', type=int, default=settings.PDF_BATCH_WORKERS,
+                            help='Počet procesů, které převádějí dokumenty do PDF')
+
+    def handle(self, *args, **options):
+        output = 'zip' if options['output'].lower().endswith('.zip') else 'pdf'
+        try:
+            pdf_batch.check_output(output)
+            pages = pdf_batch.render_pages(options['document'], options['date_from'], options['date_to'],
+                                           options['ids'], options['meal_group'])
+            documents = pdf_batch.render_documents(pages, get_backend(options['document']), options['workers'])
+            with open(options['output'], 'wb') as f:
+                if output == 'zip':
+                    for chunk in pdf_batch.zip_chunks(documents):
+                        f.write(chunk)
+                elif pages:
+                    pdf_batch.merge_pdf(documents, f)
+        except pdf_batch.BatchError as e:
+            raise CommandError(e)
+        self.stdout.write('Vytištěno dokumentů: {}'.format(len(pages)))
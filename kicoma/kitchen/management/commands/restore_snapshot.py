@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from kicoma.kitchen.snapshot import restore_snapshot, SnapshotError
+
+
+class Command(BaseCommand):
+    help = 'Nahradí všechny tabulky aplikace kitchen obsahem archivu z create_snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='Soubor .tar.gz z create_snapshot')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['file'], 'rb') as f:
+                manifest = restore_snapshot(f)
+        except SnapshotError as e:
+            raise CommandError(e)
+        self.stdout.write('Obnoveno {} tabulek, {} záznamů ze snímku {}'.format(
+            len(manifest['tables']), sum(table['rows'] for table in manifest['tables']), manifest['created']))
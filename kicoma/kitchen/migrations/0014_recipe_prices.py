@@ -0,0 +1,57 @@
+# Generated by Django 3.2.10 on 2026-10-18 11:02
+
+from django.core.exceptions import ValidationError
+from django.db import migrations, models
+
+from kicoma.kitchen.functions import convert_units
+
+
+def update_recipe_prices(apps, schema_editor):
+    Recipe = apps.get_model('kitchen', 'Recipe')
+    RecipeArticle = apps.get_model('kitchen', 'RecipeArticle')
+    StockReceiptArticle = apps.get_model('kitchen', 'StockReceiptArticle')
+    # same as Article.average_price
+    average_prices = {}
+    totals = {}
+    for recipe_article in RecipeArticle.objects.select_related('article'):
+        article = recipe_article.article
+        if article.id not in average_prices:
+            if article.on_stock != 0:
+                average_prices[article.id] = round(article.total_price / article.on_stock, 2)
+            else:
+                last = StockReceiptArticle.objects.filter(article_id=article.id).select_related('vat').order_by('-id')
+                last = last.first()
+                average_prices[article.id] = 0 if last is None else \
+                    last.price_without_vat + last.price_without_vat * last.vat.percentage / 100
+        try:
+            converted_amount = convert_units(recipe_article.amount, recipe_article.unit, article.unit)
+        except ValidationError:
+            continue
+        price = round(converted_amount * average_prices[article.id], 2)
+        totals[recipe_article.recipe_id] = totals.get(recipe_article.recipe_id, 0) + price
+    recipes = list(Recipe.objects.all())
+    for recipe in recipes:
+        recipe.total_price = round(totals.get(recipe.id, 0), 2)
+        recipe.portion_price = round(recipe.total_price / recipe.norm_amount, 2) if recipe.norm_amount else 0
+    Recipe.objects.bulk_update(recipes, ['total_price', 'portion_price'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kitchen', '0013_auto_20220227_1753'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='portion_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Cena surovin na jednu porci', max_digits=10, verbose_name='Cena porce s DPH'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Cena všech surovin receptu', max_digits=10, verbose_name='Cena receptu s DPH'),
+        ),
+        migrations.RunPython(update_recipe_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.10 on 2026-10-18 11:09
+
+from django.db import migrations, models
+
+
+def update_last_prices(apps, schema_editor):
+    Article = apps.get_model('kitchen', 'Article')
+    StockReceiptArticle = apps.get_model('kitchen', 'StockReceiptArticle')
+    # the newest receipt line of every article, as the former Article.average_price fallback
+    last_prices = {}
+    for stock_article in StockReceiptArticle.objects.select_related('vat').order_by('-id'):
+        if stock_article.article_id not in last_prices:
+            price = stock_article.price_without_vat
+            last_prices[stock_article.article_id] = round(price + price * stock_article.vat.percentage / 100, 2)
+    articles = list(Article.objects.filter(pk__in=last_prices.keys()))
+    for article in articles:
+        article.last_price = last_prices[article.id]
+    Article.objects.bulk_update(articles, ['last_price'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kitchen', '0014_recipe_prices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='last_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Jednotková cena s DPH z poslední naskladněné příjemky', max_digits=10, verbose_name='Poslední jednotková cena s DPH'),
+        ),
+        migrations.AddField(
+            model_name='historicalarticle',
+            name='last_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Jednotková cena s DPH z poslední naskladněné příjemky', max_digits=10, verbose_name='Poslední jednotková cena s DPH'),
+        ),
+        migrations.RunPython(update_last_prices, migrations.RunPython.noop),
+    ]
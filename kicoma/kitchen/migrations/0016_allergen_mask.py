@@ -0,0 +1,45 @@
+# Generated by Django 3.2.10 on 2026-10-18 11:11
+
+from django.db import migrations, models
+
+
+def update_allergen_masks(apps, schema_editor):
+    Article = apps.get_model('kitchen', 'Article')
+    Recipe = apps.get_model('kitchen', 'Recipe')
+    RecipeArticle = apps.get_model('kitchen', 'RecipeArticle')
+    # same as Article.update_allergens and Recipe.update_allergens
+    article_masks = {}
+    for article_id, allergen_id in Article.allergen.through.objects.values_list('article', 'allergen'):
+        article_masks[article_id] = article_masks.get(article_id, 0) | 1 << (allergen_id - 1)
+    articles = list(Article.objects.filter(pk__in=article_masks.keys()))
+    for article in articles:
+        article.allergen_mask = article_masks[article.id]
+    Article.objects.bulk_update(articles, ['allergen_mask'], batch_size=500)
+    recipe_masks = {}
+    for recipe_id, article_id in RecipeArticle.objects.values_list('recipe', 'article'):
+        recipe_masks[recipe_id] = recipe_masks.get(recipe_id, 0) | article_masks.get(article_id, 0)
+    recipes = list(Recipe.objects.filter(pk__in=recipe_masks.keys()))
+    for recipe in recipes:
+        recipe.allergen_mask = recipe_masks[recipe.id]
+    Recipe.objects.bulk_update(recipes, ['allergen_mask'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kitchen', '0015_article_last_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='allergen_mask',
+            field=models.BigIntegerField(default=0, editable=False, help_text='Alergeny zboží jako bitová maska', verbose_name='Alergeny'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='allergen_mask',
+            field=models.BigIntegerField(default=0, editable=False, help_text='Alergeny všech surovin receptu jako bitová maska', verbose_name='Alergeny'),
+        ),
+        migrations.RunPython(update_allergen_masks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 3.2.10 on 2026-10-18 11:12
+
+from django.core.exceptions import ValidationError
+from django.db import migrations, models
+import django.db.models.deletion
+
+from kicoma.kitchen.functions import convert_units
+
+
+def create_stock_movements(apps, schema_editor):
+    StockMovement = apps.get_model('kitchen', 'StockMovement')
+    StockIssueArticle = apps.get_model('kitchen', 'StockIssueArticle')
+    StockReceiptArticle = apps.get_model('kitchen', 'StockReceiptArticle')
+    # same amounts and prices as StockIssue.approve and StockReceipt.approve
+    movements = {}
+    issue_articles = StockIssueArticle.objects.filter(
+        stock_issue__approved=True, stock_issue__date_approved__isnull=False).select_related('stock_issue', 'article')
+    receipt_articles = StockReceiptArticle.objects.filter(
+        stock_receipt__approved=True, stock_receipt__date_approved__isnull=False).select_related(
+        'stock_receipt', 'article', 'vat')
+    for stock_article in issue_articles:
+        try:
+            amount = convert_units(stock_article.amount, stock_article.unit, stock_article.article.unit)
+        except ValidationError:
+            continue
+        key = (stock_article.stock_issue.date_approved, stock_article.article_id)
+        movement = movements.setdefault(key, StockMovement(date=key[0], article_id=key[1]))
+        movement.issued_amount += round(amount, 2)
+        movement.issued_price += round((stock_article.average_unit_price or 0) * amount, 2)
+    for stock_article in receipt_articles:
+        try:
+            amount = convert_units(stock_article.amount, stock_article.unit, stock_article.article.unit)
+        except ValidationError:
+            continue
+        price_with_vat = stock_article.price_without_vat + \
+            stock_article.price_without_vat * stock_article.vat.percentage / 100
+        key = (stock_article.stock_receipt.date_approved, stock_article.article_id)
+        movement = movements.setdefault(key, StockMovement(date=key[0], article_id=key[1]))
+        movement.received_amount += round(amount, 2)
+        movement.received_price += round(price_with_vat * amount, 2)
+    StockMovement.objects.bulk_create(movements.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kitchen', '0016_allergen_mask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Datum')),
+                ('issued_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Vydané množství')),
+                ('issued_price', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Cena vydaného zboží s DPH')),
+                ('received_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Přijaté množství')),
+                ('received_price', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Cena přijatého zboží s DPH')),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='kitchen.article', verbose_name='Zboží')),
+            ],
+            options={
+                'verbose_name': 'Pohyb zboží',
+                'verbose_name_plural': 'Pohyby zboží',
+                'ordering': ['-date'],
+                'unique_together': {('date', 'article')},
+            },
+        ),
+        migrations.RunPython(create_stock_movements, migrations.RunPython.noop),
+    ]
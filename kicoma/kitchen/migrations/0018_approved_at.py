@@ -0,0 +1,31 @@
+# Generated by Django 3.2.10 on 2026-10-18 11:44
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def set_approved_at(apps, schema_editor):
+    # the modification time is the best known approval time of the documents approved before
+    for name in ('StockIssue', 'StockReceipt'):
+        apps.get_model('kitchen', name).objects.filter(approved=True).update(approved_at=F('modified'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kitchen', '0017_stockmovement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockissue',
+            name='approved_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Čas schválení, nastavený jen jednou', null=True, verbose_name='Vyskladněno v'),
+        ),
+        migrations.AddField(
+            model_name='stockreceipt',
+            name='approved_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Čas schválení, nastavený jen jednou', null=True, verbose_name='Naskladněno v'),
+        ),
+        migrations.RunPython(set_approved_at, migrations.RunPython.noop),
+    ]
@@ -2,16 +2,19 @@ from decimal import Decimal
 import datetime
 
 from django.db import models, transaction
-from django.db.models import Sum, Count, Min, Max
+from django.db.models import F, Sum, Count, Max, Case, When, Value
+from django.db.models.functions import Coalesce, TruncMonth
 from django.urls import reverse_lazy
 from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
+from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from simple_history.models import HistoricalRecords
-from simple_history.utils import update_change_reason
+from simple_history.utils import bulk_update_with_history
 
-from .functions import convert_units, total_recipe_article_price
+from .functions import convert_units, convert_units_array, convert_units_expression, RoundTo
 
 UNIT = (
     ('kg', _('kg')),
@@ -55,6 +58,43 @@ class Allergen(models.Model):
     def __str__(self):
         return self.code + ' - ' + self.description
 
+    # allergens of articles and recipes are stored as a bitmask with one bit for every allergen id (1 - 63),
+    # the 64th bit is the sign of the bigint column
+    MAX_ID = 63
+
+    def clean(self):
+        if self.pk is None and (Allergen.objects.aggregate(Max('id'))['id__max'] or 0) >= Allergen.MAX_ID:
+            raise ValidationError('Nelze přidat další alergen, alergeny mohou mít čísla jen 1 až {}'.format(
+                Allergen.MAX_ID))
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            Allergen.bit(self.pk)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Allergen.bit(self.pk)
+
+    @staticmethod
+    def bit(allergen_id):
+        if not 1 <= allergen_id <= Allergen.MAX_ID:
+            raise ValidationError('Alergen číslo {} nelze použít, alergeny mohou mít čísla jen 1 až {}'.format(
+                allergen_id, Allergen.MAX_ID))
+        return 1 << (allergen_id - 1)
+
+    @property
+    def mask(self):
+        return Allergen.bit(self.id)
+
+    # allergen codes by id, loaded once for a whole table or report
+    @staticmethod
+    def get_codes():
+        return dict(Allergen.objects.values_list('id', 'code'))
+
+    @staticmethod
+    def display_mask(mask, codes):
+        return ', '.join(code for allergen_id, code in sorted(codes.items(), key=lambda item: item[1])
+                         if allergen_id <= Allergen.MAX_ID and mask & Allergen.bit(allergen_id))
+
 
 class MealGroup(models.Model):
     class Meta:
@@ -98,9 +138,14 @@ class Article(TimeStampedModel):
     total_price = models.DecimalField(
         max_digits=8, blank=True, null=True, decimal_places=2,
         default=0, verbose_name='Celková cena s DPH', help_text='Celková cena zboží na skladu')
+    last_price = models.DecimalField(
+        max_digits=10, decimal_places=2, default=0, editable=False, verbose_name='Poslední jednotková cena s DPH',
+        help_text='Jednotková cena s DPH z poslední naskladněné příjemky')
     allergen = models.ManyToManyField(Allergen, blank=True, verbose_name='Alergeny')
+    allergen_mask = models.BigIntegerField(default=0, editable=False, verbose_name='Alergeny',
+                                           help_text='Alergeny zboží jako bitová maska')
     comment = models.CharField(max_length=200, blank=True, null=True, verbose_name='Poznámka')
-    history = HistoricalRecords(cascade_delete_history=True)
+    history = HistoricalRecords(cascade_delete_history=True, excluded_fields=['allergen_mask'])
 
     def __str__(self):
         return self.article
@@ -110,24 +155,52 @@ class Article(TimeStampedModel):
     def average_price(self):
         if self.on_stock != 0:
             return round(self.total_price / self.on_stock, 2)
-        else:
-            stock_receipt_article = StockReceiptArticle.objects.filter(article__id=self.id)
-            if len(stock_receipt_article) == 0:
-                return 0
-            else:
-                return stock_receipt_article[0].price_with_vat
+        return self.last_price
 
     @staticmethod
     def sum_total_price():
         sum_price = Article.objects.aggregate(total_price=Sum('total_price'))['total_price']
         return 0 if sum_price is None else round(sum_price, 2)
 
+    # database expression for average_price
+    @staticmethod
+    def average_price_expression():
+        return Case(When(on_stock=0, then=F('last_price')), default=RoundTo(F('total_price') / F('on_stock'), 2),
+                    output_field=models.DecimalField())
+
+    # articles of the printed lists as dictionaries with the average price, all in one query
+    @staticmethod
+    def price_rows():
+        return list(Article.objects.order_by('article').values(
+            'article', 'unit', 'on_stock', 'min_on_stock', 'total_price',
+            average_price=Article.average_price_expression()))
+
     '''Create a string for the Allergens. This is required to display allergen in Admin and user table view.'''
-    def display_allergens(self):
-        return ', '.join(allergen.code for allergen in self.allergen.all())
+    def display_allergens(self, codes=None):
+        return Allergen.display_mask(self.allergen_mask, Allergen.get_codes() if codes is None else codes)
 
     display_allergens.short_description = _('Alergeny')
 
+    # recalculate allergen masks from the allergen relation, all articles are recalculated when article_ids is None
+    @classmethod
+    def update_allergens(cls, article_ids=None):
+        articles = cls.objects.only('id', 'allergen_mask')
+        article_allergens = cls.allergen.through.objects.all()
+        if article_ids is not None:
+            articles = articles.filter(pk__in=article_ids)
+            article_allergens = article_allergens.filter(article__in=article_ids)
+        masks = {}
+        for article_id, allergen_id in article_allergens.values_list('article', 'allergen'):
+            masks[article_id] = masks.get(article_id, 0) | Allergen.bit(allergen_id)
+        articles = list(articles)
+        for article in articles:
+            article.allergen_mask = masks.get(article.id, 0)
+        cls.objects.bulk_update(articles, ['allergen_mask'], batch_size=500)
+        if article_ids is None:
+            Recipe.update_allergens()
+        else:
+            Recipe.update_allergens_for_articles(article_ids)
+
 
 class Recipe(TimeStampedModel):
     class Meta:
@@ -140,6 +213,14 @@ class Recipe(TimeStampedModel):
         validators=[MinValueValidator(0), MaxValueValidator(1000)], verbose_name='Porcí')
     procedure = models.TextField(max_length=1000, blank=True, null=True, verbose_name='Postup receptu')
     comment = models.CharField(max_length=200, blank=True, null=True, verbose_name='Poznámka')
+    total_price = models.DecimalField(
+        max_digits=10, decimal_places=2, default=0, editable=False,
+        verbose_name='Cena receptu s DPH', help_text='Cena všech surovin receptu')
+    portion_price = models.DecimalField(
+        max_digits=10, decimal_places=2, default=0, editable=False,
+        verbose_name='Cena porce s DPH', help_text='Cena surovin na jednu porci')
+    allergen_mask = models.BigIntegerField(default=0, editable=False, verbose_name='Alergeny',
+                                           help_text='Alergeny všech surovin receptu jako bitová maska')
 
     def __str__(self):
         return self.recipe
@@ -148,32 +229,66 @@ class Recipe(TimeStampedModel):
     def get_absolute_url(self):
         return reverse_lazy('kitchen:showRecipeArticles', args=[str(self.id)])
 
-    @property
-    def total_recipe_articles_price(self):
-        recipes = RecipeArticle.objects.filter(recipe=self.id)
-        total = 0
+    # recalculate stored recipe and portion prices, all recipes are recalculated when recipe_ids is None
+    @classmethod
+    def update_prices(cls, recipe_ids=None):
+        recipes = cls.objects.only('id', 'norm_amount')
+        if recipe_ids is not None:
+            recipes = recipes.filter(pk__in=recipe_ids)
+        recipes = list(recipes)
+        totals = {}
+        recipe_articles = RecipeArticle.objects.filter(recipe__in=[recipe.id for recipe in recipes]) \
+            .select_related('article')
+        for recipe_article in recipe_articles:
+            try:
+                price = recipe_article.total_average_price
+            except ValidationError:
+                # incorrect units are listed in the report, the article is not priced
+                continue
+            totals[recipe_article.recipe_id] = totals.get(recipe_article.recipe_id, 0) + price
+        for recipe in recipes:
+            recipe.total_price = round(totals.get(recipe.id, 0), 2)
+            recipe.portion_price = round(recipe.total_price / recipe.norm_amount, 2) if recipe.norm_amount else 0
+        cls.objects.bulk_update(recipes, ['total_price', 'portion_price'], batch_size=500)
+
+    # recalculate prices of recipes where the articles are used
+    @classmethod
+    def update_prices_for_articles(cls, article_ids):
+        recipe_ids = RecipeArticle.objects.filter(article__in=article_ids).values('recipe')
+        cls.update_prices(recipe_ids)
+
+    # recalculate allergen masks from the recipe articles, all recipes are recalculated when recipe_ids is None
+    @classmethod
+    def update_allergens(cls, recipe_ids=None):
+        recipes = cls.objects.only('id', 'allergen_mask')
+        recipe_articles = RecipeArticle.objects.all()
+        if recipe_ids is not None:
+            recipes = recipes.filter(pk__in=recipe_ids)
+            recipe_articles = recipe_articles.filter(recipe__in=recipe_ids)
+        masks = {}
+        for recipe_id, allergen_mask in recipe_articles.values_list('recipe', 'article__allergen_mask'):
+            masks[recipe_id] = masks.get(recipe_id, 0) | allergen_mask
+        recipes = list(recipes)
         for recipe in recipes:
-            total += recipe.total_average_price
-        return total
+            recipe.allergen_mask = masks.get(recipe.id, 0)
+        cls.objects.bulk_update(recipes, ['allergen_mask'], batch_size=500)
 
     @classmethod
-    def get_allergens(cls, recipe_id):
-        recipe_articles = RecipeArticle.objects.filter(recipe=recipe_id).select_related('article')
-        allergens = ""
-        # get allergens
-        separator = ", "
-        for ra in recipe_articles:
-            separator = ", "
-            if len(ra.article.display_allergens()) > 0:
-                allergens += ra.article.display_allergens() + separator
-        # remove last separator
-        if allergens.endswith(separator):
-            allergens = allergens[0:len(allergens) - len(separator)]
-        # deduplicate allergens
-        words = allergens.split(separator)
-        allergens = separator.join(sorted(set(set(words)), key=words.index))
+    def update_allergens_for_articles(cls, article_ids):
+        cls.update_allergens(RecipeArticle.objects.filter(article__in=article_ids).values('recipe'))
+
+    def display_allergens(self, codes=None):
+        allergens = Allergen.display_mask(self.allergen_mask, Allergen.get_codes() if codes is None else codes)
         return allergens if len(allergens) > 0 else '-'
 
+    # recipes without any of the allergens
+    @staticmethod
+    def without_allergens(queryset, allergens):
+        mask = 0
+        for allergen in allergens:
+            mask |= allergen.mask
+        return queryset.annotate(allergen_match=F('allergen_mask').bitand(mask)).filter(allergen_match=0)
+
 
 class RecipeArticle(TimeStampedModel):
     class Meta:
@@ -274,6 +389,46 @@ class DailyMenuRecipe(TimeStampedModel):
     def __str__(self):
         return self.recipe.recipe + ' - ' + str(self.amount)
 
+    # portions and prices of the daily menu recipes between the dates (inclusive) from one grouped query,
+    # returns totals by recipe, by meal group and the total price
+    @staticmethod
+    def catering_unit(date_from, date_to):
+        rows = DailyMenuRecipe.objects.filter(daily_menu__date__range=(date_from, date_to)).order_by() \
+            .values('recipe__recipe', 'recipe__portion_price', 'daily_menu__meal_group__meal_group') \
+            .annotate(portions=Sum('amount'),
+                      price=Sum(F('amount') * F('recipe__portion_price'), output_field=models.DecimalField()))
+        recipes = {}
+        meal_groups = {}
+        total_price = 0
+        for row in rows:
+            recipe = recipes.setdefault(row['recipe__recipe'], {
+                'recipe': row['recipe__recipe'], 'unit_price': row['recipe__portion_price'],
+                'amount': 0, 'total_price': 0})
+            recipe['amount'] += row['portions']
+            recipe['total_price'] += row['price']
+            meal_group = meal_groups.setdefault(row['daily_menu__meal_group__meal_group'], {
+                'meal_group': row['daily_menu__meal_group__meal_group'], 'amount': 0, 'total_price': 0})
+            meal_group['amount'] += row['portions']
+            meal_group['total_price'] += row['price']
+            total_price += row['price']
+        return {
+            'recipes': sorted(recipes.values(), key=lambda recipe: recipe['recipe']),
+            'meal_groups': sorted(meal_groups.values(), key=lambda meal_group: meal_group['meal_group']),
+            'total_price': total_price,
+        }
+
+
+class StockIssueQuerySet(models.QuerySet):
+    # list of stock issues with the total price, line count and user names in one query,
+    # the ordering of Meta is not used by Django 3.2 in the GROUP BY query and is set explicitly
+    def with_totals(self):
+        return self.select_related('user_created', 'user_approved').annotate(
+            price_total=Coalesce(RoundTo(Sum(StockIssueArticle.total_price_expression('stockissuearticle__')), 2),
+                                 Value(0), output_field=models.DecimalField()),
+            article_count=Count('stockissuearticle'),
+            user_created_name=F('user_created__username'),
+            user_approved_name=F('user_approved__username')).order_by('-created')
+
 
 class StockIssue(TimeStampedModel):
     class Meta:
@@ -285,95 +440,108 @@ class StockIssue(TimeStampedModel):
                                      related_name='user_is_created', verbose_name='Vytvořil')
     approved = models.BooleanField(default=False, blank=True, null=True, verbose_name='Vyskladněno')
     date_approved = models.DateField(blank=True, null=True, verbose_name='Datum vyskladnění')
+    approved_at = models.DateTimeField(blank=True, null=True, editable=False, verbose_name='Vyskladněno v',
+                                       help_text='Čas schválení, nastavený jen jednou')
     user_approved = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, blank=True, null=True,
                                       related_name='user_is_approved', verbose_name='Vyskladnil')
     comment = models.CharField(max_length=200, blank=True, null=True, verbose_name='Poznámka')
 
+    objects = StockIssueQuerySet.as_manager()
+
     def __str__(self):
         return str(self.created)
 
     @property
     def total_price(self):
-        stock_issue_articles = StockIssueArticle.objects.filter(stock_issue=self.id)
-        return round(total_recipe_article_price(stock_issue_articles, 1), 2)
-
-    def consolidate_by_article(self):
-        # select all articles where count > 1
-        # group by article_id and sum amount and average_unit_price
-        articles_to_consolidate = StockIssueArticle.objects.filter(
-            stock_issue_id=self.pk).values('article_id').annotate(average_unit_price=Min('average_unit_price'),
-                                                                  total=Count('article_id'),
-                                                                  sumAmount=Sum('amount')).filter(total__gt=1)
-        article_ids = []
-        for article in articles_to_consolidate:
-            article_ids.append(article['article_id'])
-        # remove all articles where count > 1
-        StockIssueArticle.objects.filter(stock_issue_id=self.pk, article_id__in=article_ids).delete()
-        # insert consolidated articles
-        for article in articles_to_consolidate:
-            x = StockIssueArticle(
-                stock_issue=self,
-                article=Article.objects.filter(pk=article['article_id']).get(),
-                amount=article['sumAmount'],
-                unit=Article.objects.filter(pk=article['article_id']).get().unit,
-                average_unit_price=article['average_unit_price'],
-                comment='ca'
-            )
-            x.save()
-        return len(StockIssueArticle.objects.filter(stock_issue_id=self.pk))
+        total_price = StockIssueArticle.objects.filter(stock_issue=self.id).aggregate(
+            total_price=Sum(StockIssueArticle.total_price_expression()))['total_price']
+        return 0 if total_price is None else round(total_price, 2)
 
     @staticmethod
     def create_from_daily_menu(daily_menus, date, user):
+        # recipe article amounts for all daily menu portions in one query, grouped by article and recipe unit
+        recipe_articles = list(RecipeArticle.objects.filter(
+            recipe__dailymenurecipe__daily_menu__in=daily_menus
+        ).order_by().values('article', 'unit', 'article__unit').annotate(
+            amount=Sum(F('amount') * F('recipe__dailymenurecipe__amount') / F('recipe__norm_amount'),
+                       output_field=models.DecimalField())))
+        # consolidate amounts by article, converted to the article unit
+        converted_amounts = convert_units_array([recipe_article['amount'] for recipe_article in recipe_articles],
+                                                [recipe_article['unit'] for recipe_article in recipe_articles],
+                                                [recipe_article['article__unit'] for recipe_article in recipe_articles])
+        amounts = {}
+        for recipe_article, amount in zip(recipe_articles, converted_amounts):
+            amounts[recipe_article['article']] = amounts.get(recipe_article['article'], 0) + amount
+        articles = Article.objects.in_bulk(amounts.keys())
         with transaction.atomic():
-            # save the StockIssue
-            stock_issue = StockIssue(comment="Pro " + date, user_created=user)
-            stock_issue.save()
-            # save all StockIssue Articles
-            daily_menu_recipes = DailyMenuRecipe.objects.select_related('recipe').filter(daily_menu__in=daily_menus)
-            for daily_menu_recipe in daily_menu_recipes:
-                recipe_articles = RecipeArticle.objects.filter(recipe_id=daily_menu_recipe.recipe_id)
-                for recipe_article in recipe_articles:
-                    # get the coefficient between daily menu amount and recipe amount
-                    recipe_article_coefficient = Decimal(daily_menu_recipe.amount / recipe_article.recipe.norm_amount)
-                    recipe_article_amount = convert_units(recipe_article.amount, recipe_article.unit,
-                                                          recipe_article.article.unit) * recipe_article_coefficient
-                    stock_issue_article = StockIssueArticle(
-                        stock_issue=stock_issue,
-                        article=recipe_article.article,
-                        amount=recipe_article_amount,
-                        unit=recipe_article.article.unit,
-                        average_unit_price=recipe_article.article.average_price,
-                        comment=""
-                    )
-                    stock_issue_article.save()
-            count = stock_issue.consolidate_by_article()
-        return count
+            stock_issue = StockIssue.objects.create(comment="Pro " + date, user_created=user)
+            StockIssueArticle.objects.bulk_create([
+                StockIssueArticle(
+                    stock_issue=stock_issue,
+                    article=articles[article_id],
+                    amount=round(amount, 2),
+                    unit=articles[article_id].unit,
+                    average_unit_price=articles[article_id].average_price,
+                    comment=""
+                ) for article_id, amount in amounts.items()
+            ])
+        return len(amounts)
+
+    # issue all articles in one pass, returns the articles which are not on stock or an empty string on success
+    def approve(self, user):
+        with transaction.atomic():
+            stock_articles = list(StockIssueArticle.objects.filter(stock_issue=self.id))
+            # lock the articles in the id order so that concurrent approvals cannot deadlock
+            articles = Article.objects.select_for_update().filter(
+                pk__in={stock_article.article_id for stock_article in stock_articles}).order_by('id')
+            articles = {article.id: article for article in articles}
+            issued = {}
+            movements = {}
+            for stock_article in stock_articles:
+                article = articles[stock_article.article_id]
+                stock_article.article = article
+                stock_article.average_unit_price = article.average_price
+                converted_amount = round(convert_units(stock_article.amount, stock_article.unit, article.unit), 2)
+                converted_price = round(convert_units(stock_article.total_average_price_with_vat, stock_article.unit,
+                                                      article.unit), 2)
+                amount, price = issued.get(article.id, (0, 0))
+                issued[article.id] = (amount + converted_amount, price + converted_price)
+                amount, price = movements.get(article.id, (0, 0))
+                movements[article.id] = (amount + converted_amount, price + stock_article.total_average_price_with_vat)
+            messages = ''
+            for article_id, (amount, price) in issued.items():
+                article = articles[article_id]
+                if article.on_stock < 0 or article.on_stock - amount < 0:
+                    messages += "{} - na výdejce {}, na skladu {}<br/>".format(article, amount, article.on_stock)
+            if messages:
+                return messages
+            for article_id, (amount, price) in issued.items():
+                articles[article_id].on_stock -= amount
+                articles[article_id].total_price -= price
+                articles[article_id].modified = timezone.now()
+            StockIssueArticle.objects.bulk_update(stock_articles, ['average_unit_price'])
+            bulk_update_with_history(list(articles.values()), Article, ['on_stock', 'total_price', 'modified'],
+                                     default_user=user, default_change_reason='Výdej - ' + self.comment)
+            Recipe.update_prices_for_articles(articles.keys())
+            self.approved = True
+            self.date_approved = datetime.date.today()
+            self.approved_at = timezone.now()
+            self.user_approved = user
+            self.save(update_fields=('approved', 'date_approved', 'approved_at', 'user_approved',))
+            StockMovement.add_movements(self.date_approved, issued=movements)
+        return messages
 
-    @staticmethod
-    def update_stock_issue_article_average_unit_price(stock_issue_id):
-        stock_issue_articles = StockIssueArticle.objects.filter(stock_issue_id=stock_issue_id)
-        for stock_issue_article in stock_issue_articles:
-            stock_issue_article.average_unit_price = stock_issue_article.article.average_price
-            stock_issue_article.save()
 
-    @staticmethod
-    def update_article_on_stock(stock_id, comment, fake):
-        stock_articles = StockIssueArticle.objects.filter(stock_issue=stock_id)
-        messages = ''
-        for stock_article in stock_articles:
-            article = Article.objects.filter(pk=stock_article.article.id).get()
-            converted_amount = convert_units(stock_article.amount, stock_article.unit, article.unit)
-            if article.on_stock < 0 or article.on_stock - converted_amount < 0:
-                messages += "{} - na výdejce {}, na skladu {}<br/>".format(
-                    stock_article.article, converted_amount, article.on_stock)
-            if not fake:
-                new_total_price = convert_units(stock_article.total_average_price_with_vat, stock_article.unit,
-                                                article.unit)
-                article.on_stock -= round(converted_amount, 2)
-                article.total_price -= round(new_total_price, 2)
-                article.save()
-                update_change_reason(article, 'Výdej - ' + comment)
-        return messages
+class StockReceiptQuerySet(models.QuerySet):
+    # list of stock receipts with the total price, line count and user names in one query,
+    # the ordering of Meta is not used by Django 3.2 in the GROUP BY query and is set explicitly
+    def with_totals(self):
+        return self.select_related('user_created', 'user_approved').annotate(
+            price_total=Coalesce(Sum(StockReceiptArticle.total_price_expression('stockreceiptarticle__')),
+                                 Value(0), output_field=models.DecimalField()),
+            article_count=Count('stockreceiptarticle'),
+            user_created_name=F('user_created__username'),
+            user_approved_name=F('user_approved__username')).order_by('-created')
 
 
 class StockReceipt(TimeStampedModel):
@@ -387,32 +555,74 @@ class StockReceipt(TimeStampedModel):
                                      related_name='user_created', verbose_name='Vytvořil')
     approved = models.BooleanField(default=False, blank=True, null=True, verbose_name='Naskladněno')
     date_approved = models.DateField(blank=True, null=True, verbose_name='Datum naskladnění')
+    approved_at = models.DateTimeField(blank=True, null=True, editable=False, verbose_name='Naskladněno v',
+                                       help_text='Čas schválení, nastavený jen jednou')
     user_approved = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, blank=True, null=True,
                                       related_name='user_approved', verbose_name='Naskladnil')
     comment = models.CharField(max_length=200, blank=True, null=True, verbose_name='Poznámka')
 
+    objects = StockReceiptQuerySet.as_manager()
+
     def __str__(self):
         return str(self.created)
 
     @property
     def total_price(self):
-        stock_receipt_articles = StockReceiptArticle.objects.filter(stock_receipt=self.id)
-        total_price = 0
-        for stock_receipt_article in stock_receipt_articles:
-            total_price += stock_receipt_article.total_price_with_vat
-        return round(total_price, 2)
+        total_price = StockReceiptArticle.objects.filter(stock_receipt=self.id).aggregate(
+            total_price=Sum(StockReceiptArticle.total_price_expression()))['total_price']
+        return 0 if total_price is None else round(total_price, 2)
 
-    @staticmethod
-    def update_article_on_stock(stock_id, comment):
-        stock_articles = StockReceiptArticle.objects.filter(stock_receipt=stock_id)
-        for stock_article in stock_articles:
-            article = Article.objects.filter(pk=stock_article.article.id).get()
-            converted_amount = convert_units(stock_article.amount, stock_article.unit, article.unit)
-            new_total_price = convert_units(stock_article.total_price_with_vat, stock_article.unit, article.unit)
-            article.on_stock += round(converted_amount, 2)
-            article.total_price += round(new_total_price, 2)
-            article.save()
-            update_change_reason(article, 'Příjem - ' + comment)
+    # receive all articles with one update, returns the total price of the received articles
+    # nothing is received when the total price is not positive
+    def approve(self, user):
+        with transaction.atomic():
+            stock_articles = StockReceiptArticle.objects.filter(stock_receipt=self.id) \
+                .select_related('article', 'vat').order_by('-id')
+            total_price = 0
+            received = {}
+            last_prices = {}
+            movements = {}
+            for stock_article in stock_articles:
+                article = stock_article.article
+                # lines are ordered from the newest one
+                # the unit price of the line is converted to the price per unit of the article
+                last_prices.setdefault(article.id, round(convert_units(stock_article.price_with_vat, article.unit,
+                                                                       stock_article.unit), 2))
+                total_price_with_vat = stock_article.total_price_with_vat
+                total_price += total_price_with_vat
+                converted_amount = round(convert_units(stock_article.amount, stock_article.unit, article.unit), 2)
+                converted_price = round(convert_units(total_price_with_vat, stock_article.unit, article.unit), 2)
+                amount, price = received.get(article.id, (0, 0))
+                received[article.id] = (amount + converted_amount, price + converted_price)
+                amount, price = movements.get(article.id, (0, 0))
+                movements[article.id] = (amount + converted_amount, price + total_price_with_vat)
+            if total_price <= 0:
+                return total_price
+            # lock the articles in the id order like StockIssue.approve so that concurrent approvals cannot deadlock
+            list(Article.objects.select_for_update().filter(pk__in=received.keys()).order_by('id')
+                 .values_list('id', flat=True))
+            Article.objects.filter(pk__in=received.keys()).update(
+                on_stock=F('on_stock') + Case(
+                    *[When(pk=article_id, then=Value(amount)) for article_id, (amount, _) in received.items()],
+                    output_field=models.DecimalField()),
+                total_price=F('total_price') + Case(
+                    *[When(pk=article_id, then=Value(price)) for article_id, (_, price) in received.items()],
+                    output_field=models.DecimalField()),
+                last_price=Case(
+                    *[When(pk=article_id, then=Value(price)) for article_id, price in last_prices.items()],
+                    output_field=models.DecimalField()),
+                modified=timezone.now(),
+            )
+            Article.history.bulk_history_create(Article.objects.filter(pk__in=received.keys()), update=True,
+                                                default_user=user, default_change_reason='Příjem - ' + self.comment)
+            Recipe.update_prices_for_articles(received.keys())
+            self.approved = True
+            self.date_approved = datetime.date.today()
+            self.approved_at = timezone.now()
+            self.user_approved = user
+            self.save(update_fields=('approved', 'date_approved', 'approved_at', 'user_approved',))
+            StockMovement.add_movements(self.date_approved, received=movements)
+        return round(total_price, 2)
 
 
 class StockIssueArticle(TimeStampedModel):
@@ -435,6 +645,12 @@ class StockIssueArticle(TimeStampedModel):
             return round(self.average_unit_price * convert_units(self.amount, self.unit, self.article.unit), 2)
         return 0
 
+    # database expression for total_average_price_with_vat without rounding, prefix is the path to the stock article
+    @staticmethod
+    def total_price_expression(prefix=''):
+        return convert_units_expression(prefix + 'amount', prefix + 'unit', prefix + 'article__unit') * \
+            F(prefix + 'average_unit_price')
+
     # def clean(self):
     #     article = Article.objects.filter(pk=self.article.id).values_list('on_stock', 'unit')
     #     on_stock = article[0][0]
@@ -476,5 +692,81 @@ class StockReceiptArticle(TimeStampedModel):
             return round(self.price_with_vat * convert_units(self.amount, self.unit, self.article.unit), 2)
         return 0
 
+    # database expression for total_price_with_vat, prefix is the path to the stock article
+    @staticmethod
+    def total_price_expression(prefix=''):
+        price_with_vat = F(prefix + 'price_without_vat') + \
+            F(prefix + 'price_without_vat') * F(prefix + 'vat__percentage') / 100
+        return RoundTo(price_with_vat * convert_units_expression(
+            prefix + 'amount', prefix + 'unit', prefix + 'article__unit'), 2)
+
     def __str__(self):
         return self.article.article + ' - ' + str(self.amount) + self.unit
+
+
+class StockMovement(models.Model):
+    class Meta:
+        verbose_name_plural = _('Pohyby zboží')
+        verbose_name = _('Pohyb zboží')
+        ordering = ['-date']
+        unique_together = ('date', 'article')
+
+    date = models.DateField(verbose_name='Datum')
+    article = models.ForeignKey(Article, on_delete=models.CASCADE, verbose_name='Zboží')
+    issued_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Vydané množství')
+    issued_price = models.DecimalField(max_digits=12, decimal_places=2, default=0,
+                                       verbose_name='Cena vydaného zboží s DPH')
+    received_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0,
+                                          verbose_name='Přijaté množství')
+    received_price = models.DecimalField(max_digits=12, decimal_places=2, default=0,
+                                         verbose_name='Cena přijatého zboží s DPH')
+
+    def __str__(self):
+        return str(self.date) + ' - ' + str(self.article_id)
+
+    # add approved amounts and prices {article id: (amount in article unit, price)} to the day totals
+    # called inside the approval transaction, the articles are already locked by the stock update
+    @classmethod
+    def add_movements(cls, date, issued=None, received=None):
+        issued = issued or {}
+        received = received or {}
+        article_ids = set(issued.keys()) | set(received.keys())
+        movements = {movement.article_id: movement
+                     for movement in cls.objects.filter(date=date, article__in=article_ids)}
+        new_movements = []
+        for article_id in article_ids:
+            movement = movements.get(article_id)
+            if movement is None:
+                movement = cls(date=date, article_id=article_id)
+                new_movements.append(movement)
+            amount, price = issued.get(article_id, (0, 0))
+            movement.issued_amount += amount
+            movement.issued_price += price
+            amount, price = received.get(article_id, (0, 0))
+            movement.received_amount += amount
+            movement.received_price += price
+        cls.objects.bulk_create(new_movements)
+        cls.objects.bulk_update(list(movements.values()),
+                                ['issued_amount', 'issued_price', 'received_amount', 'received_price'])
+
+    # issued and received totals with the number of approved stock issues and receipts by month
+    @staticmethod
+    def monthly_totals(date_from, date_to):
+        totals = {}
+        movements = StockMovement.objects.filter(date__range=(date_from, date_to)) \
+            .annotate(month=TruncMonth('date')).order_by().values('month') \
+            .annotate(issued_price=Sum('issued_price'), received_price=Sum('received_price'))
+        for movement in movements:
+            month = totals.setdefault(movement['month'], StockMovement.empty_totals())
+            month['stock_issues_price'] = movement['issued_price']
+            month['stock_receipts_price'] = movement['received_price']
+        for model, key in ((StockIssue, 'stock_issues_count'), (StockReceipt, 'stock_receipts_count')):
+            counts = model.objects.filter(approved=True, date_approved__range=(date_from, date_to)) \
+                .annotate(month=TruncMonth('date_approved')).order_by().values('month').annotate(count=Count('id'))
+            for count in counts:
+                totals.setdefault(count['month'], StockMovement.empty_totals())[key] = count['count']
+        return totals
+
+    @staticmethod
+    def empty_totals():
+        return {'stock_issues_count': 0, 'stock_issues_price': 0, 'stock_receipts_count': 0, 'stock_receipts_price': 0}
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import Http404, HttpResponse
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils.encoding import smart_str
+from django.views.generic.base import View
+from wkhtmltopdf.utils import convert_to_pdf, make_absolute_paths
+from wkhtmltopdf.views import PDFResponse, PDFTemplateResponse, PDFTemplateView
+
+from . import pdf_reportlab
+
+# parts of the page which do not change the document, e.g. the time of generation in pdf_page.html
+CACHE_IGNORE = re.compile(r'<!-- cache-ignore -->.*?<!-- /cache-ignore -->', re.DOTALL)
+JOB_ERROR_TIMEOUT = 60 * 60
+# longest wait of a request for the renderer in seconds, longer renderings are picked up on the job page
+MAX_RENDER_WAIT = 3
+
+
+def render_html(template, context, request):
+    return make_absolute_paths(smart_str(template.render(context, request)))
+
+
+# the same key for the same pages, backend and wkhtmltopdf options
+def cache_key(pages, cmd_options, backend='wkhtmltopdf'):
+    content = json.dumps([[CACHE_IGNORE.sub('', page) if page else None for page in pages],
+                          getattr(settings, 'WKHTMLTOPDF_CMD_OPTIONS', None), cmd_options, backend],
+                         sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def cache_path(key):
+    return os.path.join(settings.PDF_CACHE_DIR, key[:2], key + '.pdf')
+
+
+def cache_get(key):
+    path = cache_path(key)
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+    # the modification time is the last use for the eviction
+    os.utime(path)
+    return content
+
+
+def cache_set(key, content):
+    path = cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.tmp', delete=False) as f:
+        f.write(content)
+    os.replace(f.name, path)
+    evict()
+
+
+# remove the least recently used files until the cache fits into PDF_CACHE_MAX_SIZE
+def evict():
+    files = []
+    for directory, _, names in os.walk(settings.PDF_CACHE_DIR):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    size = sum(file_size for _, file_size, _ in files)
+    for _, file_size, path in sorted(files):
+        if size <= settings.PDF_CACHE_MAX_SIZE:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        size -= file_size
+
+
+def write_page(content):
+    f = tempfile.NamedTemporaryFile(mode='w+b', suffix='.html')
+    f.write(content.encode('utf-8'))
+    f.flush()
+    return f
+
+
+def convert_pages(page, header, footer, cover, cmd_options):
+    files = [write_page(content) if content else None for content in (page, header, footer, cover)]
+    try:
+        return convert_to_pdf(*[f.name if f else None for f in files[:3]], cmd_options=cmd_options,
+                              cover_filename=files[3].name if files[3] else None)
+    finally:
+        for f in files:
+            if f:
+                f.close()
+
+
+def render_wkhtmltopdf(pages, cmd_options):
+    return convert_pages(*pages, cmd_options)
+
+
+# the rTable documents are drawn in process, the header, footer, cover and wkhtmltopdf options are not used
+def render_reportlab(pages, cmd_options):
+    return pdf_reportlab.render_page(pages[0])
+
+
+BACKENDS = {
+    'wkhtmltopdf': render_wkhtmltopdf,
+    'reportlab': render_reportlab,
+}
+
+
+# backend for the document type from PDF_BACKENDS, wkhtmltopdf by default
+def get_backend(document):
+    backend = settings.PDF_BACKENDS.get(document, 'wkhtmltopdf')
+    if backend not in BACKENDS:
+        raise ImproperlyConfigured('Neznámý PDF backend {}'.format(backend))
+    return backend
+
+
+# a bounded pool of renderer threads per web worker, the waiting requests release the worker after a timeout
+_executor = None
+_jobs = {}
+_lock = threading.Lock()
+
+
+class RendererBusy(Exception):
+    pass
+
+
+def error_key(key):
+    return 'kitchen_pdf_error_' + key
+
+
+def render_job(key, pages, cmd_options, backend):
+    try:
+        content = BACKENDS[backend](pages, cmd_options)
+    except Exception as e:
+        cache.set(error_key(key), str(e), JOB_ERROR_TIMEOUT)
+        raise
+    if settings.PDF_CACHE_DIR:
+        cache_set(key, content)
+    return content
+
+
+# start the rendering of the pages or join the running job with the same key
+def submit(key, pages, cmd_options, backend='wkhtmltopdf'):
+    global _executor
+    with _lock:
+        future = _jobs.get(key)
+        if future is not None:
+            return future
+        if len(_jobs) >= settings.PDF_RENDER_QUEUE_SIZE:
+            raise RendererBusy()
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.PDF_RENDER_WORKERS, thread_name_prefix='pdf')
+        cache.delete(error_key(key))
+        future = _jobs[key] = _executor.submit(render_job, key, pages, cmd_options, backend)
+    future.add_done_callback(lambda done: finish_job(key, done))
+    return future
+
+
+def finish_job(key, future):
+    with _lock:
+        if _jobs.get(key) is future:
+            del _jobs[key]
+
+
+class CachedPDFTemplateResponse(PDFTemplateResponse):
+    backend = 'wkhtmltopdf'
+
+    # main page, header, footer and cover as HTML
+    def render_pages(self):
+        context = self.resolve_context(self.context_data)
+        return [render_html(template, context, self._request) if template else None
+                for template in (self.resolve_template(self.template_name),
+                                 self.resolve_template(self.header_template),
+                                 self.resolve_template(self.footer_template),
+                                 self.resolve_template(self.cover_template))]
+
+    # wkhtmltopdf runs only for pages which are not in the cache yet
+    @property
+    def rendered_content(self):
+        pages = self.render_pages()
+        cmd_options = self.cmd_options.copy()
+        if not settings.PDF_CACHE_DIR:
+            return BACKENDS[self.backend](pages, cmd_options)
+        key = cache_key(pages, cmd_options, self.backend)
+        content = cache_get(key)
+        if content is None:
+            content = BACKENDS[self.backend](pages, cmd_options)
+            cache_set(key, content)
+        return content
+
+
+def pending_response(request, key, filename):
+    return TemplateResponse(request, 'kitchen/pdf_pending.html', {
+        'url': '{}?{}'.format(reverse('kitchen:pdfJob', kwargs={'key': key}), urlencode({'filename': filename}))},
+        status=202)
+
+
+class CachedPDFTemplateView(PDFTemplateView):
+    response_class = CachedPDFTemplateResponse
+    # document type for PDF_BACKENDS
+    pdf_document = None
+
+    # the rendering waits at most PDF_RENDER_TIMEOUT seconds, then the page with the job is returned,
+    # without the cache the result cannot be picked up later and the document is rendered in the request
+    def render_to_response(self, context, **response_kwargs):
+        response = super().render_to_response(context, **response_kwargs)
+        if not isinstance(response, CachedPDFTemplateResponse):
+            return response
+        response.backend = get_backend(self.pdf_document)
+        if not settings.PDF_CACHE_DIR:
+            return response
+        pages = response.render_pages()
+        key = cache_key(pages, response.cmd_options, response.backend)
+        content = cache_get(key)
+        if content is None:
+            try:
+                future = submit(key, pages, response.cmd_options.copy(), response.backend)
+            except RendererBusy:
+                return HttpResponse('Tisk je přetížen, zkuste to prosím za chvíli znovu.', status=503)
+            try:
+                content = future.result(timeout=min(settings.PDF_RENDER_TIMEOUT, MAX_RENDER_WAIT))
+            except TimeoutError:
+                return pending_response(self.request, key, response.filename)
+        response.content = content
+        return response
+
+
+class PDFJobView(LoginRequiredMixin, View):
+
+    def get(self, request, key):
+        if not settings.PDF_CACHE_DIR or not re.fullmatch('[0-9a-f]{64}', key):
+            raise Http404
+        filename = request.GET.get('filename') or 'dokument.pdf'
+        content = cache_get(key)
+        if content is not None:
+            return PDFResponse(content, filename=filename)
+        error = cache.get(error_key(key))
+        if error is not None:
+            return TemplateResponse(request, 'kitchen/pdf_pending.html', {'error': error}, status=500)
+        return pending_response(request, key, filename)
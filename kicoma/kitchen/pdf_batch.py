@@ -0,0 +1,170 @@
+import io
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.template.loader import get_template
+
+from . import pdf
+from .models import Allergen, DailyMenuRecipe, MealGroup, StockIssue, StockIssueArticle
+
+try:
+    import pypdf
+except ImportError:  # merging into one PDF is optional, the documents can be downloaded as a ZIP
+    pypdf = None
+
+DATE_FORMAT = '%d.%m.%Y'
+OUTPUTS = ('pdf', 'zip')
+
+
+class BatchError(Exception):
+    pass
+
+
+def check_output(output):
+    if output not in OUTPUTS:
+        raise BatchError('Nepodporovaný výstup {}'.format(output))
+    if output == 'pdf' and pypdf is None:
+        raise BatchError('Spojení do jednoho PDF vyžaduje knihovnu pypdf, stáhněte dokumenty jako ZIP')
+
+
+# (file name, context) of the daily menu of every day in the range, all days are loaded with one query
+def daily_menu_documents(date_from, date_to, ids=None, meal_group=None):
+    if ids:
+        raise BatchError('Denní menu se tisknou podle data, ne podle čísel dokladů')
+    if date_from is None or date_to is None:
+        raise BatchError('Zadejte období')
+    daily_menu_recipes = DailyMenuRecipe.objects.filter(daily_menu__date__range=(date_from, date_to))
+    meal_group_filter = None
+    if meal_group:
+        daily_menu_recipes = daily_menu_recipes.filter(daily_menu__meal_group=meal_group)
+        meal_group = MealGroup.objects.filter(pk=meal_group).first()
+        if meal_group is None:
+            raise BatchError('Neznámá skupina strávníků')
+        meal_group_filter = "Filtrováno pro skupinu strávníků: " + meal_group.meal_group
+    allergen_codes = Allergen.get_codes()
+    days = {}
+    for daily_menu_recipe in daily_menu_recipes.select_related(
+            'daily_menu__meal_group', 'daily_menu__meal_type', 'recipe').order_by('daily_menu__date', 'recipe__recipe'):
+        daily_menu_recipe.allergens = daily_menu_recipe.recipe.display_allergens(allergen_codes)
+        days.setdefault(daily_menu_recipe.daily_menu.date, []).append(daily_menu_recipe)
+    for date, recipes in days.items():
+        context = {'title': "Denní menu pro " + date.strftime(DATE_FORMAT), 'daily_menu_recipes': recipes}
+        if meal_group_filter:
+            context['meal_group_filter'] = meal_group_filter
+        yield 'Denni_menu-{}.pdf'.format(date.isoformat()), context
+
+
+# stock issues by id or created in the range, the totals and the lines of all stock issues are loaded with two queries
+def stock_issue_documents(date_from, date_to, ids=None, meal_group=None):
+    stock_issues = StockIssue.objects.with_totals().prefetch_related(Prefetch(
+        'stockissuearticle_set', to_attr='lines',
+        queryset=StockIssueArticle.objects.select_related('article').order_by('article__article')))
+    if ids:
+        stock_issues = stock_issues.filter(pk__in=ids)
+    elif date_from is not None and date_to is not None:
+        stock_issues = stock_issues.filter(created__date__range=(date_from, date_to))
+    else:
+        raise BatchError('Zadejte období nebo čísla výdejek')
+    for stock_issue in stock_issues.order_by('created', 'id'):
+        yield 'Výdejka-{}.pdf'.format(stock_issue.id), {
+            'title': "Výdejka", 'stock_issue': stock_issue, 'stock_issue_articles': stock_issue.lines,
+            'total_price': stock_issue.price_total}
+
+
+# document type: (template, documents)
+DOCUMENTS = {
+    'dailymenu': ('kitchen/dailymenu/pdf.html', daily_menu_documents),
+    'stockissue': ('kitchen/stockissue/pdf.html', stock_issue_documents),
+}
+
+
+# (file name, pages) of the documents, the HTML is rendered in this process from the loaded contexts
+def render_pages(document, date_from=None, date_to=None, ids=None, meal_group=None, request=None):
+    if document not in DOCUMENTS:
+        raise BatchError('Neznámý dokument {}'.format(document))
+    template_name, documents = DOCUMENTS[document]
+    template = get_template(template_name)
+    return [(filename, [pdf.render_html(template, context, request), None, None, None])
+            for filename, context in documents(date_from, date_to, ids, meal_group)]
+
+
+def convert(backend, pages):
+    return pdf.BACKENDS[backend](pages, {})
+
+
+# (file name, PDF) in the order of the pages, the documents missing in the cache are converted by the bounded
+# PDF renderer threads a few documents ahead, or by forked processes when processes is more than one,
+# which is safe only in a single threaded process like the print_batch command
+def render_documents(pages, backend='wkhtmltopdf', processes=1):
+    jobs = []
+    for filename, document_pages in pages:
+        key = pdf.cache_key(document_pages, {}, backend)
+        jobs.append((filename, key, document_pages, pdf.cache_get(key) if settings.PDF_CACHE_DIR else None))
+    if processes > 1:
+        yield from render_in_processes(jobs, backend, processes)
+        return
+    futures = {}
+    for number, (filename, key, document_pages, content) in enumerate(jobs):
+        if content is None:
+            for _, next_key, next_pages, next_content in jobs[number:]:
+                if len(futures) >= settings.PDF_RENDER_WORKERS:
+                    break
+                if next_content is None and next_key not in futures:
+                    futures[next_key] = pdf.submit(next_key, next_pages, {}, backend)
+            content = futures.pop(key).result()
+        yield filename, content
+
+
+def render_in_processes(jobs, backend, processes):
+    missing = [document_pages for _, _, document_pages, content in jobs if content is None]
+    executor = ProcessPoolExecutor(min(processes, len(missing)) or 1, mp_context=multiprocessing.get_context('fork'))
+    try:
+        rendered = executor.map(convert, repeat(backend), missing)
+        for filename, key, _, content in jobs:
+            if content is None:
+                content = next(rendered)
+                if settings.PDF_CACHE_DIR:
+                    pdf.cache_set(key, content)
+            yield filename, content
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def merge_pdf(documents, fileobj):
+    check_output('pdf')
+    writer = pypdf.PdfWriter()
+    for _, content in documents:
+        writer.append(io.BytesIO(content))
+    writer.write(fileobj)
+    return fileobj
+
+
+# file like object which hands over the written data, the ZIP is sent while the next documents are rendered
+class ZipStream:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, value):
+        self.chunks.append(bytes(value))
+        return len(value)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        content = b''.join(self.chunks)
+        self.chunks = []
+        return content
+
+
+def zip_chunks(documents):
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w') as archive:
+        for filename, content in documents:
+            archive.writestr(filename, content)
+            yield stream.pop()
+    yield stream.pop()
@@ -0,0 +1,142 @@
+import functools
+import io
+import re
+from html import escape
+from html.parser import HTMLParser
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.units import mm
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+except ImportError:  # the reportlab backend is optional
+    pdfmetrics = None
+
+FONT = 'KicomaSans'
+FONT_BOLD = 'KicomaSans-Bold'
+
+
+# blocks of the pages made from kitchen/pdf_page.html: headings, paragraphs and rTable tables
+class PageParser(HTMLParser):
+    IGNORED = ('head', 'title', 'style', 'script')
+    HEADINGS = ('h1', 'h2', 'h3', 'h4')
+
+    def __init__(self):
+        super().__init__()
+        self.blocks = []
+        self.tags = []
+        self.text = None
+        self.table = None
+
+    def handle_starttag(self, tag, attrs):
+        classes = (dict(attrs).get('class') or '').split()
+        self.tags.append((tag, classes))
+        if 'rTable' in classes:
+            self.table = {'rows': [], 'header': 0}
+            self.blocks.append(('table', self.table))
+        elif 'rTableRow' in classes and self.table is not None:
+            self.table['rows'].append([])
+        elif ('rTableHead' in classes or 'rTableCell' in classes) and self.table is not None:
+            self.text = []
+            if 'rTableHead' in classes and len(self.table['rows']) == 1:
+                self.table['header'] = 1
+        elif tag in self.HEADINGS or tag == 'p':
+            self.text = []
+        elif tag == 'br' and self.text is not None:
+            self.text.append('\n')
+
+    def handle_endtag(self, tag):
+        classes = []
+        while self.tags:
+            open_tag, classes = self.tags.pop()
+            if open_tag == tag:
+                break
+        if 'rTable' in classes:
+            self.table = None
+        elif ('rTableHead' in classes or 'rTableCell' in classes) and self.table is not None:
+            self.table['rows'][-1].append(self.collected())
+        elif tag in self.HEADINGS or tag == 'p':
+            text = self.collected()
+            if text:
+                self.blocks.append((tag, text))
+
+    def handle_data(self, data):
+        if self.text is not None and not any(tag in self.IGNORED for tag, _ in self.tags):
+            self.text.append(re.sub(r'\s+', ' ', data))
+
+    def collected(self):
+        text = '\n'.join(re.sub(' +', ' ', line).strip() for line in ''.join(self.text or []).split('\n'))
+        self.text = None
+        return text.strip()
+
+
+def parse_page(html):
+    parser = PageParser()
+    parser.feed(html)
+    parser.close()
+    return parser.blocks
+
+
+# TrueType fonts with the Czech characters, the built in fonts of reportlab cover only Latin-1
+@functools.lru_cache(maxsize=None)
+def register_fonts():
+    if pdfmetrics is None:
+        raise ImproperlyConfigured('PDF backend reportlab vyžaduje knihovnu reportlab')
+    pdfmetrics.registerFont(TTFont(FONT, settings.PDF_FONT))
+    pdfmetrics.registerFont(TTFont(FONT_BOLD, settings.PDF_FONT_BOLD))
+
+
+def styles():
+    return {
+        'h1': ParagraphStyle('h1', fontName=FONT_BOLD, fontSize=16, leading=20, alignment=TA_CENTER, spaceAfter=6),
+        'h3': ParagraphStyle('h3', fontName=FONT_BOLD, fontSize=11, leading=14, alignment=TA_CENTER,
+                             spaceBefore=8, spaceAfter=6),
+        'p': ParagraphStyle('p', fontName=FONT, fontSize=7, leading=9, alignment=TA_CENTER, spaceAfter=4),
+        'cell': ParagraphStyle('cell', fontName=FONT, fontSize=7, leading=9),
+        'head': ParagraphStyle('head', fontName=FONT_BOLD, fontSize=7, leading=9),
+    }
+
+
+def paragraph(text, style):
+    return Paragraph(escape(text).replace('\n', '<br/>'), style)
+
+
+def table(data, style, width):
+    columns = max(len(row) for row in data['rows'])
+    rows = [[paragraph(text, style['head'] if number < data['header'] else style['cell']) for text in row] +
+            [''] * (columns - len(row)) for number, row in enumerate(data['rows'])]
+    result = Table(rows, colWidths=[width / columns] * columns, repeatRows=data['header'])
+    commands = [
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#999999')),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ]
+    if data['header']:
+        commands.append(('BACKGROUND', (0, 0), (-1, data['header'] - 1), colors.HexColor('#CFCFCF')))
+    result.setStyle(TableStyle(commands))
+    return result
+
+
+# draw the page with reportlab instead of a browser engine, only the rTable layout of pdf_page.html is supported
+def render_page(html):
+    register_fonts()
+    style = styles()
+    output = io.BytesIO()
+    document = SimpleDocTemplate(output, pagesize=A4, leftMargin=10 * mm, rightMargin=10 * mm,
+                                 topMargin=10 * mm, bottomMargin=10 * mm)
+    flowables = []
+    for kind, content in parse_page(html):
+        if kind == 'table':
+            if content['rows']:
+                flowables.append(table(content, style, document.width))
+                flowables.append(Spacer(0, 4 * mm))
+        else:
+            flowables.append(paragraph(content, style.get(kind, style['h3'] if kind.startswith('h') else style['p'])))
+    document.build(flowables)
+    return output.getvalue()
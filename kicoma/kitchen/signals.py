@@ -0,0 +1,55 @@
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Allergen, Article, Recipe, RecipeArticle
+
+# Article fields which change the average price or the unit conversion of the recipe articles
+ARTICLE_PRICE_FIELDS = {'unit', 'on_stock', 'total_price', 'last_price'}
+
+
+@receiver(post_save, sender=Article)
+def article_saved(sender, instance, created, raw, update_fields, **kwargs):
+    # fixtures are loaded as raw data, prices are recalculated after the import
+    if raw or created:
+        return
+    if update_fields is not None and not ARTICLE_PRICE_FIELDS.intersection(update_fields):
+        return
+    Recipe.update_prices_for_articles([instance.id])
+
+
+@receiver(m2m_changed, sender=Article.allergen.through)
+def article_allergens_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        Article.update_allergens([instance.id])
+    elif action == 'post_clear':
+        Article.update_allergens()
+    else:
+        Article.update_allergens(pk_set)
+
+
+@receiver(post_delete, sender=Allergen)
+def allergen_deleted(sender, instance, **kwargs):
+    # relations to articles are deleted without m2m_changed
+    articles = Article.objects.annotate(allergen_match=F('allergen_mask').bitand(instance.mask)) \
+        .exclude(allergen_match=0).values_list('id', flat=True)
+    Article.update_allergens(list(articles))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, raw, **kwargs):
+    # portion price depends on the norm amount
+    if raw or created:
+        return
+    Recipe.update_prices([instance.id])
+
+
+@receiver(post_save, sender=RecipeArticle)
+@receiver(post_delete, sender=RecipeArticle)
+def recipe_article_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    Recipe.update_prices([instance.recipe_id])
+    Recipe.update_allergens([instance.recipe_id])
@@ -0,0 +1,110 @@
+import io
+import json
+import tarfile
+import tempfile
+
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.utils import timezone
+
+MANIFEST = 'manifest.json'
+VERSION = 1
+
+
+class SnapshotError(Exception):
+    pass
+
+
+# all tables of the kitchen app including many to many relations and the article history
+def snapshot_models():
+    return list(apps.get_app_config('kitchen').get_models(include_auto_created=True))
+
+
+def last_migration():
+    return MigrationRecorder.Migration.objects.filter(app='kitchen').order_by('-id').values_list(
+        'name', flat=True).first()
+
+
+def table_columns(model):
+    return [field.column for field in model._meta.local_concrete_fields]
+
+
+def add_file(archive, name, fileobj, size):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(timezone.now().timestamp())
+    archive.addfile(info, fileobj)
+
+
+# write a gzipped tar archive with one CSV file per table made by COPY and a manifest
+def create_snapshot(fileobj):
+    manifest = {'version': VERSION, 'created': timezone.now().isoformat(), 'migration': last_migration(),
+                'tables': []}
+    # a transaction which is already running, e.g. in tests, cannot change its isolation level,
+    # SnapshotView is therefore excluded from ATOMIC_REQUESTS
+    new_transaction = not connection.in_atomic_block
+    with transaction.atomic(), tarfile.open(fileobj=fileobj, mode='w:gz') as archive:
+        with connection.cursor() as cursor:
+            # all tables are copied from the same snapshot of the database
+            if new_transaction:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+            for model in snapshot_models():
+                table = model._meta.db_table
+                columns = table_columns(model)
+                with tempfile.SpooledTemporaryFile(max_size=10 * 1024 * 1024) as data:
+                    cursor.copy_expert('COPY {} ({}) TO STDOUT WITH (FORMAT csv)'.format(
+                        connection.ops.quote_name(table),
+                        ', '.join(connection.ops.quote_name(column) for column in columns)), data)
+                    rows = cursor.rowcount
+                    size = data.tell()
+                    data.seek(0)
+                    add_file(archive, table + '.csv', data, size)
+                manifest['tables'].append({'model': model._meta.label, 'table': table, 'columns': columns,
+                                           'rows': rows})
+        content = json.dumps(manifest, indent=2).encode()
+        add_file(archive, MANIFEST, io.BytesIO(content), len(content))
+    return manifest
+
+
+# replace the kitchen tables with the snapshot, foreign keys are checked at the end of the transaction
+def restore_snapshot(fileobj):
+    with tarfile.open(fileobj=fileobj, mode='r:gz') as archive:
+        try:
+            manifest = json.load(archive.extractfile(MANIFEST))
+        except KeyError:
+            raise SnapshotError('Archiv neobsahuje {}'.format(MANIFEST))
+        if manifest.get('version') != VERSION:
+            raise SnapshotError('Nepodporovaná verze snímku {}'.format(manifest.get('version')))
+        if manifest.get('migration') != last_migration():
+            raise SnapshotError('Snímek je z verze databáze {}, aktuální verze je {}'.format(
+                manifest.get('migration'), last_migration()))
+        models = {model._meta.label: model for model in snapshot_models()}
+        # the table and the columns are taken from the models, the manifest only selects and orders them
+        tables = []
+        for table in manifest['tables']:
+            model = models.get(table.get('model'))
+            if model is None:
+                raise SnapshotError('Neznámá tabulka {}'.format(table.get('model')))
+            columns = table_columns(model)
+            unknown = [column for column in table.get('columns', []) if column not in columns]
+            if unknown or not table.get('columns'):
+                raise SnapshotError('Neznámé sloupce {} tabulky {}'.format(
+                    ', '.join(map(str, unknown)), table['model']))
+            tables.append((model._meta.db_table, [column for column in table['columns'] if column in columns]))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+            cursor.execute('TRUNCATE {}'.format(', '.join(
+                connection.ops.quote_name(model._meta.db_table) for model in models.values())))
+            for db_table, columns in tables:
+                try:
+                    data = archive.extractfile(db_table + '.csv')
+                except KeyError:
+                    raise SnapshotError('Archiv neobsahuje {}.csv'.format(db_table))
+                cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+                    connection.ops.quote_name(db_table),
+                    ', '.join(connection.ops.quote_name(column) for column in columns)), data)
+            for sql in connection.ops.sequence_reset_sql(no_style(), list(models.values())):
+                cursor.execute(sql)
+    return manifest
@@ -0,0 +1,63 @@
+import csv
+import tempfile
+
+from openpyxl import Workbook
+
+from . import admin
+from .export import queryset_chunks
+
+FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+}
+
+
+# import export resources of kitchen/admin.py by the lower case model name
+def get_resources():
+    return {resource._meta.model._meta.model_name: resource for name, resource in vars(admin).items()
+            if name.endswith('Resource') and getattr(getattr(resource, '_meta', None), 'model', None)}
+
+
+# queryset of the resource in chunks with the exported foreign keys joined and many to many relations prefetched
+def resource_chunks(resource):
+    queryset = resource.get_queryset()
+    model = queryset.model
+    names = [field.attribute for field in resource.get_export_fields() if field.attribute]
+    queryset = queryset.select_related(*[field.name for field in model._meta.fields
+                                         if field.is_relation and field.name in names])
+    prefetch = [field.name for field in model._meta.many_to_many if field.name in names]
+    if not queryset.ordered:
+        queryset = queryset.order_by(model._meta.pk.name)
+    yield from queryset_chunks(queryset, prefetch)
+
+
+def export_rows(resource):
+    yield resource.get_export_headers()
+    for chunk in resource_chunks(resource):
+        for obj in chunk:
+            yield resource.export_resource(obj)
+
+
+# file like object which returns the written data, the csv writer writes directly into the response
+class Echo:
+    def write(self, value):
+        return value
+
+
+def export_csv(resource):
+    writer = csv.writer(Echo())
+    for row in export_rows(resource):
+        yield writer.writerow(row).encode()
+
+
+# the rows of a write only worksheet are kept in a temporary file by openpyxl until the workbook is saved
+def export_xlsx(resource, fileobj=None):
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(resource._meta.model._meta.model_name)
+    for row in export_rows(resource):
+        worksheet.append(row)
+    if fileobj is None:
+        fileobj = tempfile.TemporaryFile()
+    workbook.save(fileobj)
+    fileobj.seek(0)
+    return fileobj
@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import Group, ContentType, Permission
+from django.contrib.sessions.models import Session
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+
+from kicoma.users.models import User
+
+from .models import StockIssueArticle, StockReceiptArticle, Recipe, Allergen, MealType, MealGroup, \
+    VAT, Article, HistoricalArticle, RecipeArticle, StockIssue, StockReceipt, DailyMenu, DailyMenuRecipe
+
+CACHE_KEY = 'kitchen_statistics'
+
+# names used by the about page and the counted models
+STATISTICS_MODELS = {
+    'allergenCount': Allergen,
+    'meal_typeCount': MealType,
+    'mealGroupCount': MealGroup,
+    'vatCount': VAT,
+    'recipeCount': Recipe,
+    'recipe_article_count': RecipeArticle,
+    'article_count': Article,
+    'article_allergen_count': Article.allergen.through,
+    'historical_article_count': HistoricalArticle,
+    'stockIssueCount': StockIssue,
+    'stockReceiptCount': StockReceipt,
+    'stock_issue_article_count': StockIssueArticle,
+    'stock_receipt_article_count': StockReceiptArticle,
+    'dailyMenuCount': DailyMenu,
+    'dailyMenuRecipeCount': DailyMenuRecipe,
+    'groupCount': Group,
+    'userCount': User,
+    'content_type_count': ContentType,
+    'permission_count': Permission,
+    'migration_count': MigrationRecorder.Migration,
+    'session_count': Session,
+    'site_count': Site,
+    'user_group_rel_count': User.groups.through,
+}
+
+
+# planner row estimates from the last ANALYZE, tables which were never analyzed are missing
+def estimate_counts(tables):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND reltuples >= 0 "
+                       "AND pg_table_is_visible(oid) AND relname = ANY(%s)", [list(tables)])
+        return {table: int(reltuples) for table, reltuples in cursor.fetchall()}
+
+
+def exact_count(table):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM ' + connection.ops.quote_name(table))
+        return cursor.fetchone()[0]
+
+
+# every thread has its own database connection which has to be closed
+def exact_count_in_thread(table):
+    try:
+        return exact_count(table)
+    finally:
+        connection.close()
+
+
+# returns ({name: count}, names of estimated counts)
+def collect_statistics(exact_count_limit=None, workers=None):
+    exact_count_limit = settings.STATISTICS_EXACT_COUNT_LIMIT if exact_count_limit is None else exact_count_limit
+    workers = settings.STATISTICS_WORKERS if workers is None else workers
+    tables = {name: model._meta.db_table for name, model in STATISTICS_MODELS.items()}
+    estimates = estimate_counts(tables.values())
+    counts = {}
+    estimated = set()
+    exact_tables = set()
+    for name, table in tables.items():
+        if estimates.get(table, 0) > exact_count_limit:
+            counts[name] = estimates[table]
+            estimated.add(name)
+        else:
+            exact_tables.add(table)
+    if workers > 1 and len(exact_tables) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            exact_counts = dict(zip(exact_tables, executor.map(exact_count_in_thread, exact_tables)))
+    else:
+        exact_counts = {table: exact_count(table) for table in exact_tables}
+    for name, table in tables.items():
+        if name not in estimated:
+            counts[name] = exact_counts[table]
+    return counts, estimated
+
+
+# statistics for the about page, cached for STATISTICS_CACHE_TIMEOUT seconds
+def get_statistics():
+    statistics = cache.get(CACHE_KEY)
+    if statistics is None:
+        counts, estimated = collect_statistics()
+        statistics = dict(counts, total_records=sum(counts.values()), estimated=sorted(estimated))
+        cache.set(CACHE_KEY, statistics, settings.STATISTICS_CACHE_TIMEOUT)
+    return statistics
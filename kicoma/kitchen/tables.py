@@ -1,14 +1,24 @@
 import django_tables2 as tables
-from django_filters import FilterSet, CharFilter, DateFilter
+from django_filters import FilterSet, CharFilter, DateFilter, ModelMultipleChoiceFilter
 from django.contrib.humanize.templatetags.humanize import intcomma
 
-from .models import Recipe, RecipeArticle, StockReceipt, StockIssue, Article, DailyMenu, \
+from .models import Allergen, Recipe, RecipeArticle, StockReceipt, StockIssue, Article, DailyMenu, \
     Menu, MenuRecipe, StockIssueArticle, StockReceiptArticle, DailyMenuRecipe
 
 
-class ArticleTable(tables.Table):
+class AllergenCodesMixin:
+    allergen_codes = None
+
+    # allergen codes are loaded once for the whole table
+    def render_allergens(self, record):
+        if self.allergen_codes is None:
+            self.allergen_codes = Allergen.get_codes()
+        return record.display_allergens(self.allergen_codes)
+
+
+class ArticleTable(AllergenCodesMixin, tables.Table):
     average_price = tables.Column(verbose_name='Průměrná jednotková cena s DPH')
-    allergens = tables.TemplateColumn('''{{record.display_allergens}}''', verbose_name='Alergeny')
+    allergens = tables.Column(verbose_name='Alergeny', empty_values=(), orderable=False)
     change = tables.TemplateColumn(
         '''<a href="/kitchen/article/update/{{ record.id }}">Upravit</a>
         | <a href="/kitchen/article/history/{{ record.id }}">Historie</a>
@@ -39,8 +49,8 @@ class ArticleTable(tables.Table):
         return '{} {}'.format(value, record.unit)
 
 
-class ArticleRestrictedTable(tables.Table):
-    allergen = tables.TemplateColumn('''{{record.display_allergens}}''', verbose_name='Alergeny')
+class ArticleRestrictedTable(AllergenCodesMixin, tables.Table):
+    allergens = tables.Column(verbose_name='Alergeny', empty_values=(), orderable=False)
     change = tables.TemplateColumn(
         '''<a href="/kitchen/article/restrictedupdate/{{ record.id }}">Upravit</a>''',
         verbose_name=u'Akce', )
@@ -49,7 +59,7 @@ class ArticleRestrictedTable(tables.Table):
         model = Article
         template_name = "django_tables2/bootstrap4.html"
         attrs = {"class": "table table-striped table-hover table-sm"}
-        fields = ("article", "unit", "min_on_stock", "allergen", "comment", "change")
+        fields = ("article", "unit", "min_on_stock", "allergens", "comment", "change")
 
     @staticmethod
     def render_min_on_stock(value, record):
@@ -64,9 +74,8 @@ class ArticleFilter(FilterSet):
         fields = ("article",)
 
 
-class RecipeTable(tables.Table):
-    total_recipe_articles_price = tables.Column(verbose_name='Cena receptu s DPH')
-    allergens = tables.Column(verbose_name='Alergeny', empty_values=())
+class RecipeTable(AllergenCodesMixin, tables.Table):
+    allergens = tables.Column(verbose_name='Alergeny', empty_values=(), orderable=False)
     change = tables.TemplateColumn(
         '''<a href="/kitchen/recipe/update/{{ record.id }}">Upravit</a>
         | <a href="/kitchen/recipe/articlelist/{{ record.id }}">Zobrazit ingredience</a>
@@ -79,24 +88,30 @@ class RecipeTable(tables.Table):
         model = Recipe
         template_name = "django_tables2/bootstrap4.html"
         attrs = {"class": "table table-striped table-hover table-sm"}
-        fields = ("recipe", "norm_amount", "total_recipe_articles_price", "allergens", "change")
+        fields = ("recipe", "norm_amount", "total_price", "portion_price", "allergens", "change")
 
     @staticmethod
-    def render_total_recipe_articles_price(value):
+    def render_total_price(value):
         return '{} Kč'.format(intcomma(value))
 
     @staticmethod
-    def render_allergens(record):
-        return record.get_allergens(record.id)
+    def render_portion_price(value):
+        return '{} Kč'.format(intcomma(value))
 
 
 class RecipeFilter(FilterSet):
     recipe = CharFilter(lookup_expr='icontains')
+    without_allergens = ModelMultipleChoiceFilter(queryset=Allergen.objects.all(), label='Bez alergenů',
+                                                  method='filter_without_allergens')
 
     class Meta:
         model = Recipe
         fields = ("recipe",)
 
+    @staticmethod
+    def filter_without_allergens(queryset, name, value):
+        return Recipe.without_allergens(queryset, value) if value else queryset
+
 
 class RecipeArticleTable(tables.Table):
     # average_price = tables.Column(accessor="article.average_price", verbose_name="Průměrná jednotková cena s DPH")
@@ -205,7 +220,10 @@ class MenuRecipeTable(tables.Table):
 
 
 class StockIssueTable(tables.Table):
-    total_price = tables.Column(verbose_name='Celková cena s DPH')
+    user_created = tables.Column(accessor='user_created_name', verbose_name='Vytvořil')
+    user_approved = tables.Column(accessor='user_approved_name', verbose_name='Vyskladnil')
+    article_count = tables.Column(verbose_name='Počet položek')
+    total_price = tables.Column(accessor='price_total', verbose_name='Celková cena s DPH')
     change = tables.TemplateColumn(
         '''<a href="/kitchen/stockissue/update/{{ record.id }}">Upravit poznámku</a>
         | <a href="/kitchen/stockissue/articlelist/{{ record.id }}">Zobrazit zboží</a>
@@ -223,7 +241,7 @@ class StockIssueTable(tables.Table):
         template_name = "django_tables2/bootstrap4.html"
         attrs = {"class": "table table-striped table-hover table-sm"}
         fields = ("created", "user_created", "approved", "date_approved",
-                  "user_approved", "total_price", "comment", "change")
+                  "user_approved", "article_count", "total_price", "comment", "change")
 
     @staticmethod
     def render_total_price(value):
@@ -265,7 +283,10 @@ class StockIssueArticleTable(tables.Table):
 
 
 class StockReceiptTable(tables.Table):
-    total_price = tables.Column(verbose_name='Celková cena s DPH')
+    user_created = tables.Column(accessor='user_created_name', verbose_name='Vytvořil')
+    user_approved = tables.Column(accessor='user_approved_name', verbose_name='Naskladnil')
+    article_count = tables.Column(verbose_name='Počet položek')
+    total_price = tables.Column(accessor='price_total', verbose_name='Celková cena s DPH')
     change = tables.TemplateColumn(
         '''<a href="/kitchen/stockreceipt/update/{{ record.id }}">Upravit</a>
         | <a href="/kitchen/stockreceipt/articlelist/{{ record.id }}">Zobrazit zboží</a>
@@ -279,7 +300,7 @@ class StockReceiptTable(tables.Table):
         template_name = "django_tables2/bootstrap4.html"
         attrs = {"class": "table table-striped table-hover table-sm"}
         fields = ("date_created", "user_created", "approved", "date_approved",
-                  "user_approved", "total_price", "comment", "change")
+                  "user_approved", "article_count", "total_price", "comment", "change")
 
     @staticmethod
     def render_total_price(value):
@@ -0,0 +1,55 @@
+import functools
+import posixpath
+import re
+
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils.safestring import mark_safe
+from wkhtmltopdf.utils import pathname2fileurl
+
+register = template.Library()
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+CSS_SPACE = re.compile(r'\s*([{}:;,>])\s*')
+CSS_URL = re.compile(r'''url\(\s*(['"]?)(?!data:|[a-z]+://|/)([^'")]+)\1\s*\)''')
+
+
+# path of a static file in STATIC_ROOT, the finders search only the static directories when the files
+# are not collected
+def static_path(path):
+    if settings.STATIC_ROOT and staticfiles_storage.exists(path):
+        return staticfiles_storage.path(path)
+    found = finders.find(path)
+    if found is None:
+        raise template.TemplateSyntaxError('Statický soubor {} neexistuje'.format(path))
+    return found
+
+
+def minify_css(css):
+    css = CSS_COMMENT.sub('', css)
+    css = CSS_SPACE.sub(r'\1', css)
+    return re.sub(r'\s+', ' ', css).replace(';}', '}').strip()
+
+
+# relative urls of fonts and images are rewritten to file:// urls of the static files
+@functools.lru_cache(maxsize=None)
+def compiled_stylesheet(path):
+    with open(static_path(path), encoding='utf-8') as f:
+        css = minify_css(f.read())
+    directory = posixpath.dirname(path)
+    return CSS_URL.sub(lambda match: 'url("{}")'.format(
+        pathname2fileurl(static_path(posixpath.normpath(posixpath.join(directory, match.group(2)))))), css)
+
+
+# the stylesheet is inlined so wkhtmltopdf does not load anything over HTTP, it is compiled once per process
+@register.simple_tag
+def pdf_stylesheet(path='css/pdf.css'):
+    css = compiled_stylesheet(path) if not settings.DEBUG else compiled_stylesheet.__wrapped__(path)
+    return mark_safe('<style type="text/css">{}</style>'.format(css))
+
+
+@register.simple_tag
+def pdf_static(path):
+    return pathname2fileurl(static_path(path))
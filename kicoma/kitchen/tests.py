@@ -1,5 +1,36 @@
-from django.test import TestCase
+import datetime
+import gzip
+import io
+import json
+import os
+import tarfile
+import tempfile
+import threading
+import unittest
+from decimal import Decimal
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles import finders
+from django.core import management
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 import urllib.parse
+import zipfile
+
+from tablib import Dataset
+
+from kicoma.users.tests.factories import UserFactory
+
+from . import analytics, dataimport, export, pdf, pdf_batch, pdf_reportlab, snapshot, statistics
+from .admin import ArticleResource, StockIssueArticleResource
+from .templatetags import pdf_assets
+from .functions import convert_units, convert_units_array, convert_units_expression
+from .models import Allergen, Article, Recipe, RecipeArticle, DailyMenu, DailyMenuRecipe, MealGroup, MealType, \
+    StockIssue, StockIssueArticle, StockMovement, StockReceipt, StockReceiptArticle, VAT
 
 
 class ViewTests(TestCase):
@@ -99,3 +130,1059 @@ class ViewTests(TestCase):
             self.assertRedirects(response, "/accounts/login/?next="+urllib.parse.quote(url), status_code=302,
                                  target_status_code=200, msg_prefix='', fetch_redirect_response=True)
             # self.assertEqual(response.status_code, 302, msg=url)
+
+
+class RecipePriceTests(TestCase):
+
+    def setUp(self):
+        self.flour = Article.objects.create(article='Mouka', unit='kg', on_stock=10, total_price=200)
+        self.milk = Article.objects.create(article='Mléko', unit='l', on_stock=4, total_price=100)
+        self.recipe = Recipe.objects.create(recipe='Palačinky', norm_amount=10)
+        RecipeArticle.objects.create(recipe=self.recipe, article=self.flour, amount=500, unit='g')
+        RecipeArticle.objects.create(recipe=self.recipe, article=self.milk, amount=2, unit='l')
+
+    def test_recipe_article_change_updates_price(self):
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.total_price, Decimal('60.00'))
+        self.assertEqual(self.recipe.portion_price, Decimal('6.00'))
+        RecipeArticle.objects.filter(article=self.milk).get().delete()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.total_price, Decimal('10.00'))
+
+    def test_article_price_change_updates_price(self):
+        self.flour.total_price = 400
+        self.flour.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.total_price, Decimal('70.00'))
+
+    def test_norm_amount_change_updates_portion_price(self):
+        self.recipe.norm_amount = 20
+        self.recipe.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.portion_price, Decimal('3.00'))
+
+    def test_recipe_list_reads_stored_prices(self):
+        with self.assertNumQueries(1):
+            prices = list(Recipe.objects.values_list('total_price', 'portion_price'))
+        self.assertEqual(prices, [(Decimal('60.00'), Decimal('6.00'))])
+
+
+class StockIssueFromDailyMenuTests(TestCase):
+
+    def setUp(self):
+        self.flour = Article.objects.create(article='Mouka', unit='kg', on_stock=10, total_price=200)
+        self.milk = Article.objects.create(article='Mléko', unit='l', on_stock=4, total_price=100)
+        pancakes = Recipe.objects.create(recipe='Palačinky', norm_amount=10)
+        RecipeArticle.objects.create(recipe=pancakes, article=self.flour, amount=500, unit='g')
+        RecipeArticle.objects.create(recipe=pancakes, article=self.milk, amount=2, unit='l')
+        bread = Recipe.objects.create(recipe='Chléb', norm_amount=5)
+        RecipeArticle.objects.create(recipe=bread, article=self.flour, amount=1, unit='kg')
+        daily_menu = DailyMenu.objects.create(
+            date=datetime.date(2022, 3, 1), meal_group=MealGroup.objects.create(meal_group='Děti'),
+            meal_type=MealType.objects.create(meal_type='Oběd'))
+        DailyMenuRecipe.objects.create(daily_menu=daily_menu, recipe=pancakes, amount=20)
+        DailyMenuRecipe.objects.create(daily_menu=daily_menu, recipe=bread, amount=10)
+
+    def test_articles_are_consolidated(self):
+        daily_menus = DailyMenu.objects.filter(date=datetime.date(2022, 3, 1))
+        count = StockIssue.create_from_daily_menu(daily_menus, '01.03.2022', UserFactory())
+        self.assertEqual(count, 2)
+        stock_issue = StockIssue.objects.get()
+        self.assertEqual(stock_issue.comment, 'Pro 01.03.2022')
+        lines = StockIssueArticle.objects.filter(stock_issue=stock_issue)
+        self.assertEqual(
+            sorted(lines.values_list('article__article', 'amount', 'unit', 'average_unit_price')),
+            [('Mléko', Decimal('4.00'), 'l', Decimal('25.00')), ('Mouka', Decimal('3.00'), 'kg', Decimal('20.00'))])
+
+
+class StockIssueApproveTests(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.flour = Article.objects.create(article='Mouka', unit='kg', on_stock=10, total_price=200)
+        self.milk = Article.objects.create(article='Mléko', unit='l', on_stock=4, total_price=100)
+        self.stock_issue = StockIssue.objects.create(user_created=self.user, comment='Pro 01.03.2022')
+        StockIssueArticle.objects.create(stock_issue=self.stock_issue, article=self.flour, amount=0.5, unit='kg')
+        StockIssueArticle.objects.create(stock_issue=self.stock_issue, article=self.flour, amount=1, unit='kg')
+        StockIssueArticle.objects.create(stock_issue=self.stock_issue, article=self.milk, amount=2, unit='l')
+
+    def test_approve_updates_articles_in_bulk(self):
+        self.assertEqual(self.stock_issue.approve(self.user), '')
+        self.flour.refresh_from_db()
+        self.milk.refresh_from_db()
+        self.assertEqual((self.flour.on_stock, self.flour.total_price), (Decimal('8.50'), Decimal('170.00')))
+        self.assertEqual((self.milk.on_stock, self.milk.total_price), (Decimal('2.00'), Decimal('50.00')))
+        self.assertEqual(self.flour.history.first().history_change_reason, 'Výdej - Pro 01.03.2022')
+        self.assertEqual(self.flour.history.first().history_user, self.user)
+        self.stock_issue.refresh_from_db()
+        self.assertTrue(self.stock_issue.approved)
+        self.assertEqual(self.stock_issue.user_approved, self.user)
+
+    def test_approve_refuses_missing_articles(self):
+        StockIssueArticle.objects.create(stock_issue=self.stock_issue, article=self.milk, amount=3, unit='l')
+        self.assertEqual(self.stock_issue.approve(self.user), 'Mléko - na výdejce 5.00, na skladu 4.00<br/>')
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.on_stock, Decimal('4.00'))
+        self.stock_issue.refresh_from_db()
+        self.assertFalse(self.stock_issue.approved)
+
+
+class StockReceiptApproveTests(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.vat = VAT.objects.create(percentage=10, rate='Druhá snížená sazba DPH')
+        self.flour = Article.objects.create(article='Mouka', unit='kg', on_stock=10, total_price=200)
+        self.milk = Article.objects.create(article='Mléko', unit='l')
+        self.stock_receipt = StockReceipt.objects.create(user_created=self.user, comment='Makro')
+        for article, amount in ((self.flour, 5), (self.flour, 5), (self.milk, 10)):
+            StockReceiptArticle.objects.create(stock_receipt=self.stock_receipt, article=article, amount=amount,
+                                               unit=article.unit, price_without_vat=10, vat=self.vat)
+
+    def test_approve_updates_articles_in_bulk(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.stock_receipt.approve(self.user), Decimal('220.00'))
+        self.assertEqual(len(queries), 11)
+        # the articles are locked in the id order before they are updated
+        locks = [number for number, query in enumerate(queries) if query['sql'].endswith('FOR UPDATE')]
+        updates = [number for number, query in enumerate(queries)
+                   if query['sql'].startswith('UPDATE "kitchen_article"')]
+        self.assertEqual(len(locks), 1)
+        self.assertIn('ORDER BY "kitchen_article"."id" ASC', queries[locks[0]]['sql'])
+        self.assertLess(locks[0], updates[0])
+        self.flour.refresh_from_db()
+        self.milk.refresh_from_db()
+        self.assertEqual((self.flour.on_stock, self.flour.total_price), (Decimal('20.00'), Decimal('310.00')))
+        self.assertEqual((self.milk.on_stock, self.milk.total_price), (Decimal('10.00'), Decimal('110.00')))
+        history = self.flour.history.first()
+        self.assertEqual((history.on_stock, history.history_change_reason), (Decimal('20.00'), 'Příjem - Makro'))
+        self.stock_receipt.refresh_from_db()
+        self.assertTrue(self.stock_receipt.approved)
+
+    def test_approve_stores_last_price(self):
+        StockReceiptArticle.objects.filter(article=self.milk).update(price_without_vat=Decimal('10.33'))
+        self.stock_receipt.approve(self.user)
+        milk = Article.objects.get(pk=self.milk.id)
+        self.assertEqual(milk.last_price, Decimal('11.36'))
+        milk.on_stock = 0
+        with self.assertNumQueries(0):
+            self.assertEqual(milk.average_price, Decimal('11.36'))
+
+    def test_last_price_in_article_unit(self):
+        stock_receipt = StockReceipt.objects.create(user_created=self.user, comment='Trh')
+        StockReceiptArticle.objects.create(stock_receipt=stock_receipt, article=self.flour, amount=500, unit='g',
+                                           price_without_vat=Decimal('0.10'), vat=self.vat)
+        stock_receipt.approve(self.user)
+        self.assertEqual(Article.objects.get(pk=self.flour.id).last_price, Decimal('110.00'))
+
+    def test_empty_receipt_is_not_approved(self):
+        StockReceiptArticle.objects.all().delete()
+        self.assertEqual(self.stock_receipt.approve(self.user), 0)
+        self.stock_receipt.refresh_from_db()
+        self.assertFalse(self.stock_receipt.approved)
+
+
+class ConvertUnitsTests(TestCase):
+
+    def test_convert_units(self):
+        self.assertEqual(convert_units(Decimal('1.5'), 'kg', 'g'), Decimal('1500'))
+        self.assertEqual(convert_units(Decimal('250'), 'g', 'kg'), Decimal('0.25'))
+        self.assertEqual(convert_units(Decimal('2'), 'ks', 'ks'), Decimal('2'))
+        with self.assertRaises(ValidationError):
+            convert_units(Decimal('2'), 'ks', 'kg')
+
+    def test_convert_units_array(self):
+        self.assertEqual(convert_units_array([Decimal('1'), Decimal('50')], ['l', 'ml'], 'l'),
+                         [Decimal('1'), Decimal('0.5')])
+        self.assertEqual(convert_units_array([Decimal('1.5'), Decimal('2'), Decimal('250')], ['kg', 'ks', 'g'],
+                                             ['g', 'ks', 'kg']),
+                         [Decimal('1500'), Decimal('2'), Decimal('0.25')])
+        with self.assertRaisesMessage(ValidationError, 'Není možné provést konverzi 3 ks na kg'):
+            convert_units_array([Decimal('1'), Decimal('3')], ['g', 'ks'], 'kg')
+
+    def test_convert_units_expression(self):
+        article = Article.objects.create(article='Mouka', unit='kg')
+        for amount, unit in ((500, 'g'), (2, 'kg'), (3, 'ks')):
+            RecipeArticle.objects.create(recipe=Recipe.objects.create(recipe=unit, norm_amount=1), article=article,
+                                         amount=amount, unit=unit)
+        converted = RecipeArticle.objects.annotate(
+            converted=convert_units_expression('amount', 'unit', 'article__unit')).order_by('unit')
+        self.assertEqual([(ra.unit, ra.converted) for ra in converted],
+                         [('g', Decimal('0.5')), ('kg', Decimal('2')), ('ks', None)])
+
+    def test_stock_document_totals(self):
+        user = UserFactory()
+        article = Article.objects.create(article='Mouka', unit='kg')
+        stock_issue = StockIssue.objects.create(user_created=user)
+        StockIssueArticle.objects.create(stock_issue=stock_issue, article=article, amount=500, unit='g',
+                                         average_unit_price=Decimal('20.50'))
+        StockIssueArticle.objects.create(stock_issue=stock_issue, article=article, amount=1, unit='kg',
+                                         average_unit_price=Decimal('20'))
+        with self.assertNumQueries(1):
+            self.assertEqual(stock_issue.total_price, Decimal('30.25'))
+        stock_receipt = StockReceipt.objects.create(user_created=user)
+        vat = VAT.objects.create(percentage=15, rate='První snížená sazba DPH')
+        StockReceiptArticle.objects.create(stock_receipt=stock_receipt, article=article, amount=3, unit='kg',
+                                           price_without_vat=Decimal('10.33'), vat=vat)
+        StockReceiptArticle.objects.create(stock_receipt=stock_receipt, article=article, amount=1, unit='kg',
+                                           price_without_vat=Decimal('10.33'), vat=vat)
+        with self.assertNumQueries(1):
+            self.assertEqual(stock_receipt.total_price, Decimal('47.52'))
+
+
+class StockListTotalsTests(TestCase):
+    fixtures = ['skupiny.json']
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_login(self.user)
+        article = Article.objects.create(article='Mouka', unit='kg')
+        vat = VAT.objects.create(percentage=15, rate='První snížená sazba DPH')
+        for i in range(1, 4):
+            stock_issue = StockIssue.objects.create(user_created=self.user, comment=str(i))
+            stock_receipt = StockReceipt.objects.create(user_created=self.user, comment=str(i))
+            for j in range(i):
+                StockIssueArticle.objects.create(stock_issue=stock_issue, article=article, amount=500, unit='g',
+                                                 average_unit_price=Decimal('20.50'))
+                StockReceiptArticle.objects.create(stock_receipt=stock_receipt, article=article, amount=3,
+                                                   unit='kg', price_without_vat=Decimal('10.33'), vat=vat)
+
+    def test_with_totals(self):
+        with self.assertNumQueries(1):
+            stock_issues = list(StockIssue.objects.with_totals().order_by('comment'))
+        self.assertEqual([(si.article_count, si.price_total) for si in stock_issues],
+                         [(1, Decimal('10.25')), (2, Decimal('20.50')), (3, Decimal('30.75'))])
+        self.assertEqual(stock_issues[0].user_created_name, self.user.username)
+        with self.assertNumQueries(1):
+            stock_receipts = list(StockReceipt.objects.with_totals().order_by('comment'))
+        self.assertEqual([(sr.article_count, sr.price_total) for sr in stock_receipts],
+                         [(1, Decimal('35.64')), (2, Decimal('71.28')), (3, Decimal('106.92'))])
+
+    def test_list_views(self):
+        for url in ('/kitchen/stockissue/list', '/kitchen/stockreceipt/list'):
+            # has_group queries the groups on every use, only the other queries are counted
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'sort': '-total_price'})
+            self.assertEqual(len([query for query in queries if 'auth_group' not in query['sql']]), 6)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([record.article_count for record in response.context['table'].page.object_list.data],
+                             [3, 2, 1])
+            # newest first without sorting
+            response = self.client.get(url)
+            self.assertTrue(response.context['table'].data.data.ordered)
+            self.assertEqual([record.comment for record in response.context['table'].page.object_list.data],
+                             ['3', '2', '1'])
+
+
+class AllergenMaskTests(TestCase):
+
+    def setUp(self):
+        self.gluten = Allergen.objects.create(code='01', description='Lepek')
+        self.milk_allergen = Allergen.objects.create(code='07', description='Mléko')
+        self.flour = Article.objects.create(article='Mouka', unit='kg')
+        self.milk = Article.objects.create(article='Mléko', unit='l')
+        self.pancakes = Recipe.objects.create(recipe='Palačinky', norm_amount=10)
+        self.potatoes = Recipe.objects.create(recipe='Brambory', norm_amount=10)
+        RecipeArticle.objects.create(recipe=self.pancakes, article=self.flour, amount=1, unit='kg')
+        RecipeArticle.objects.create(recipe=self.pancakes, article=self.milk, amount=1, unit='l')
+
+    def test_masks_follow_relations(self):
+        self.flour.allergen.add(self.gluten)
+        self.milk_allergen.article_set.add(self.milk)
+        self.pancakes.refresh_from_db()
+        self.assertEqual(self.pancakes.allergen_mask, self.gluten.mask | self.milk_allergen.mask)
+        self.assertEqual(self.pancakes.display_allergens(), '01, 07')
+        self.flour.allergen.clear()
+        RecipeArticle.objects.filter(article=self.milk).delete()
+        self.pancakes.refresh_from_db()
+        self.assertEqual(self.pancakes.display_allergens(), '-')
+
+    def test_deleted_allergen(self):
+        self.flour.allergen.add(self.gluten, self.milk_allergen)
+        self.gluten.delete()
+        self.flour.refresh_from_db()
+        self.assertEqual(self.flour.allergen_mask, self.milk_allergen.mask)
+
+    def test_recipes_without_allergens(self):
+        self.milk.allergen.add(self.milk_allergen)
+        recipes = Recipe.without_allergens(Recipe.objects.all(), [self.milk_allergen])
+        self.assertEqual(list(recipes), [self.potatoes])
+        recipes = Recipe.without_allergens(Recipe.objects.all(), [self.gluten])
+        self.assertEqual(list(recipes), [self.potatoes, self.pancakes])
+
+    def test_allergen_ids_fit_mask(self):
+        last = Allergen.objects.create(id=Allergen.MAX_ID, code='63', description='Poslední')
+        self.flour.allergen.add(last)
+        self.flour.refresh_from_db()
+        self.assertEqual(self.flour.allergen_mask, 1 << 62)
+        self.assertEqual(self.flour.display_allergens(), '63')
+        with self.assertRaisesMessage(ValidationError, 'alergeny mohou mít čísla jen 1 až 63'):
+            Allergen(code='64', description='Další').full_clean()
+        with self.assertRaises(ValidationError):
+            Allergen.objects.create(id=Allergen.MAX_ID + 1, code='64', description='Další')
+        self.assertFalse(Allergen.objects.filter(code='64').exists())
+
+
+class StockMovementTests(TestCase):
+    fixtures = ['skupiny.json']
+
+    def setUp(self):
+        self.user = UserFactory()
+        vat = VAT.objects.create(percentage=10, rate='Druhá snížená sazba DPH')
+        self.flour = Article.objects.create(article='Mouka', unit='kg', on_stock=10, total_price=200)
+        stock_receipt = StockReceipt.objects.create(user_created=self.user, comment='Makro')
+        StockReceiptArticle.objects.create(stock_receipt=stock_receipt, article=self.flour, amount=5, unit='kg',
+                                           price_without_vat=10, vat=vat)
+        stock_receipt.approve(self.user)
+        for amount in (1, 2):
+            stock_issue = StockIssue.objects.create(user_created=self.user, comment='Pro 01.03.2022')
+            StockIssueArticle.objects.create(stock_issue=stock_issue, article=self.flour, amount=amount, unit='kg')
+            stock_issue.approve(self.user)
+
+    def test_approvals_are_added_to_day_totals(self):
+        movement = StockMovement.objects.get()
+        self.assertEqual((movement.date, movement.article), (datetime.date.today(), self.flour))
+        self.assertEqual((movement.received_amount, movement.received_price), (Decimal('5.00'), Decimal('55.00')))
+        self.assertEqual((movement.issued_amount, movement.issued_price), (Decimal('3.00'), Decimal('51.00')))
+
+    def test_report(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/kitchen/report/showFoodConsumptionTotalPrice', {'months': 12, 'compare': 'on'})
+        self.assertEqual(response.status_code, 200)
+        all_data = response.context['all_data']
+        self.assertEqual(len(all_data), 12)
+        self.assertEqual((all_data[0]['stock_issues_count'], all_data[0]['stock_issues_price']), (2, Decimal('51.00')))
+        self.assertEqual((all_data[0]['stock_receipts_count'], all_data[0]['stock_receipts_price']),
+                         (1, Decimal('55.00')))
+        self.assertEqual(all_data[1]['stock_issues_price'], 0)
+        self.assertEqual(all_data[0]['previous_year']['stock_issues_count'], 0)
+
+
+class CateringUnitTests(TestCase):
+    fixtures = ['skupiny.json']
+
+    def setUp(self):
+        pancakes = Recipe.objects.create(recipe='Palačinky', norm_amount=10)
+        soup = Recipe.objects.create(recipe='Polévka', norm_amount=10)
+        Recipe.objects.filter(pk=pancakes.id).update(portion_price=Decimal('12.50'))
+        Recipe.objects.filter(pk=soup.id).update(portion_price=Decimal('8.00'))
+        meal_type = MealType.objects.create(meal_type='Oběd')
+        children = MealGroup.objects.create(meal_group='Studenti')
+        adults = MealGroup.objects.create(meal_group='Dospělí')
+        for date, meal_group, recipe, amount in (
+                (datetime.date(2022, 3, 1), children, pancakes, 20), (datetime.date(2022, 3, 1), adults, pancakes, 10),
+                (datetime.date(2022, 3, 3), children, soup, 5), (datetime.date(2022, 3, 8), adults, soup, 10)):
+            daily_menu = DailyMenu.objects.create(date=date, meal_group=meal_group, meal_type=meal_type)
+            DailyMenuRecipe.objects.create(daily_menu=daily_menu, recipe=recipe, amount=amount)
+
+    def test_catering_unit(self):
+        with self.assertNumQueries(1):
+            catering_unit = DailyMenuRecipe.catering_unit(datetime.date(2022, 2, 28), datetime.date(2022, 3, 6))
+        self.assertEqual([(recipe['recipe'], recipe['amount'], recipe['total_price'])
+                          for recipe in catering_unit['recipes']],
+                         [('Palačinky', 30, Decimal('375.00')), ('Polévka', 5, Decimal('40.00'))])
+        self.assertEqual([(meal_group['meal_group'], meal_group['amount'], meal_group['total_price'])
+                          for meal_group in catering_unit['meal_groups']],
+                         [('Dospělí', 10, Decimal('125.00')), ('Studenti', 25, Decimal('290.00'))])
+        self.assertEqual(catering_unit['total_price'], Decimal('415.00'))
+
+    def test_month(self):
+        self.client.force_login(UserFactory())
+        response = self.client.get('/kitchen/report/print/cateringunit', {'date': '15.03.2022', 'period': 'month'})
+        self.assertEqual(response.context['date'], '01.03.2022 - 31.03.2022')
+        self.assertEqual(response.context['daily_menu_recipes_total_price'], Decimal('495.00'))
+
+
+class IncorrectUnitsTests(TestCase):
+    fixtures = ['skupiny.json']
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_login(self.user)
+        flour = Article.objects.create(article='Mouka', unit='kg')
+        self.eggs = Article.objects.create(article='Vejce', unit='ks')
+        self.pancakes = Recipe.objects.create(recipe='Palačinky', norm_amount=10)
+        bread = Recipe.objects.create(recipe='Chléb', norm_amount=10)
+        RecipeArticle.objects.create(recipe=self.pancakes, article=flour, amount=500, unit='g')
+        RecipeArticle.objects.create(recipe=self.pancakes, article=self.eggs, amount=1, unit='kg')
+        RecipeArticle.objects.create(recipe=bread, article=flour, amount=1, unit='kg')
+        stock_issue = StockIssue.objects.create(user_created=self.user)
+        StockIssueArticle.objects.create(stock_issue=stock_issue, article=flour, amount=1, unit='l')
+        StockIssueArticle.objects.create(stock_issue=stock_issue, article=self.eggs, amount=1, unit='ks')
+
+    def test_incorrect_units(self):
+        response = self.client.get('/kitchen/report/incorrectunits')
+        self.assertEqual(list(response.context['object_list']), [self.pancakes])
+        self.assertEqual([stock_article.unit for stock_article in response.context['stock_issue_articles']], ['l'])
+        self.assertEqual(list(response.context['stock_receipt_articles']), [])
+
+
+class StatisticsTests(TestCase):
+
+    def setUp(self):
+        cache.delete(statistics.CACHE_KEY)
+        Article.objects.create(article='Mouka', unit='kg')
+        Article.objects.create(article='Mléko', unit='l')
+
+    def test_exact_counts(self):
+        counts, estimated = statistics.collect_statistics()
+        self.assertEqual(counts['article_count'], 2)
+        self.assertEqual(estimated, set())
+
+    def test_large_tables_are_estimated(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE kitchen_article')
+        counts, estimated = statistics.collect_statistics(exact_count_limit=1)
+        self.assertIn('article_count', estimated)
+        self.assertEqual(counts['article_count'], 2)
+
+    def test_statistics_are_cached(self):
+        self.assertEqual(statistics.get_statistics()['article_count'], 2)
+        Article.objects.create(article='Vejce', unit='ks')
+        with self.assertNumQueries(0):
+            self.assertEqual(statistics.get_statistics()['article_count'], 2)
+
+
+class ExportDataTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(UserFactory())
+        allergen = Allergen.objects.create(code='01', description='Lepek')
+        for i in range(5):
+            Article.objects.create(article='Zboží {}'.format(i), unit='kg').allergen.add(allergen)
+
+    def test_export_matches_dumpdata(self):
+        dumpdata = io.StringIO()
+        management.call_command('dumpdata', 'kitchen', stdout=dumpdata)
+        with patch('kicoma.kitchen.export.CHUNK_SIZE', 2):
+            response = self.client.get('/kitchen/export')
+            content = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename=data.json')
+        self.assertEqual(json.loads(content), json.loads(dumpdata.getvalue()))
+
+    def test_gzip_export(self):
+        response = self.client.get('/kitchen/export', {'compression': 'gzip'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename=data.json.gz')
+        objects = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual(len([obj for obj in objects if obj['model'] == 'kitchen.article']), 5)
+
+
+class SnapshotTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        allergen = Allergen.objects.create(code='01', description='Lepek')
+        self.flour = Article.objects.create(article='Mouka', unit='kg', on_stock=10, total_price=200)
+        self.flour.allergen.add(allergen)
+        self.flour.comment = 'Hladká, "výběrová"\nmouka'
+        self.flour.save()
+        StockIssue.objects.create(user_created=self.user, comment='Pro 01.03.2022')
+
+    def test_snapshot_and_restore(self):
+        f = io.BytesIO()
+        manifest = snapshot.create_snapshot(f)
+        rows = {table['model']: table['rows'] for table in manifest['tables']}
+        self.assertEqual((rows['kitchen.Article'], rows['kitchen.HistoricalArticle'], rows['kitchen.Article_allergen']),
+                         (1, 2, 1))
+        Article.objects.all().delete()
+        Article.objects.create(article='Mléko', unit='l')
+        f.seek(0)
+        snapshot.restore_snapshot(f)
+        flour = Article.objects.get()
+        self.assertEqual((flour.id, flour.comment, flour.on_stock), (self.flour.id, self.flour.comment, Decimal('10')))
+        self.assertEqual(flour.allergen.get().code, '01')
+        self.assertEqual(flour.history.count(), 2)
+        self.assertEqual(StockIssue.objects.get().user_created, self.user)
+        # sequences continue after the restored ids
+        self.assertGreater(Article.objects.create(article='Mléko', unit='l').id, self.flour.id)
+
+    def test_download_outside_request_transaction(self):
+        self.client.force_login(self.user)
+        atomic = []
+        create_snapshot = snapshot.create_snapshot
+
+        def record(fileobj):
+            atomic.append(connection.in_atomic_block)
+            return create_snapshot(fileobj)
+        with patch.dict(connection.settings_dict, ATOMIC_REQUESTS=True), \
+                patch('kicoma.kitchen.snapshot.create_snapshot', side_effect=record):
+            response = self.client.get('/kitchen/snapshot', {'download': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(atomic, [False])
+
+    def test_restore_rejects_other_migration(self):
+        f = io.BytesIO()
+        with patch('kicoma.kitchen.snapshot.last_migration', return_value='0001_initial'):
+            snapshot.create_snapshot(f)
+        f.seek(0)
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.restore_snapshot(f)
+        self.assertEqual(Article.objects.count(), 1)
+
+    # snapshot with the manifest entry of the articles changed by edit
+    def edited_snapshot(self, edit):
+        source = io.BytesIO()
+        snapshot.create_snapshot(source)
+        source.seek(0)
+        f = io.BytesIO()
+        with tarfile.open(fileobj=source, mode='r:gz') as archive, tarfile.open(fileobj=f, mode='w:gz') as edited:
+            for member in archive.getmembers():
+                content = archive.extractfile(member).read()
+                if member.name == snapshot.MANIFEST:
+                    manifest = json.loads(content)
+                    edit(next(table for table in manifest['tables'] if table['model'] == 'kitchen.Article'))
+                    content = json.dumps(manifest).encode()
+                snapshot.add_file(edited, member.name, io.BytesIO(content), len(content))
+        f.seek(0)
+        return f
+
+    def test_restore_uses_tables_of_models(self):
+        f = self.edited_snapshot(lambda table: table.update(table='users_user'))
+        snapshot.restore_snapshot(f)
+        self.assertEqual(Article.objects.get().article, 'Mouka')
+        f = self.edited_snapshot(lambda table: table['columns'].append('id") FROM STDIN; DROP TABLE users_user; --'))
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.restore_snapshot(f)
+        self.assertTrue(get_user_model().objects.filter(pk=self.user.pk).exists())
+
+
+class MergeImportTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(UserFactory())
+        self.allergen = Allergen.objects.create(code='01', description='Lepek')
+        self.flour = Article.objects.create(article='Mouka', unit='kg', on_stock=10, total_price=200)
+        self.flour.allergen.add(self.allergen)
+        self.milk = Article.objects.create(article='Mléko', unit='l')
+        self.objects = json.loads(''.join(export.export_json()))
+
+    def edited_objects(self):
+        objects = [obj for obj in self.objects
+                   if obj['pk'] != self.milk.id or obj['model'] != 'kitchen.article']
+        for obj in objects:
+            if obj['model'] == 'kitchen.article' and obj['pk'] == self.flour.id:
+                obj['fields']['article'] = 'Mouka hladká'
+                obj['fields']['allergen'] = []
+        objects.append({'model': 'kitchen.article', 'pk': 1000, 'fields': {
+            'article': 'Cukr', 'unit': 'kg', 'on_stock': '5.00', 'total_price': '100.00', 'comment': '',
+            'min_on_stock': '0.00', 'last_price': '20.00', 'allergen': [self.allergen.id],
+            'created': '2022-03-01T10:00:00Z', 'modified': '2022-03-01T10:00:00Z', 'allergen_mask': 0}})
+        return objects
+
+    def test_merge_import(self):
+        Article.objects.filter(id=self.flour.id).update(on_stock=5)
+        result = dataimport.merge_import(self.edited_objects)
+        self.assertEqual(result['kitchen.article'], {'inserted': 1, 'updated': 1, 'deleted': 1})
+        self.assertEqual(result['kitchen.allergen'], {'inserted': 0, 'updated': 0, 'deleted': 0})
+        flour = Article.objects.get(id=self.flour.id)
+        self.assertEqual((flour.article, flour.on_stock, flour.allergen.count()), ('Mouka hladká', 10, 0))
+        sugar = Article.objects.get(id=1000)
+        self.assertEqual(sugar.created, datetime.datetime(2022, 3, 1, 10, tzinfo=datetime.timezone.utc))
+        self.assertEqual(sugar.allergen_mask, self.allergen.mask)
+        self.assertFalse(Article.objects.filter(id=self.milk.id).exists())
+        # sequences continue after the imported ids
+        self.assertGreater(Article.objects.create(article='Sůl', unit='kg').id, 1000)
+
+    def test_rekeyed_row(self):
+        # Mouka deleted and created again with a new id, the recipe line follows it
+        recipe = Recipe.objects.create(recipe='Chléb', norm_amount=5)
+        RecipeArticle.objects.create(recipe=recipe, article=self.flour, amount=1, unit='kg')
+        objects = json.loads(''.join(export.export_json()))
+        for obj in objects:
+            if obj['model'] == 'kitchen.article' and obj['pk'] == self.flour.id:
+                obj['pk'] = 2000
+            elif obj['model'] == 'kitchen.recipearticle':
+                obj['fields']['article'] = 2000
+        result = dataimport.merge_import(lambda: objects)
+        self.assertEqual(result['kitchen.article'], {'inserted': 1, 'updated': 0, 'deleted': 1})
+        self.assertEqual(Article.objects.get(article='Mouka').id, 2000)
+        self.assertEqual(RecipeArticle.objects.get().article_id, 2000)
+
+    def test_unchanged_import(self):
+        result = dataimport.merge_import(lambda: self.objects)
+        self.assertFalse([label for label, counts in result.items() if any(counts.values())])
+
+    def test_import_view(self):
+        upload = SimpleUploadedFile('data.json.gz', gzip.compress(json.dumps(self.edited_objects()).encode()))
+        response = self.client.post('/kitchen/import', {'myfile': upload, 'mode': 'merge'})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(response.url, {'format': 'json'})
+        self.assertEqual(response.json()['state'], 'done')
+        self.assertEqual(response.json()['result']['kitchen.article']['inserted'], 1)
+        self.assertEqual(Article.objects.get(id=1000).article, 'Cukr')
+        response = self.client.get('/kitchen/import/unknown')
+        self.assertEqual(response.status_code, 302)
+
+
+class StreamingLoaderTests(TestCase):
+
+    def setUp(self):
+        allergen = Allergen.objects.create(code='01', description='Lepek')
+        for i in range(5):
+            Article.objects.create(article='Zboží {}'.format(i), unit='kg', comment='"[{}]",\n'.format(i)
+                                   ).allergen.add(allergen)
+        self.objects = json.loads(''.join(export.export_json()))
+
+    def write_file(self, content):
+        f = tempfile.NamedTemporaryFile(suffix='.json')
+        f.write(content)
+        f.flush()
+        self.addCleanup(f.close)
+        return f.name
+
+    def test_read_objects(self):
+        content = json.dumps(self.objects, indent=2).encode()
+        for data in (content, gzip.compress(content)):
+            with patch('kicoma.kitchen.dataimport.READ_SIZE', 7):
+                self.assertEqual(list(dataimport.read_objects(self.write_file(data))), self.objects)
+        self.assertEqual(list(dataimport.read_objects(self.write_file(b' [ ] '))), [])
+
+    def test_read_invalid_file(self):
+        for content in (b'{"model": "kitchen.article"}', b'[{"model": "kitchen.article"} {}]', b'[{"model": "kit'):
+            with self.assertRaises(dataimport.DataImportError):
+                list(dataimport.read_objects(self.write_file(content)))
+
+    def test_load_objects(self):
+        Article.objects.all().delete()
+        Allergen.objects.all().delete()
+        path = self.write_file(json.dumps(self.objects).encode())
+        with patch('kicoma.kitchen.dataimport.BATCH_SIZE', 2):
+            counts = dataimport.load_objects(dataimport.read_objects(path))
+        self.assertEqual((counts['kitchen.article'], counts['kitchen.allergen']), (5, 1))
+        self.assertEqual(json.loads(''.join(export.export_json())), self.objects)
+        self.assertEqual(Article.objects.filter(allergen_mask=Allergen.objects.get().mask).count(), 5)
+        with self.assertRaises(dataimport.DataImportError):
+            dataimport.load_objects([{'model': 'kitchen.unknown', 'pk': 1, 'fields': {}}])
+
+    def test_replace_view(self):
+        self.client.force_login(UserFactory())
+        upload = SimpleUploadedFile('data.json', json.dumps(self.objects).encode())
+        # the upload is saved to MEDIA_ROOT
+        with tempfile.TemporaryDirectory() as directory, override_settings(MEDIA_ROOT=directory):
+            response = self.client.post('/kitchen/import', {'myfile': upload, 'mode': 'replace'})
+        message = [str(message) for message in response.context['messages']][0]
+        self.assertIn('Nahráno {} objektů ze souboru data.json'.format(len(self.objects)), message)
+        self.assertEqual(Article.objects.count(), 5)
+
+
+class ArticleImportTests(TestCase):
+    fixtures = ['skupiny.json']
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_login(self.user)
+        self.allergen = Allergen.objects.create(code='01', description='Lepek')
+        self.flour = Article.objects.create(article='Mouka', unit='kg', on_stock=10, total_price=200)
+        self.milk = Article.objects.create(article='Mléko', unit='l', on_stock=4, total_price=100)
+        self.recipe = Recipe.objects.create(recipe='Palačinky', norm_amount=10)
+        RecipeArticle.objects.create(recipe=self.recipe, article=self.flour, amount=500, unit='g')
+        self.dataset = ArticleResource().export()
+
+    def set_value(self, article, column, value):
+        row = [row[self.dataset.headers.index('article')] for row in self.dataset].index(article)
+        values = list(self.dataset[row])
+        values[self.dataset.headers.index(column)] = value
+        self.dataset[row] = values
+
+    def test_import_articles(self):
+        self.set_value('Mouka', 'total_price', '400')
+        self.set_value('Mouka', 'allergen', str(self.allergen.id))
+        self.dataset.append(['', '', '', 'Cukr', 'kg', '5', '0', '100', '0', '', '0', ''])
+        result = dataimport.import_articles(self.dataset, self.user)
+        self.assertEqual(result['totals'], {'new': 1, 'update': 1, 'skip': 1, 'error': 0})
+        flour = next(row for row in result['rows'] if row['article'] == 'Mouka')
+        self.assertEqual(flour['changes'], {'total_price': (Decimal('200.00'), Decimal('400.00')),
+                                            'allergen': ([], [self.allergen.id])})
+        self.flour.refresh_from_db()
+        self.assertEqual((self.flour.total_price, self.flour.allergen_mask), (Decimal('400.00'), self.allergen.mask))
+        self.assertEqual(self.flour.history.count(), 2)
+        self.assertEqual(self.flour.history.first().history_user, self.user)
+        self.assertEqual(Article.objects.get(article='Cukr').history.get().history_type, '+')
+        self.assertEqual(self.milk.history.count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.total_price, Decimal('20.00'))
+
+    def test_invalid_rows_are_not_imported(self):
+        self.set_value('Mouka', 'total_price', '400')
+        self.set_value('Mléko', 'unit', 'x')
+        self.dataset.append(['', '', '', 'Mouka', 'kg', 'abc', '0', '100', '0', '99', '0', ''])
+        result = dataimport.import_articles(self.dataset)
+        self.assertEqual(result['totals']['error'], 2)
+        self.assertEqual(len(result['rows'][2]['errors']), 2)
+        self.flour.refresh_from_db()
+        self.assertEqual(self.flour.total_price, Decimal('200.00'))
+
+    def test_import_view(self):
+        self.set_value('Mléko', 'on_stock', 6)
+        upload = SimpleUploadedFile('zbozi.xlsx', self.dataset.export('xlsx'))
+        response = self.client.post('/kitchen/article/import', {'myfile': upload})
+        self.assertEqual([row['article'] for row in response.context['rows']], ['Mléko'])
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.on_stock, 6)
+
+
+class SpreadsheetExportTests(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_login(self.user)
+        allergen = Allergen.objects.create(code='01', description='Lepek')
+        stock_issue = StockIssue.objects.create(user_created=self.user, comment='Pro 01.03.2022')
+        for i in range(5):
+            article = Article.objects.create(article='Zboží {}'.format(i), unit='kg', on_stock=i, total_price=10 * i)
+            article.allergen.add(allergen)
+            StockIssueArticle.objects.create(stock_issue=stock_issue, article=article, amount=1, unit='kg')
+
+    def test_article_export(self):
+        with patch('kicoma.kitchen.export.CHUNK_SIZE', 2):
+            response = self.client.get('/kitchen/article/export')
+            content = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="seznam-zbozi.xlsx"')
+        dataset = Dataset().load(content, format='xlsx')
+        expected = Dataset().load(ArticleResource().export().xlsx, format='xlsx')
+        self.assertEqual(dataset.dict, expected.dict)
+
+    def test_csv_export_queries_do_not_grow(self):
+        # session, user and one cursor over the joined lines
+        with patch('kicoma.kitchen.export.CHUNK_SIZE', 2), self.assertNumQueries(3):
+            response = self.client.get('/kitchen/export/stockissuearticle', {'format': 'csv'})
+            content = b''.join(response.streaming_content).decode()
+        self.assertEqual(content, StockIssueArticleResource().export().csv)
+
+    def test_unknown_resource(self):
+        response = self.client.get('/kitchen/export/user')
+        self.assertEqual(response.status_code, 302)
+
+
+@unittest.skipIf(analytics.pyarrow is None, 'pyarrow is not installed')
+class AnalyticsExportTests(TestCase):
+    fixtures = ['skupiny.json']
+
+    def setUp(self):
+        self.user = UserFactory()
+        vat = VAT.objects.create(percentage=10, rate='Druhá snížená sazba DPH')
+        self.flour = Article.objects.create(article='Mouka', unit='kg', on_stock=10, total_price=200)
+        stock_receipt = StockReceipt.objects.create(user_created=self.user, comment='Makro')
+        StockReceiptArticle.objects.create(stock_receipt=stock_receipt, article=self.flour, amount=5, unit='kg',
+                                           price_without_vat=10, vat=vat)
+        stock_receipt.approve(self.user)
+        StockReceipt.objects.update(date_approved=datetime.date(2022, 3, 1))
+        self.issue(500)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def issue(self, amount):
+        stock_issue = StockIssue.objects.create(user_created=self.user, comment='Pro 01.03.2022')
+        StockIssueArticle.objects.create(stock_issue=stock_issue, article=self.flour, amount=amount, unit='g')
+        stock_issue.approve(self.user)
+
+    def read(self, dataset):
+        import pyarrow.parquet
+        return pyarrow.parquet.read_table(os.path.join(self.directory.name, dataset)).to_pylist()
+
+    def test_partitions_are_appended(self):
+        self.assertEqual(analytics.export_partitions('stockreceiptarticle', self.directory.name), (1, 1))
+        self.assertEqual(analytics.export_partitions('stockissuearticle', self.directory.name), (1, 1))
+        receipt = self.read('stockreceiptarticle')[0]
+        self.assertEqual((receipt['month'], receipt['amount'], receipt['price']),
+                         ('2022-03', Decimal('5.0000'), Decimal('55.00')))
+        self.assertEqual(self.read('stockissuearticle')[0]['amount'], Decimal('0.5000'))
+        self.issue(250)
+        self.assertEqual(analytics.export_partitions('stockissuearticle', self.directory.name), (1, 1))
+        self.assertEqual(sorted(row['amount'] for row in self.read('stockissuearticle')),
+                         [Decimal('0.2500'), Decimal('0.5000')])
+        self.assertEqual(analytics.export_partitions('stockreceiptarticle', self.directory.name), (0, 0))
+
+    def test_late_approval(self):
+        older = StockIssue.objects.create(user_created=self.user, comment='Pro 02.03.2022')
+        StockIssueArticle.objects.create(stock_issue=older, article=self.flour, amount=100, unit='g')
+        self.issue(250)
+        self.assertEqual(analytics.export_partitions('stockissuearticle', self.directory.name), (2, 1))
+        older.approve(self.user)
+        self.assertEqual(analytics.export_partitions('stockissuearticle', self.directory.name), (1, 1))
+        # editing an approved stock issue does not export its lines again
+        older.comment = 'Pro 03.03.2022'
+        older.save()
+        self.assertEqual(analytics.export_partitions('stockissuearticle', self.directory.name), (0, 0))
+        self.assertEqual(sorted(row['amount'] for row in self.read('stockissuearticle')),
+                         [Decimal('0.1000'), Decimal('0.2500'), Decimal('0.5000')])
+
+    def test_article_history(self):
+        management.call_command('export_analytics', self.directory.name, dataset=['historicalarticle'],
+                                stdout=io.StringIO())
+        history = self.read('historicalarticle')
+        self.assertEqual([row['on_stock'] for row in history], [Decimal('10.00'), Decimal('15.00'), Decimal('14.50')])
+
+    def test_endpoint(self):
+        import pyarrow.parquet
+        self.client.force_login(self.user)
+        response = self.client.get('/kitchen/analytics/stockissuearticle')
+        self.assertEqual(response['X-Rows'], '1')
+        table = pyarrow.parquet.read_table(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(table.column('amount').to_pylist(), [Decimal('0.5000')])
+        self.issue(250)
+        response = self.client.get('/kitchen/analytics/stockissuearticle',
+                                   {'after': response['X-Watermark'], 'format': 'arrow'})
+        self.assertEqual(response['X-Rows'], '1')
+
+
+class PDFCacheTests(TestCase):
+    fixtures = ['skupiny.json']
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_login(self.user)
+        self.flour = Article.objects.create(article='Mouka', unit='kg', on_stock=10, total_price=200)
+        self.stock_issue = StockIssue.objects.create(user_created=self.user, comment='Pro 01.03.2022')
+        StockIssueArticle.objects.create(stock_issue=self.stock_issue, article=self.flour, amount=1, unit='kg')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings = override_settings(PDF_CACHE_DIR=directory.name, PDF_CACHE_MAX_SIZE=25)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    @patch('kicoma.kitchen.pdf.convert_to_pdf', return_value=b'%PDF-1.4')
+    def test_same_page_is_rendered_once(self, convert_to_pdf):
+        url = '/kitchen/stockissue/print/{}'.format(self.stock_issue.id)
+        self.assertEqual(self.client.get(url).content, b'%PDF-1.4')
+        self.assertEqual(self.client.get(url).content, b'%PDF-1.4')
+        self.assertEqual(convert_to_pdf.call_count, 1)
+        StockIssueArticle.objects.update(amount=2)
+        self.client.get(url)
+        self.assertEqual(convert_to_pdf.call_count, 2)
+
+    def test_slow_rendering_is_picked_up_later(self):
+        rendered = threading.Event()
+        # a failed assertion must not leave the renderer thread waiting
+        self.addCleanup(rendered.set)
+        url = '/kitchen/stockissue/print/{}'.format(self.stock_issue.id)
+        convert_to_pdf = patch('kicoma.kitchen.pdf.convert_to_pdf',
+                               side_effect=lambda *args, **kwargs: rendered.wait() and b'%PDF')
+        # the wait is capped even with a long PDF_RENDER_TIMEOUT
+        wait = patch('kicoma.kitchen.pdf.MAX_RENDER_WAIT', 0.01)
+        with convert_to_pdf, wait, override_settings(PDF_RENDER_TIMEOUT=60):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 202)
+            job_url = response.context['url']
+            self.assertEqual(self.client.get(job_url).status_code, 202)
+            rendered.set()
+            for future in list(pdf._jobs.values()):
+                future.result()
+        response = self.client.get(job_url)
+        self.assertEqual((response.status_code, response.content), (200, b'%PDF'))
+        self.assertTrue(response['Content-Disposition'].startswith('attachment; filename="V?dejka-'))
+
+    @override_settings(PDF_RENDER_QUEUE_SIZE=0)
+    def test_full_queue(self):
+        response = self.client.get('/kitchen/stockissue/print/{}'.format(self.stock_issue.id))
+        self.assertEqual(response.status_code, 503)
+
+    @override_settings(PDF_RENDER_QUEUE_SIZE=0)
+    @patch('kicoma.kitchen.pdf.convert_to_pdf', return_value=b'%PDF')
+    def test_without_cache_rendered_in_request(self, convert_to_pdf):
+        with override_settings(PDF_CACHE_DIR=''):
+            response = self.client.get('/kitchen/stockissue/print/{}'.format(self.stock_issue.id))
+        self.assertEqual((response.status_code, response.content), (200, b'%PDF'))
+
+    def test_least_recently_used_are_evicted(self):
+        for i, key in enumerate(['aa1', 'bb2']):
+            pdf.cache_set(key, b'0123456789')
+            os.utime(pdf.cache_path(key), (i, i))
+        pdf.cache_get('aa1')
+        pdf.cache_set('cc3', b'0123456789')
+        self.assertIsNotNone(pdf.cache_get('aa1'))
+        self.assertIsNone(pdf.cache_get('bb2'))
+        self.assertIsNotNone(pdf.cache_get('cc3'))
+
+
+class PDFAssetsTests(TestCase):
+
+    def test_minify_css(self):
+        css = '/* PDF */\nbody {\n  font-size: x-small;\n}\n\n.a, .b > p {\n  margin: 0 1px;\n}\n'
+        self.assertEqual(pdf_assets.minify_css(css), 'body{font-size:x-small}.a,.b>p{margin:0 1px}')
+
+    def test_relative_urls_are_local_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, 'css'))
+            with open(os.path.join(directory, 'css', 'test.css'), 'w') as f:
+                f.write("@font-face { src: url('../fonts/a.ttf') }\nbody { background: url(data:image/png;base64,AA) }")
+            with patch('django.contrib.staticfiles.finders.find',
+                       side_effect=lambda path: os.path.join(directory, path)):
+                css = pdf_assets.compiled_stylesheet.__wrapped__('css/test.css')
+        self.assertIn('src:url("file://{}/fonts/a.ttf")'.format(directory), css)
+        self.assertIn('url(data:image/png;base64,AA)', css)
+
+    def test_collected_files_are_used_first(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(STATIC_ROOT=directory):
+            self.assertEqual(pdf_assets.static_path('css/pdf.css'), finders.find('css/pdf.css'))
+            os.makedirs(os.path.join(directory, 'css'))
+            with open(os.path.join(directory, 'css', 'pdf.css'), 'w') as f:
+                f.write('body { font-size: small; }')
+            self.assertEqual(pdf_assets.static_path('css/pdf.css'), os.path.join(directory, 'css', 'pdf.css'))
+            self.assertEqual(pdf_assets.compiled_stylesheet.__wrapped__('css/pdf.css'), 'body{font-size:small}')
+
+    def test_pdf_page_has_no_remote_assets(self):
+        user = UserFactory()
+        self.client.force_login(user)
+        stock_issue = StockIssue.objects.create(user_created=user, comment='Pro 01.03.2022')
+        response = self.client.get('/kitchen/stockissue/print/{}'.format(stock_issue.id), {'as': 'html'})
+        content = response.content.decode()
+        self.assertIn('<style type="text/css">body{font-size:x-small}', content)
+        self.assertNotIn('/static/', content)
+        self.assertNotIn('http', content)
+
+
+@unittest.skipIf(pdf_reportlab.pdfmetrics is None, 'reportlab is not installed')
+class ReportlabBackendTests(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_login(self.user)
+        flour = Article.objects.create(article='Mouka hladká', unit='kg', on_stock=10, total_price=200)
+        self.stock_issue = StockIssue.objects.create(user_created=self.user, comment='Pro 01.03.2022')
+        StockIssueArticle.objects.create(stock_issue=self.stock_issue, article=flour, amount=1, unit='kg',
+                                         average_unit_price=20, comment='Řádek\ns poznámkou')
+        self.url = '/kitchen/stockissue/print/{}'.format(self.stock_issue.id)
+
+    def test_parse_page(self):
+        blocks = pdf_reportlab.parse_page(self.client.get(self.url, {'as': 'html'}).content.decode())
+        self.assertEqual([kind for kind, _ in blocks], ['h1', 'table', 'h3', 'table', 'p'])
+        lines = blocks[3][1]
+        self.assertEqual(lines['header'], 1)
+        self.assertEqual(lines['rows'][1], ['Mouka hladká', '1,00 kg', '20,00 Kč', '20,00 Kč', 'Řádek s poznámkou'])
+
+    @patch('kicoma.kitchen.pdf.convert_to_pdf')
+    def test_backend_per_document(self, convert_to_pdf):
+        with override_settings(PDF_BACKENDS={'stockissue': 'reportlab'}):
+            response = self.client.get(self.url)
+        self.assertTrue(response.content.startswith(b'%PDF'))
+        convert_to_pdf.assert_not_called()
+
+    def test_benchmark(self):
+        out = io.StringIO()
+        management.call_command('benchmark_pdf', backend=['reportlab'], repeat=1, stdout=out)
+        self.assertRegex(out.getvalue(), r'stockissue reportlab: \d+\.\d ms, \d+ kB')
+        self.assertRegex(out.getvalue(), r'stocktake reportlab: \d+\.\d ms, \d+ kB')
+        self.assertNotIn('chyba', out.getvalue())
+
+    @patch('kicoma.kitchen.pdf.convert_to_pdf', return_value=b'%PDF')
+    def test_benchmark_wkhtmltopdf_options(self, convert_to_pdf):
+        out = io.StringIO()
+        management.call_command('benchmark_pdf', backend=['wkhtmltopdf'], repeat=1, stdout=out)
+        self.assertNotIn('chyba', out.getvalue())
+        self.assertIn('stockissue wkhtmltopdf: ', out.getvalue())
+
+
+class PDFBatchTests(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_login(self.user)
+        children = MealGroup.objects.create(meal_group='Děti')
+        lunch = MealType.objects.create(meal_type='Oběd')
+        pancakes = Recipe.objects.create(recipe='Palačinky', norm_amount=10)
+        bread = Recipe.objects.create(recipe='Chléb', norm_amount=5)
+        for day in (1, 2, 4):
+            daily_menu = DailyMenu.objects.create(date=datetime.date(2022, 3, day), meal_group=children,
+                                                  meal_type=lunch)
+            DailyMenuRecipe.objects.create(daily_menu=daily_menu, recipe=pancakes, amount=20)
+            DailyMenuRecipe.objects.create(daily_menu=daily_menu, recipe=bread, amount=day)
+        flour = Article.objects.create(article='Mouka', unit='kg', on_stock=10, total_price=200)
+        self.stock_issues = []
+        for amount in (1, 2):
+            stock_issue = StockIssue.objects.create(user_created=self.user, comment='Pro 0{}.03.2022'.format(amount))
+            StockIssueArticle.objects.create(stock_issue=stock_issue, article=flour, amount=amount, unit='kg',
+                                             average_unit_price=20)
+            self.stock_issues.append(stock_issue)
+
+    def page(self, url, query):
+        html = pdf.make_absolute_paths(self.client.get(url, dict(query, **{'as': 'html'})).content.decode())
+        return pdf.CACHE_IGNORE.sub('', html)
+
+    def test_daily_menus_are_loaded_at_once(self):
+        with self.assertNumQueries(2):
+            pages = pdf_batch.render_pages('dailymenu', datetime.date(2022, 3, 1), datetime.date(2022, 3, 3))
+        self.assertEqual([filename for filename, _ in pages],
+                         ['Denni_menu-2022-03-01.pdf', 'Denni_menu-2022-03-02.pdf'])
+        self.assertEqual(pdf.CACHE_IGNORE.sub('', pages[1][1][0]),
+                         self.page('/kitchen/dailymenu/print', {'date': '02.03.2022', 'meal_group': ''}))
+
+    def test_stock_issues_are_loaded_at_once(self):
+        with self.assertNumQueries(2):
+            pages = pdf_batch.render_pages('stockissue', ids=[stock_issue.id for stock_issue in self.stock_issues])
+        self.assertEqual(len(pages), 2)
+        for stock_issue, (filename, document_pages) in zip(self.stock_issues, pages):
+            self.assertEqual(filename, 'Výdejka-{}.pdf'.format(stock_issue.id))
+            self.assertEqual(pdf.CACHE_IGNORE.sub('', document_pages[0]),
+                             self.page('/kitchen/stockissue/print/{}'.format(stock_issue.id), {}))
+
+    @patch('kicoma.kitchen.pdf.convert_to_pdf',
+           side_effect=lambda filename, *args, **kwargs: b'%PDF ' + filename.encode())
+    def test_zip(self, convert_to_pdf):
+        response = self.client.get('/kitchen/print/dailymenu',
+                                   {'date_from': '01.03.2022', 'date_to': '04.03.2022', 'output': 'zip'})
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ['Denni_menu-2022-03-01.pdf', 'Denni_menu-2022-03-02.pdf',
+                                              'Denni_menu-2022-03-04.pdf'])
+        self.assertTrue(archive.read('Denni_menu-2022-03-04.pdf').startswith(b'%PDF '))
+        self.assertEqual(convert_to_pdf.call_count, 3)
+
+    def test_missing_range(self):
+        response = self.client.get('/kitchen/print/stockissue', {'output': 'zip'})
+        self.assertRedirects(response, '/kitchen/about', fetch_redirect_response=False)
+
+    @unittest.skipIf(pdf_batch.pypdf is None or pdf_reportlab.pdfmetrics is None, 'pypdf or reportlab is not installed')
+    @override_settings(PDF_BACKENDS={'stockissue': 'reportlab'})
+    def test_merged_pdf(self):
+        ids = ','.join(str(stock_issue.id) for stock_issue in self.stock_issues)
+        response = self.client.get('/kitchen/print/stockissue', {'ids': ids})
+        reader = pdf_batch.pypdf.PdfReader(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len(reader.pages), 2)
+
+    @unittest.skipIf(pdf_batch.pypdf is None or pdf_reportlab.pdfmetrics is None, 'pypdf or reportlab is not installed')
+    @override_settings(PDF_BACKENDS={'stockissue': 'reportlab'})
+    def test_command_in_worker_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'vydejky.pdf')
+            management.call_command('print_batch', 'stockissue', path, workers=2, stdout=io.StringIO(),
+                                    ids=[stock_issue.id for stock_issue in self.stock_issues])
+            self.assertEqual(len(pdf_batch.pypdf.PdfReader(path).pages), 2)
+
+    @override_settings(PDF_RENDER_QUEUE_SIZE=0)
+    def test_full_renderer(self):
+        response = self.client.get('/kitchen/print/dailymenu',
+                                   {'date_from': '01.03.2022', 'date_to': '04.03.2022', 'output': 'zip'})
+        self.assertEqual(response.status_code, 503)
+
+    @patch('kicoma.kitchen.pdf.convert_to_pdf', return_value=b'%PDF')
+    def test_command(self, convert_to_pdf):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'menu.zip')
+            out = io.StringIO()
+            management.call_command('print_batch', 'dailymenu', path, date_from=datetime.date(2022, 3, 1),
+                                    date_to=datetime.date(2022, 3, 7), stdout=out)
+            self.assertEqual(len(zipfile.ZipFile(path).namelist()), 3)
+        self.assertIn('Vytištěno dokumentů: 3', out.getvalue())
+
+
+class ArticlePDFContextTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(UserFactory())
+        for number in range(30):
+            Article.objects.create(article='Zboží {:02}'.format(number), unit='kg', on_stock=number % 3,
+                                   total_price=number, last_price=7)
+
+    def test_average_price(self):
+        self.assertEqual([row['average_price'] for row in Article.price_rows()],
+                         [article.average_price for article in Article.objects.order_by('article')])
+
+    def test_query_budget(self):
+        # session, user and the articles regardless of the number of articles
+        for url in ('/kitchen/article/print', '/kitchen/article/stockprint'):
+            with self.assertNumQueries(3):
+                response = self.client.get(url, {'as': 'html'})
+            self.assertContains(response, 'Zboží 29')
+        response = self.client.get('/kitchen/article/print', {'as': 'html'})
+        self.assertEqual(response.context['total_stock_price'], Article.sum_total_price())
+        self.assertContains(response, '14,50 Kč / kg')
@@ -1,10 +1,11 @@
+from django.db import transaction
 from django.urls import path
 from django.conf.urls import include
 from django.views.generic import RedirectView
 
 from .views import ArticleListView, ArticleRestrictedListView, ArticleHistoryDetailView, ArticleCreateView, \
     ArticleRestrictedUpdateView, ArticleUpdateView, ArticleDeleteView, \
-    ArticlePDFView, ArticleLackListView, ArticleExportView, ArticleImportView
+    ArticlePDFView, ArticleLackListView, ArticleExportView, ArticleImportView, ResourceExportView
 from .views import StockTakePDFView
 from .views import StockReceiptListView, StockReceiptCreateView, StockReceiptUpdateView, \
     StockReceiptDeleteView, StockReceiptPDFView, StockReceiptApproveView
@@ -27,7 +28,10 @@ from .views import DailyMenuRecipeListView, DailyMenuRecipeCreateView, DailyMenu
 from .views import IncorrectUnitsListView, ArticlesNotInRecipesListView, ShowFoodConsumptionTotalPrice, \
     CateringUnitFilterView, CateringUnitShowView
 
-from .views import about, changelog, docs, export_data, ImportDataView, set_language
+from .views import about, changelog, docs, export_data, export_analytics, print_batch, ImportDataView, \
+    ImportStatusView, SnapshotView, set_language
+
+from .pdf import PDFJobView
 
 app_name = "kitchen"
 urlpatterns = [
@@ -35,7 +39,14 @@ urlpatterns = [
     path('changelog', changelog, name='changelog'),
     path('docs', docs, name='docs'),
     path('export', export_data, name='export'),
+    path('export/<str:resource>', ResourceExportView.as_view(), name='exportResource'),
+    path('analytics/<str:dataset>', export_analytics, name='exportAnalytics'),
+    path('pdf/<str:key>', PDFJobView.as_view(), name='pdfJob'),
+    path('print/<str:document>', print_batch, name='printBatch'),
+    # the snapshot is copied in its own repeatable read transaction, also with ATOMIC_REQUESTS
+    path('snapshot', transaction.non_atomic_requests(SnapshotView.as_view()), name='snapshot'),
     path('import', ImportDataView.as_view(), name='import'),
+    path('import/<str:job_id>', ImportStatusView.as_view(), name='importStatus'),
     path('favicon.ico', RedirectView.as_view(url='/static/images/favicons/favicon.ico')),
     path('lang', set_language, name='lang'),
     path('i18n', include('django.conf.urls.i18n'), name='i18n'),
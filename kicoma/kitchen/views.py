@@ -1,5 +1,8 @@
 import logging
 import io
+import itertools
+import tarfile
+import tempfile
 from datetime import datetime
 from dateutil import relativedelta
 from contextlib import redirect_stdout
@@ -9,14 +12,14 @@ from django.core.files.storage import FileSystemStorage
 
 from django.urls import reverse_lazy
 from django.utils.safestring import mark_safe
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse, FileResponse, JsonResponse
 from django.contrib import messages
 from django.shortcuts import render, get_object_or_404
 from django.core.exceptions import ValidationError
 from django.conf import settings
 
-from django.db import transaction, connection
-from django.db.models import F, Count, Sum
+from django.db import transaction, DatabaseError
+from django.db.models import F
 
 from django.views.generic import DetailView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
@@ -26,19 +29,15 @@ from django.views.generic.base import TemplateView, View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 from django.contrib.messages.views import SuccessMessageMixin
-from django.contrib.auth.models import Group, ContentType, Permission
 
-from wkhtmltopdf.views import PDFTemplateView
 from django_tables2 import SingleTableMixin
 from django_filters.views import FilterView
 
 from tablib import Dataset
 
-from kicoma.users.models import User
-
-from .models import StockIssueArticle, StockReceiptArticle, Recipe, Allergen, MealType, MealGroup, \
-    VAT, Article, HistoricalArticle, RecipeArticle, StockIssue, StockReceipt, DailyMenu, Menu, MenuRecipe, \
-    DailyMenuRecipe
+from .models import StockIssueArticle, StockReceiptArticle, Recipe, Allergen, MealGroup, \
+    Article, RecipeArticle, StockIssue, StockReceipt, DailyMenu, Menu, MenuRecipe, \
+    DailyMenuRecipe, StockMovement
 
 from .tables import StockReceiptTable, StockReceiptArticleTable, StockReceiptFilter
 from .tables import StockIssueTable, StockIssueArticleTable, StockIssueFilter
@@ -55,7 +54,10 @@ from .forms import DailyMenuSearchForm, DailyMenuPrintForm, MenuForm, MenuRecipe
                    DailyMenuEditForm, DailyMenuRecipeForm
 from .forms import DailyMenuCateringUnitForm
 
-from .functions import convert_units
+from . import analytics, dataimport, export, pdf_batch, snapshot, spreadsheet
+from .pdf import CachedPDFTemplateView, RendererBusy, get_backend
+from .functions import convert_units, incorrect_units
+from .statistics import get_statistics
 
 from .admin import ArticleResource
 
@@ -64,86 +66,8 @@ logger = logging.getLogger(__name__)
 
 
 def about(request):
-    allergen_count = Allergen.objects.all().count()
-    meal_type_count = MealType.objects.all().count()
-    meal_group_count = MealGroup.objects.all().count()
-    vat_count = VAT.objects.all().count()
-    recipe_count = Recipe.objects.all().count()
-    recipe_article_count = RecipeArticle.objects.all().count()
-    article_count = Article.objects.all().count()
-    article_allergen_count = Article.objects.all().aggregate(count=Count('allergen'))['count']
-    historical_article_count = HistoricalArticle.objects.all().count()
-    stock_issue_count = StockIssue.objects.all().count()
-    stock_receipt_count = StockReceipt.objects.all().count()
-    stock_issue_article_count = StockIssueArticle.objects.all().count()
-    stock_receipt_article_count = StockReceiptArticle.objects.all().count()
-    daily_menu_count = DailyMenu.objects.all().count()
-    daily_menu_recipe_count = DailyMenuRecipe.objects.all().count()
-
-    user_count = User.objects.all().count()
-    group_count = Group.objects.all().count()
-
-    # service tables content
-    content_type_count = ContentType.objects.all().count()
-    permission_count = Permission.objects.all().count()
-    with connection.cursor() as cursor:
-        cursor.execute('select count(*) from django_migrations')
-        row = cursor.fetchone()
-        migration_count = row[0]
-
-    with connection.cursor() as cursor:
-        cursor.execute('select count(*) from django_session')
-        row = cursor.fetchone()
-        session_count = row[0]
-
-    with connection.cursor() as cursor:
-        cursor.execute('select count(*) from django_site')
-        row = cursor.fetchone()
-        site_count = row[0]
-
-    with connection.cursor() as cursor:
-        cursor.execute('select count(*) from users_user_groups')
-        row = cursor.fetchone()
-        user_group_rel_count = row[0]
-
-    total_records = allergen_count + meal_type_count + meal_group_count + \
-        vat_count + recipe_count + recipe_article_count + article_count + article_allergen_count + \
-        historical_article_count + stock_issue_count + stock_receipt_count + stock_issue_article_count + \
-        stock_receipt_article_count + daily_menu_count + daily_menu_recipe_count + user_count + group_count + \
-        content_type_count + permission_count + migration_count + session_count + site_count + user_group_rel_count
-
     logger.info("processing index")
-
-    return render(request, 'kitchen/about.html', {
-        'allergenCount': allergen_count,
-        'meal_typeCount': meal_type_count,
-        'mealGroupCount': meal_group_count,
-        'vatCount': vat_count,
-
-        'recipeCount': recipe_count,
-        'recipe_article_count': recipe_article_count,
-        'article_count': article_count,
-        'article_allergen_count': article_allergen_count,
-        'historical_article_count': historical_article_count,
-        'stockIssueCount': stock_issue_count,
-        'stockReceiptCount': stock_receipt_count,
-        'stock_issue_article_count': stock_issue_article_count,
-        'stock_receipt_article_count': stock_receipt_article_count,
-        'dailyMenuCount': daily_menu_count,
-        'dailyMenuRecipeCount': daily_menu_recipe_count,
-
-        "groupCount": group_count,
-        "userCount": user_count,
-
-        "content_type_count": content_type_count,
-        'permission_count': permission_count,
-        "migration_count": migration_count,
-        "session_count": session_count,
-        'site_count': site_count,
-        'user_group_rel_count': user_group_rel_count,
-
-        'total_records': total_records
-    })
+    return render(request, 'kitchen/about.html', get_statistics())
 
 
 def changelog(request):
@@ -156,14 +80,96 @@ def docs(request):
 
 @login_required
 def export_data(request):
-    file_name = 'data.json'
-    with open(file_name, "w") as f:
-        management.call_command('dumpdata', 'kitchen', exclude=['contenttypes', 'auth'], stdout=f)
+    # ?compression=gzip or zstd, the data are streamed without a temporary file
+    compression = request.GET.get('compression') or None
+    if compression not in export.available_compressions():
+        messages.error(request, "Nepodporovaná komprese: {}".format(compression))
+        return HttpResponseRedirect(reverse_lazy('kitchen:about'))
+    file_name = 'data.json' + export.COMPRESSIONS[compression]
+    response = StreamingHttpResponse(export.compress(export.export_json(), compression),
+                                     content_type='application/json' if compression is None
+                                     else 'application/octet-stream')
+    response['Content-Disposition'] = 'attachment; filename=' + file_name
+    return response
+
+
+# ?format=parquet or arrow, ?after=<watermark> returns only the rows since the export with this watermark
+@login_required
+def export_analytics(request, dataset):
+    file_format = request.GET.get('format', 'parquet')
+    after = request.GET.get('after') or None
+    f = tempfile.TemporaryFile()
+    try:
+        if after is not None and dataset in analytics.DATASETS:
+            after = analytics.DATASETS[dataset][2](after)
+        rows, watermark = analytics.export_file(dataset, f, file_format, after)
+    except (analytics.AnalyticsError, ValueError) as e:
         f.close()
-        response = HttpResponse(open(file_name, "rb"), content_type="application/json")
-        response['Content-Disposition'] = 'attachment; filename='+file_name
-        messages.success(request, "Všechna data byla exportována")
-        return response
+        messages.error(request, "Export pro analýzy se nezdařil: {}".format(e))
+        return HttpResponseRedirect(reverse_lazy('kitchen:about'))
+    f.seek(0)
+    response = FileResponse(f, as_attachment=True, filename=dataset + analytics.FORMATS[file_format],
+                            content_type='application/octet-stream')
+    response['X-Rows'] = rows
+    response['X-Watermark'] = '' if watermark is None else watermark
+    return response
+
+
+# ?date_from=dd.mm.yyyy&date_to=dd.mm.yyyy or ?ids=1,2,3 prints all documents at once,
+# ?output=pdf returns one merged PDF and ?output=zip streams a ZIP with a PDF of each document
+@login_required
+def print_batch(request, document):
+    output = request.GET.get('output', 'pdf')
+    try:
+        pdf_batch.check_output(output)
+        date_from, date_to = [datetime.strptime(request.GET[name], "%d.%m.%Y").date() if request.GET.get(name)
+                              else None for name in ('date_from', 'date_to')]
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk.strip()]
+        pages = pdf_batch.render_pages(document, date_from, date_to, ids, request.GET.get('meal_group'), request)
+        if not pages:
+            raise pdf_batch.BatchError('Pro zadaný výběr nejsou žádné dokumenty')
+        documents = pdf_batch.render_documents(pages, get_backend(document))
+        if output == 'zip':
+            # the first document is rendered before the response starts, so that a full renderer is reported
+            chunks = pdf_batch.zip_chunks(documents)
+            first = next(chunks)
+            response = StreamingHttpResponse(itertools.chain([first], chunks), content_type='application/zip')
+            response['Content-Disposition'] = 'attachment; filename="{}.zip"'.format(document)
+            return response
+        f = pdf_batch.merge_pdf(documents, tempfile.TemporaryFile())
+    except RendererBusy:
+        return HttpResponse('Tisk je přetížen, zkuste to prosím za chvíli znovu.', status=503)
+    except (pdf_batch.BatchError, ValueError) as e:
+        messages.error(request, "Hromadný tisk se nezdařil: {}".format(e))
+        return HttpResponseRedirect(reverse_lazy('kitchen:about'))
+    f.seek(0)
+    return FileResponse(f, as_attachment=True, filename=document + '.pdf', content_type='application/pdf')
+
+
+class SnapshotView(LoginRequiredMixin, TemplateView):
+    template_name = 'kitchen/snapshot.html'
+
+    def get(self, request, *args, **kwargs):
+        if 'download' not in request.GET:
+            return super().get(request, *args, **kwargs)
+        f = tempfile.TemporaryFile()
+        snapshot.create_snapshot(f)
+        f.seek(0)
+        file_name = 'kicoma-{}.tar.gz'.format(datetime.now().strftime('%Y%m%d-%H%M%S'))
+        return FileResponse(f, as_attachment=True, filename=file_name, content_type='application/gzip')
+
+    def post(self, request):
+        if len(request.FILES) == 0:
+            messages.error(self.request, "Není vybrán soubor se snímkem dat.")
+            return HttpResponseRedirect(reverse_lazy('kitchen:snapshot'))
+        try:
+            manifest = snapshot.restore_snapshot(request.FILES['snapshot'])
+        except (snapshot.SnapshotError, tarfile.TarError, DatabaseError) as e:
+            messages.error(self.request, "Snímek dat nebylo možné obnovit: {}".format(e))
+            return HttpResponseRedirect(reverse_lazy('kitchen:snapshot'))
+        messages.success(self.request, "Obnoveno {} záznamů ze snímku z {}".format(
+            sum(table['rows'] for table in manifest['tables']), manifest['created']))
+        return HttpResponseRedirect(reverse_lazy('kitchen:snapshot'))
 
 
 class ImportDataView(LoginRequiredMixin, TemplateView):
@@ -177,6 +183,12 @@ class ImportDataView(LoginRequiredMixin, TemplateView):
                 "Není vybrán vstupní soubor, použij tlačítko Browse a vyber soubor.")
             return super(ImportDataView, self).render_to_response(context)
         uploaded_file = request.FILES['myfile']
+        if request.POST.get('mode') == 'merge':
+            with tempfile.NamedTemporaryFile(delete=False) as f:
+                for chunk in uploaded_file.chunks():
+                    f.write(chunk)
+            job_id = dataimport.start_import_job(f.name)
+            return HttpResponseRedirect(reverse_lazy('kitchen:importStatus', kwargs={'job_id': job_id}))
         fs = FileSystemStorage()
         filename = fs.save(uploaded_file.name, uploaded_file)
         f = io.StringIO()
@@ -185,13 +197,27 @@ class ImportDataView(LoginRequiredMixin, TemplateView):
                 management.call_command('flush', interactive=False, verbosity=1)
                 management.call_command('loaddata', "./kicoma/kitchen/fixtures/skupiny.json", verbosity=1)
                 management.call_command('loaddata', "./kicoma/kitchen/fixtures/uzivatele.json", verbosity=1)
-                management.call_command('loaddata', fs.path(filename), verbosity=1)
-                messages.success(self.request, "Data úspěšně nahrána: "+f.getvalue())
+                counts = dataimport.load_objects(dataimport.read_objects(fs.path(filename)))
+            messages.success(self.request, "Data úspěšně nahrána: {}Nahráno {} objektů ze souboru {}".format(
+                f.getvalue(), sum(counts.values()), uploaded_file.name))
         except Exception as e:
             messages.success(self.request, "Chyba při výmazu dat před importem: "+str(e))
         return super(ImportDataView, self).render_to_response(context)
 
 
+class ImportStatusView(LoginRequiredMixin, TemplateView):
+    template_name = 'kitchen/import_status.html'
+
+    def get(self, request, *args, **kwargs):
+        job = dataimport.get_job(kwargs['job_id'])
+        if job is None:
+            messages.error(self.request, "Import nebyl nalezen.")
+            return HttpResponseRedirect(reverse_lazy('kitchen:import'))
+        if request.GET.get('format') == 'json':
+            return JsonResponse(job)
+        return self.render_to_response(self.get_context_data(job=job, **kwargs))
+
+
 def set_language(request):
     return render(request, 'kitchen/i18n.html')
 
@@ -276,7 +302,7 @@ class ArticleDeleteView(SuccessMessageMixin, LoginRequiredMixin, DeleteView):
         return super(ArticleDeleteView, self).delete(request, *args, **kwargs)
 
 
-class ArticlePDFView(LoginRequiredMixin, PDFTemplateView):
+class ArticlePDFView(LoginRequiredMixin, CachedPDFTemplateView):
     template_name = 'kitchen/article/pdf.html'
     filename = 'Seznam_zbozi.pdf'
     cmd_options = {
@@ -288,28 +314,46 @@ class ArticlePDFView(LoginRequiredMixin, PDFTemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['articles'] = Article.objects.all()
+        articles = Article.price_rows()
+        context['articles'] = articles
         context['title'] = "Seznam zboží na skladu"
-        context['total_stock_price'] = Article.sum_total_price()
+        total_stock_price = sum(article['total_price'] or 0 for article in articles)
+        context['total_stock_price'] = round(total_stock_price, 2)
         return context
 
 
 class ArticleExportView(LoginRequiredMixin, View):
 
-    def get(self):
-        data = ArticleResource().export()
-        response = HttpResponse(
-            data.xlsx, content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-        response['Content-Disposition'] = 'attachment; filename=seznam-zbozi.xlsx'
+    def get(self, request):
+        response = FileResponse(spreadsheet.export_xlsx(ArticleResource()), as_attachment=True,
+                                filename='seznam-zbozi.xlsx', content_type=spreadsheet.FORMATS['xlsx'])
         messages.success(self.request, "Seznam zboží byl exportován")
         return response
 
 
+class ResourceExportView(LoginRequiredMixin, View):
+
+    # ?format=xlsx or csv, csv is streamed while it is written
+    def get(self, request, resource):
+        resources = spreadsheet.get_resources()
+        file_format = request.GET.get('format', 'xlsx')
+        if resource not in resources or file_format not in spreadsheet.FORMATS:
+            messages.error(request, "Nepodporovaný export: {} {}".format(resource, file_format))
+            return HttpResponseRedirect(reverse_lazy('kitchen:about'))
+        file_name = '{}.{}'.format(resource, file_format)
+        if file_format == 'csv':
+            response = StreamingHttpResponse(spreadsheet.export_csv(resources[resource]()),
+                                             content_type=spreadsheet.FORMATS['csv'])
+            response['Content-Disposition'] = 'attachment; filename=' + file_name
+            return response
+        return FileResponse(spreadsheet.export_xlsx(resources[resource]()), as_attachment=True, filename=file_name,
+                            content_type=spreadsheet.FORMATS['xlsx'])
+
+
 class ArticleImportView(LoginRequiredMixin, TemplateView):
     template_name = 'kitchen/article/import.html'
 
     def post(self, request, **kwargs):
-        article_resource = ArticleResource()
         dataset = Dataset()
         context = {}  # set your context
         if len(request.FILES) == 0:
@@ -318,18 +362,20 @@ class ArticleImportView(LoginRequiredMixin, TemplateView):
                 "Není vybrán vstupní soubor, použij tlačítko Browse a vyber exportovaný a upravený MS Excel soubor.")
             return super(ArticleImportView, self).render_to_response(context)
         new_articles = request.FILES['myfile']
-        imported_data = dataset.load(new_articles.read())
-        result = article_resource.import_data(imported_data, dry_run=True,
-                                              collect_failed_rows=True)  # Test the data import
-        if result.has_errors() or result.has_validation_errors():
-            messages.error(self.request, "Chyba v průběhu importu. Chybná data: {}".format(result.failed_dataset))
+        try:
+            result = dataimport.import_articles(dataset.load(new_articles.read()), request.user)
+        except dataimport.DataImportError as e:
+            messages.error(self.request, "Chyba v průběhu importu: {}".format(e))
+            return super(ArticleImportView, self).render_to_response(context)
+        totals = result['totals']
+        if totals['error']:
+            messages.error(self.request, "Chyba v průběhu importu, nic nebylo importováno. Chybných řádků: {}"
+                           .format(totals['error']))
         else:
-            article_resource.import_data(imported_data, dry_run=False)  # Actually import now
             messages.success(self.request, "Seznam zboží byl importován. Importováno {} řádků, z toho {} vloženo, \
-                {} aktualizováno, {} vymazáno, {} přeskočeno, {} s chybou a {} neplatných řádků"
-                             .format(result.total_rows, result.totals['new'], result.totals['update'],
-                                     result.totals['delete'], result.totals['skip'], result.totals['error'],
-                                     result.totals['invalid']))
+                {} aktualizováno a {} přeskočeno"
+                             .format(len(result['rows']), totals['new'], totals['update'], totals['skip']))
+        context['rows'] = [row for row in result['rows'] if row['status'] != 'skip']
         return super(ArticleImportView, self).render_to_response(context)
 
 
@@ -344,13 +390,14 @@ class ArticleHistoryDetailView(LoginRequiredMixin, DetailView):
         return context
 
 
-class StockTakePDFView(LoginRequiredMixin, PDFTemplateView):
+class StockTakePDFView(LoginRequiredMixin, CachedPDFTemplateView):
     template_name = 'kitchen/stocktake/pdf.html'
+    pdf_document = 'stocktake'
     filename = 'Seznam_zbozi_na_skladu.pdf'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['articles'] = Article.objects.all()
+        context['articles'] = Article.objects.order_by('article').values('article', 'unit')
         context['title'] = "Seznam zboží na skladu ke kontrole"
         return context
 
@@ -396,7 +443,7 @@ class RecipeDeleteView(SuccessMessageMixin, LoginRequiredMixin, DeleteView):
         return super(RecipeDeleteView, self).delete(request, *args, **kwargs)
 
 
-class RecipeListPDFView(LoginRequiredMixin, PDFTemplateView):
+class RecipeListPDFView(LoginRequiredMixin, CachedPDFTemplateView):
     template_name = 'kitchen/recipe/pdf_list.html'
     filename = 'Seznam_receptu.pdf'
 
@@ -408,7 +455,7 @@ class RecipeListPDFView(LoginRequiredMixin, PDFTemplateView):
         return context
 
 
-class RecipePDFView(LoginRequiredMixin, PDFTemplateView):
+class RecipePDFView(LoginRequiredMixin, CachedPDFTemplateView):
     template_name = 'kitchen/recipe/pdf.html'
     filename = 'Recept.pdf'
 
@@ -570,8 +617,9 @@ class DailyMenuDeleteView(SuccessMessageMixin, LoginRequiredMixin, DeleteView):
         return super(DailyMenuDeleteView, self).delete(request, *args, **kwargs)
 
 
-class DailyMenuPDFView(LoginRequiredMixin, PDFTemplateView):
+class DailyMenuPDFView(LoginRequiredMixin, CachedPDFTemplateView):
     template_name = 'kitchen/dailymenu/pdf.html'
+    pdf_document = 'dailymenu'
     filename = 'Denni_menu.pdf'
 
     def get(self, request, *args, **kwargs):
@@ -594,6 +642,11 @@ class DailyMenuPDFView(LoginRequiredMixin, PDFTemplateView):
                 daily_menu__date=datetime.strptime(date, "%d.%m.%Y"), daily_menu__meal_group=meal_group)
             context['meal_group_filter'] = "Filtrováno pro skupinu strávníků: " + \
                 MealGroup.objects.filter(pk=meal_group).get().meal_group
+        daily_menu_recipes = daily_menu_recipes.select_related(
+            'daily_menu__meal_group', 'daily_menu__meal_type', 'recipe')
+        allergen_codes = Allergen.get_codes()
+        for daily_menu_recipe in daily_menu_recipes:
+            daily_menu_recipe.allergens = daily_menu_recipe.recipe.display_allergens(allergen_codes)
         context['title'] = "Denní menu pro " + date
         context['daily_menu_recipes'] = daily_menu_recipes
         return context
@@ -811,6 +864,7 @@ class DailyMenuRecipeDeleteView(SuccessMessageMixin, LoginRequiredMixin, DeleteV
 
 class StockIssueListView(SingleTableMixin, LoginRequiredMixin, FilterView):
     model = StockIssue
+    queryset = StockIssue.objects.with_totals()
     table_class = StockIssueTable
     template_name = 'kitchen/stockissue/list.html'
     filterset_class = StockIssueFilter
@@ -908,8 +962,9 @@ class StockIssueDeleteView(SuccessMessageMixin, LoginRequiredMixin, DeleteView):
         return super(StockIssueDeleteView, self).post(request, *args, **kwargs)
 
 
-class StockIssuePDFView(SuccessMessageMixin, LoginRequiredMixin, PDFTemplateView):
+class StockIssuePDFView(SuccessMessageMixin, LoginRequiredMixin, CachedPDFTemplateView):
     template_name = 'kitchen/stockissue/pdf.html'
+    pdf_document = 'stockissue'
     filename = 'Výdejka-' + datetime.now().strftime("%Y.%m.%d_%H-%M-%S-%f") + '.pdf'
 
     def get_context_data(self, **kwargs):
@@ -947,20 +1002,13 @@ class StockIssueApproveView(LoginRequiredMixin, TemplateView):
             messages.warning(
                 self.request, 'Vyskladnění neprovedeno - nulová cena zboží, je zboží naskladněno?')
             return HttpResponseRedirect(reverse_lazy('kitchen:showStockIssues',))
-        with transaction.atomic():
-            stock_issue.approved = True
-            stock_issue.date_approved = datetime.now()
-            stock_issue.user_approved = self.request.user
-            StockIssue.update_stock_issue_article_average_unit_price(stock_issue.id)
-            errors = StockIssue.update_article_on_stock(stock_issue.id, stock_issue.comment, True)
-            if errors:
-                errors = "Níže uvedené zboží není možné vyskladnit:<br/>" + errors
-                messages.error(self.request, mark_safe(errors))
-                return HttpResponseRedirect(reverse_lazy('kitchen:approveStockIssue', kwargs={'pk': self.kwargs['pk']}))
-            _ = StockIssue.update_article_on_stock(stock_issue.id, stock_issue.comment, False)
-            stock_issue.save(update_fields=('approved', 'date_approved', 'user_approved',))
-            messages.success(self.request, "Výdejka byla vyskladněna")
-            return HttpResponseRedirect(reverse_lazy('kitchen:showStockIssues',))
+        errors = stock_issue.approve(self.request.user)
+        if errors:
+            errors = "Níže uvedené zboží není možné vyskladnit:<br/>" + errors
+            messages.error(self.request, mark_safe(errors))
+            return HttpResponseRedirect(reverse_lazy('kitchen:approveStockIssue', kwargs={'pk': self.kwargs['pk']}))
+        messages.success(self.request, "Výdejka byla vyskladněna")
+        return HttpResponseRedirect(reverse_lazy('kitchen:showStockIssues',))
 
 
 class StockIssueArticleListView(SingleTableMixin, LoginRequiredMixin, FilterView):
@@ -1069,6 +1117,7 @@ class StockIssueArticleDeleteView(SuccessMessageMixin, LoginRequiredMixin, Delet
 
 class StockReceiptListView(SingleTableMixin, LoginRequiredMixin, FilterView):
     model = StockReceipt
+    queryset = StockReceipt.objects.with_totals()
     table_class = StockReceiptTable
     template_name = 'kitchen/stockreceipt/list.html'
     filterset_class = StockReceiptFilter
@@ -1122,8 +1171,9 @@ class StockReceiptDeleteView(SuccessMessageMixin, LoginRequiredMixin, DeleteView
         return super(StockReceiptDeleteView, self).post(request, *args, **kwargs)
 
 
-class StockReceiptPDFView(LoginRequiredMixin, PDFTemplateView):
+class StockReceiptPDFView(LoginRequiredMixin, CachedPDFTemplateView):
     template_name = 'kitchen/stockreceipt/pdf.html'
+    pdf_document = 'stockreceipt'
     filename = 'Příjemka.pdf'
 
     def get_context_data(self, **kwargs):
@@ -1156,17 +1206,11 @@ class StockReceiptApproveView(LoginRequiredMixin, TemplateView):
         if stock_receipt.approved:
             messages.warning(self.request, 'Naskladnění neprovedeno - již bylo naskladněno')
             return HttpResponseRedirect(reverse_lazy('kitchen:showStockReceipts',))
-        if stock_receipt.total_price <= 0:
+        if stock_receipt.approve(self.request.user) <= 0:
             messages.warning(
                 self.request, 'Naskladnění neprovedeno - nulová cena zboží, přidejte alespoň jedno zboží na příjemku')
             return HttpResponseRedirect(reverse_lazy('kitchen:showStockReceipts',))
-        with transaction.atomic():
-            stock_receipt.approved = True
-            stock_receipt.date_approved = datetime.now()
-            stock_receipt.user_approved = self.request.user
-            StockReceipt.update_article_on_stock(stock_receipt.id, stock_receipt.comment)
-            stock_receipt.save(update_fields=('approved', 'date_approved', 'user_approved',))
-            messages.success(self.request, "Příjemka byla naskladněna")
+        messages.success(self.request, "Příjemka byla naskladněna")
         return HttpResponseRedirect(reverse_lazy('kitchen:showStockReceipts',))
 
 
@@ -1279,42 +1323,32 @@ class StockReceiptArticleDeleteView(SuccessMessageMixin, LoginRequiredMixin, Del
         return super(StockReceiptArticleDeleteView, self).delete(request, *args, **kwargs)
 
 
-def stock_issues_receipts_data(month):
-    month = datetime.now() + relativedelta.relativedelta(months=-month)
-    month_year = month.year
-    month_month = month.month
-    stock_issues = StockIssue.objects.filter(
-        date_approved__year=month_year, date_approved__month=month_month)
-    stock_receipts = StockReceipt.objects.filter(
-        date_approved__year=month_year, date_approved__month=month_month)
-    stock_issues_price = -1
-    for si in stock_issues:
-        stock_issues_price += si.total_price
-    stock_receipts_price = -1
-    for sr in stock_receipts:
-        stock_receipts_price += sr.total_price
-    return {
-        'year': month_year,
-        'month': month_month,
-        'stock_issues_count': stock_issues.count(),
-        'stock_issues_price': stock_issues_price,
-        'stock_receipts_count': stock_receipts.count(),
-        'stock_receipts_price': stock_receipts_price
-    }
-
-
 class ShowFoodConsumptionTotalPrice(LoginRequiredMixin, TemplateView):
     template_name = 'kitchen/report/show_stock_issues_receipts_total_price.html'
+    month_choices = (3, 6, 12, 24)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-
-        context['all_data'] = [
-            stock_issues_receipts_data(0),
-            stock_issues_receipts_data(1),
-            stock_issues_receipts_data(2),
-        ]
-
+        months = self.request.GET.get('months', '3')
+        months = int(months) if months.isdigit() and int(months) in self.month_choices else 3
+        compare = 'compare' in self.request.GET
+        today = datetime.now().date()
+        first_month = today.replace(day=1) + relativedelta.relativedelta(months=-(months - 1))
+        date_from = first_month + relativedelta.relativedelta(years=-1) if compare else first_month
+        totals = StockMovement.monthly_totals(date_from, today)
+        all_data = []
+        for i in range(months):
+            month = today.replace(day=1) + relativedelta.relativedelta(months=-i)
+            data = {'year': month.year, 'month': month.month}
+            data.update(totals.get(month, StockMovement.empty_totals()))
+            if compare:
+                data['previous_year'] = totals.get(month + relativedelta.relativedelta(years=-1),
+                                                   StockMovement.empty_totals())
+            all_data.append(data)
+        context['all_data'] = all_data
+        context['months'] = months
+        context['month_choices'] = self.month_choices
+        context['compare'] = compare
         return context
 
 
@@ -1324,17 +1358,16 @@ class IncorrectUnitsListView(SingleTableMixin, LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         # show only recipes where article unit cannot be converted to stock article unit
-        recipes = super().get_queryset()
-        incorrect_recipes = set()
-        for recipe in recipes:
-            recipe_articles = RecipeArticle.objects.filter(recipe=recipe)
-            for recipe_article in recipe_articles:
-                try:
-                    convert_units(recipe_article.amount,
-                                  recipe_article.unit, recipe_article.article.unit)
-                except ValidationError:
-                    incorrect_recipes.add(recipe.pk)
-        return Recipe.objects.filter(pk__in=incorrect_recipes)
+        recipe_articles = RecipeArticle.objects.filter(incorrect_units('unit', 'article__unit'))
+        return Recipe.objects.filter(pk__in=recipe_articles.values('recipe'))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['stock_issue_articles'] = StockIssueArticle.objects.filter(
+            incorrect_units('unit', 'article__unit')).select_related('article', 'stock_issue')
+        context['stock_receipt_articles'] = StockReceiptArticle.objects.filter(
+            incorrect_units('unit', 'article__unit')).select_related('article', 'stock_receipt')
+        return context
 
 
 class ArticlesNotInRecipesListView(SingleTableMixin, LoginRequiredMixin, ListView):
@@ -1355,30 +1388,24 @@ class CateringUnitShowView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         date = self.request.GET['date']
-        daily_menu_ids = DailyMenu.objects.filter(date=datetime.strptime(date, "%d.%m.%Y")).values('id')
-        daily_menu_recipes = DailyMenuRecipe.objects.filter(daily_menu__in=daily_menu_ids)
-        recipes = Recipe.objects.filter(id__in=daily_menu_recipes.values('recipe'))
-
-        output = []
-        total_price = 0
-        for recipe in recipes:
-            daily_menu_recipes = DailyMenuRecipe.objects.filter(
-                daily_menu__in=daily_menu_ids
-            ).filter(recipe=recipe).values('recipe').annotate(amount=Sum('amount'))[0]
-            unit_price = recipe.total_recipe_articles_price / recipe.norm_amount
-            output_new = {
-                "recipe": recipe.recipe,
-                "unit_price": unit_price,
-                "amount": daily_menu_recipes['amount'],
-                "total_price": unit_price * daily_menu_recipes['amount']
-            }
-            output.append(output_new)
-            total_price += unit_price * daily_menu_recipes['amount']
-
-        context['date'] = date
-        context['daily_menu_recipes'] = output
-        context['daily_menu_recipes_total'] = len(output)
-        context['daily_menu_recipes_total_price'] = total_price
+        period = self.request.GET.get('period', 'day')
+        date_from = date_to = datetime.strptime(date, "%d.%m.%Y").date()
+        if period == 'week':
+            date_from = date_from - relativedelta.relativedelta(days=date_from.weekday())
+            date_to = date_from + relativedelta.relativedelta(days=6)
+        elif period == 'month':
+            date_from = date_from.replace(day=1)
+            date_to = date_from + relativedelta.relativedelta(months=1, days=-1)
+        catering_unit = DailyMenuRecipe.catering_unit(date_from, date_to)
+
+        if date_from == date_to:
+            context['date'] = date
+        else:
+            context['date'] = date_from.strftime("%d.%m.%Y") + ' - ' + date_to.strftime("%d.%m.%Y")
+        context['daily_menu_recipes'] = catering_unit['recipes']
+        context['meal_groups'] = catering_unit['meal_groups']
+        context['daily_menu_recipes_total'] = len(catering_unit['recipes'])
+        context['daily_menu_recipes_total_price'] = catering_unit['total_price']
         return context
 
 